@@ -0,0 +1,26 @@
+import re
+
+
+class AggMethod:
+    """Resolve aggregation methods of records to their names and quantiles."""
+
+    QUANTILES = {"median": 0.5, "first_quartile": 0.25, "third_quartile": 0.75}
+    PATTERN_PERCENTILE = re.compile(r"^percentile_(\d+)$")
+
+    @staticmethod
+    def get_name(method) -> str:
+        """Name a method given by name or as a function like DataFrame.agg."""
+        return method if isinstance(method, str) else method.__name__
+
+    @staticmethod
+    def get_quantile(name: str) -> float | None:
+        """
+        Get the quantile of an order statistic, e.g. 0.25 of first_quartile
+        and 0.9 of percentile_90, None if the method is not a quantile.
+        """
+        if name in AggMethod.QUANTILES:
+            return AggMethod.QUANTILES[name]
+        match_percentile = AggMethod.PATTERN_PERCENTILE.match(name)
+        if match_percentile is not None:
+            return int(match_percentile.group(1)) / 100
+        return None
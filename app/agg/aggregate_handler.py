@@ -1,13 +1,18 @@
 import ast
 import csv
 import os
+import numpy as np
 import pandas as pd
 import logging
 import warnings
+from app.agg.agg_method import AggMethod
+from app.deduplicated_kpis import DeduplicatedKpis
 
 
 class AggregateHandler:
     COL_KPI_INDEX = "kpi_index"
+    # parsed aggregation records and the signature of their file by path
+    _aggregations = {}
 
     def __init__(
         self,
@@ -23,14 +28,34 @@ class AggregateHandler:
         self.df_kpi_map = df_kpi_map
         self.df_metric = df_metric
         self.enforce_existing_aggregations = enforce_existing_aggregations
-        self.path_aggregations = os.path.join("aggregations", f"{handler_name}.csv")
-        self.aggregations = pd.read_csv(self.path_aggregations)
-        self.aggregations["groups"] = self.aggregations["groups"].apply(
-            ast.literal_eval
-        )
-        self.aggregations["methods"] = self.aggregations["methods"].apply(
-            ast.literal_eval
+        self.path_aggregations = AggregateHandler.build_path_aggregations(handler_name)
+        self.aggregations = AggregateHandler.read_aggregations(handler_name)
+
+    @staticmethod
+    def build_path_aggregations(handler_name: str) -> str:
+        return os.path.join("aggregations", f"{handler_name}.csv")
+
+    @staticmethod
+    def read_aggregations(handler_name: str) -> pd.DataFrame:
+        """
+        Read aggregation records of a handler with parsed groups and methods.
+
+        Records are parsed again whenever the size or modification time of the
+        file changed, so records appended by this or other processes are seen.
+        """
+        path_aggregations = os.path.abspath(
+            AggregateHandler.build_path_aggregations(handler_name)
         )
+        stat = os.stat(path_aggregations)
+        signature = (stat.st_size, stat.st_mtime_ns)
+        cached = AggregateHandler._aggregations.get(path_aggregations)
+        if cached is not None and cached[0] == signature:
+            return cached[1].copy()
+        aggregations = pd.read_csv(path_aggregations)
+        aggregations["groups"] = aggregations["groups"].apply(ast.literal_eval)
+        aggregations["methods"] = aggregations["methods"].apply(ast.literal_eval)
+        AggregateHandler._aggregations[path_aggregations] = (signature, aggregations)
+        return aggregations.copy()
 
     def record_new_aggregation(
         self, index: int, name: str, groups: list, methods: list
@@ -84,77 +109,100 @@ class AggregateHandler:
                     index = agg_methods.index(name)
                     agg_methods[index] = func
 
+        if isinstance(df_metric_to_agg, pd.DataFrame):
+            # aggregate identical KPIs once weighted by their number of copies
+            deduplicated_kpis = DeduplicatedKpis.from_frame(df_metric_to_agg)
+            if deduplicated_kpis is not None:
+                df_metric_to_agg = deduplicated_kpis
         with warnings.catch_warnings():
             warnings.simplefilter("ignore", category=RuntimeWarning)
             return df_metric_to_agg.agg(agg_methods, axis=1)
 
     def aggregate_with_groups(self, group_columns: list, agg_methods: list = None):
-        df_kpi_indices = self.df_kpi_map.groupby(group_columns).agg(
-            lambda s: s.to_list()
-        )
+        # group on category codes without unobserved combinations of labels
+        df_kpi_indices = self.df_kpi_map.groupby(group_columns, observed=True)[
+            [AggregateHandler.COL_KPI_INDEX]
+        ].agg(lambda s: s.to_list())
+        column_prefixes = AggregateHandler.gen_column_prefixes(df_kpi_indices)
         list_df_agg_metric = []
-        for index in df_kpi_indices.index:
-            kpi_indices_to_agg = df_kpi_indices.loc[
-                index, AggregateHandler.COL_KPI_INDEX
-            ]
+        columns = []
+        for column_prefix, kpi_indices_to_agg in zip(
+            column_prefixes, df_kpi_indices[AggregateHandler.COL_KPI_INDEX]
+        ):
             if self.is_distribution():
                 for m in ["count", "mean", "sum_of_squared_deviation"]:
                     kpi_columns_to_agg = [f"kpi-{i}-{m}" for i in kpi_indices_to_agg]
-                    df_metric_to_agg = self.df_metric[kpi_columns_to_agg]
-                    column_prefix = (
-                        AggregateHandler.gen_column_prefix(index, df_kpi_indices)
-                        + "distribut_"
-                        + m
-                        + "-"
+                    df_agg_metric = self.apply_aggregation(
+                        self.df_metric[kpi_columns_to_agg], agg_methods
                     )
-                    list_df_agg_metric.append(
-                        self.apply_aggregation(
-                            df_metric_to_agg, agg_methods
-                        ).add_prefix(column_prefix)
+                    list_df_agg_metric.append(df_agg_metric)
+                    columns.extend(
+                        column_prefix + "distribut_" + m + "-" + df_agg_metric.columns
                     )
             else:
                 kpi_columns_to_agg = [f"kpi-{i}-value" for i in kpi_indices_to_agg]
-                df_metric_to_agg = self.df_metric[kpi_columns_to_agg]
-
-                list_df_agg_metric.append(
-                    self.apply_aggregation(df_metric_to_agg, agg_methods).add_prefix(
-                        AggregateHandler.gen_column_prefix(index, df_kpi_indices)
-                    )
+                df_agg_metric = self.apply_aggregation(
+                    self.df_metric[kpi_columns_to_agg], agg_methods
                 )
-        return pd.concat(list_df_agg_metric, axis=1)
+                list_df_agg_metric.append(df_agg_metric)
+                columns.extend(column_prefix + df_agg_metric.columns)
+        # name columns once instead of copying each group with add_prefix
+        df_agg_metric = pd.concat(list_df_agg_metric, axis=1)
+        df_agg_metric.columns = columns
+        return df_agg_metric
 
     def gen_map_columns(self, target_column: str = None) -> dict:
         if len(self.df_kpi_map) == 1:
             return {"kpi-0-value": "kpi-value"}
         df_kpi_map = self.df_kpi_map.set_index("kpi_index")
-        map_columns = {}
-        for kpi_index in df_kpi_map.index:
-            original_column_name = f"kpi-{kpi_index}-value"
-            # find distinguished words from KPI map as KPI names
-            if target_column is None:
-                map_columns[original_column_name] = "-".join(
-                    list(
-                        (
-                            name.upper() + "-" + str(value).lower()
-                            for name, value in df_kpi_map.loc[kpi_index]
-                            .to_dict()
-                            .items()
-                        )
-                    )
-                )
-            else:
-                map_columns[original_column_name] = df_kpi_map.loc[
-                    kpi_index, target_column
-                ]
-        return map_columns
+        original_column_names = "kpi-" + df_kpi_map.index.astype(str) + "-value"
+        if target_column is not None:
+            return dict(zip(original_column_names, df_kpi_map[target_column].tolist()))
+        # find distinguished words from KPI map as KPI names
+        return dict(
+            zip(
+                original_column_names,
+                AggregateHandler.join_labels(
+                    [(name, df_kpi_map[name].to_numpy()) for name in df_kpi_map.columns]
+                ),
+            )
+        )
+
+    @staticmethod
+    def format_label_values(values: np.ndarray) -> np.ndarray:
+        """Format label values in lower case once per unique value."""
+        codes, uniques = pd.factorize(values, use_na_sentinel=False)
+        formatted = np.array([str(value).lower() for value in uniques], dtype=object)
+        return formatted[codes]
+
+    @staticmethod
+    def join_labels(labels: list) -> np.ndarray:
+        """
+        Join label names and values of all KPIs or groups at once.
+
+        Parameters
+        ----------
+        labels : list
+            pairs of a label name and its values of all KPIs or groups
+
+        Returns
+        -------
+        ndarray
+            NAME-value strings of labels joined with "-" per KPI or group
+        """
+        joined = None
+        for name, values in labels:
+            words = name.upper() + "-" + AggregateHandler.format_label_values(values)
+            joined = words if joined is None else joined + "-" + words
+        return joined
 
     @staticmethod
     def first_quartile(series: pd.Series):
-        return series.quantile(0.25)
+        return series.quantile(AggMethod.QUANTILES["first_quartile"])
 
     @staticmethod
     def third_quartile(series: pd.Series):
-        return series.quantile(0.75)
+        return series.quantile(AggMethod.QUANTILES["third_quartile"])
 
     @staticmethod
     def percentile(n):
@@ -172,18 +220,15 @@ class AggregateHandler:
         return False
 
     @staticmethod
-    def gen_column_prefix(index, df_kpi_indices: pd.DataFrame) -> str:
-        if type(index) is tuple:
-            return (
-                "-".join(
-                    list(
-                        (
-                            name.upper() + "-" + str(value).lower()
-                            for name, value in zip(df_kpi_indices.index.names, index)
-                        )
-                    )
-                )
-                + "-"
+    def gen_column_prefixes(df_kpi_indices: pd.DataFrame) -> np.ndarray:
+        """Generate column prefixes of all groups from the group labels."""
+        index = df_kpi_indices.index
+        return (
+            AggregateHandler.join_labels(
+                [
+                    (name, index.get_level_values(i).to_numpy())
+                    for i, name in enumerate(index.names)
+                ]
             )
-        else:
-            return df_kpi_indices.index.name.upper() + "-" + str(index).lower() + "-"
+            + "-"
+        )
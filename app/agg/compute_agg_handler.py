@@ -94,6 +94,7 @@ class ComputeAggHandler(AggregateHandler):
     def transform_kpi_map(self):
         """Transform KPI map into a human interpretable form."""
         if "ip_protocol" in self.df_kpi_map.columns:
-            self.df_kpi_map["ip_protocol"] = self.df_kpi_map["ip_protocol"].apply(
+            # map unique protocols only if the column is categorical
+            self.df_kpi_map["ip_protocol"] = self.df_kpi_map["ip_protocol"].map(
                 lambda v: ComputeAggHandler.IP_PROTOCOL[str(v)]
             )
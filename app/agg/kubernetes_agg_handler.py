@@ -1,6 +1,7 @@
 import logging
 import pandas as pd
 from app.agg.aggregate_handler import AggregateHandler
+from app.agg.service_resolver import ServiceResolver
 
 
 class KubernetesAggHandler(AggregateHandler):
@@ -46,12 +47,12 @@ class KubernetesAggHandler(AggregateHandler):
 
         if self.metric_name.startswith("kubernetes.io/autoscaler"):
             self.df_kpi_map = self.df_kpi_map.set_index("kpi_index")
-            map_columns = {}
-            for kpi_index in self.df_kpi_map.index:
-                original_column_name = f"kpi-{kpi_index}-value"
-                map_columns[original_column_name] = self.df_kpi_map.loc[
-                    kpi_index, "container_name"
-                ]
+            map_columns = dict(
+                zip(
+                    "kpi-" + self.df_kpi_map.index.astype(str) + "-value",
+                    self.df_kpi_map["container_name"].tolist(),
+                )
+            )
             self.record_new_aggregation(
                 self.metric_index,
                 self.metric_name,
@@ -107,8 +108,7 @@ class KubernetesAggHandler(AggregateHandler):
     def transform_kpi_map(self):
         """Transform KPI map into a human interpretable form."""
         if self.metric_name.startswith("kubernetes.io/pod"):
-            pattern_pod_names = "|".join(self.metadata["services"])
-            self.df_kpi_map["service"] = self.df_kpi_map["pod_name"].str.extract(
-                f"({pattern_pod_names})"
-            )
+            self.df_kpi_map["service"] = ServiceResolver.from_metadata(
+                self.metadata
+            ).resolve_series(self.df_kpi_map["pod_name"])
             self.df_kpi_map = self.df_kpi_map.drop(["pod_name"], axis=1)
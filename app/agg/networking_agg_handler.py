@@ -3,6 +3,7 @@ import logging
 import os
 import pandas as pd
 from app.agg.aggregate_handler import AggregateHandler
+from app.agg.service_resolver import ServiceResolver
 from app.agg.strategy import Strategy
 from app.gcloud_metrics import GCloudMetrics
 
@@ -111,8 +112,7 @@ class NetworkingAggHandler(AggregateHandler):
     def transform_kpi_map(self):
         """Transform KPI map into a human interpretable form."""
         if self.metric_name.startswith("networking.googleapis.com/pod_flow"):
-            pattern_pod_names = "|".join(self.metadata["services"])
-            self.df_kpi_map["service"] = self.df_kpi_map["pod_name"].str.extract(
-                f"({pattern_pod_names})"
-            )
+            self.df_kpi_map["service"] = ServiceResolver.from_metadata(
+                self.metadata
+            ).resolve_series(self.df_kpi_map["pod_name"])
             self.df_kpi_map = self.df_kpi_map.drop(["pod_name"], axis=1)
@@ -1,6 +1,7 @@
 import logging
 import pandas as pd
 from app.agg.aggregate_handler import AggregateHandler
+from app.agg.service_resolver import ServiceResolver
 
 
 class PrometheusAggHandler(AggregateHandler):
@@ -139,8 +140,7 @@ class PrometheusAggHandler(AggregateHandler):
     def transform_kpi_map(self):
         """Transform KPI map into a human interpretable form."""
         if self.metric_name.startswith("prometheus.googleapis.com/kube_pod_status"):
-            pattern_pod_names = "|".join(self.metadata["services"])
-            self.df_kpi_map["service"] = self.df_kpi_map["pod"].str.extract(
-                f"({pattern_pod_names})"
-            )
+            self.df_kpi_map["service"] = ServiceResolver.from_metadata(
+                self.metadata
+            ).resolve_series(self.df_kpi_map["pod"])
             self.df_kpi_map = self.df_kpi_map.drop(["pod"], axis=1)
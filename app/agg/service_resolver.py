@@ -0,0 +1,67 @@
+import numpy as np
+import pandas as pd
+
+
+class ServiceResolver:
+    """
+    Resolve pod names to service names with a trie of the services in the
+    metadata YAML.
+
+    A pod name resolves to the longest service starting at the first position
+    where any service matches, which is what an unanchored regex alternation
+    finds if the services are ordered from the longest to the shortest.
+    Services of a column are resolved once per unique pod name.
+    """
+
+    # shared resolvers keyed by the tuple of services
+    _resolvers = {}
+    _END = ""
+
+    def __init__(self, services: list):
+        self.trie = {}
+        for service in services:
+            node = self.trie
+            for char in service:
+                node = node.setdefault(char, {})
+            node[ServiceResolver._END] = service
+
+    @staticmethod
+    def from_metadata(metadata: dict) -> "ServiceResolver":
+        """Get the resolver of the services in the metadata, built only once."""
+        services = tuple(metadata["services"])
+        if services not in ServiceResolver._resolvers:
+            ServiceResolver._resolvers[services] = ServiceResolver(list(services))
+        return ServiceResolver._resolvers[services]
+
+    def resolve(self, pod_name: str) -> str | None:
+        if not isinstance(pod_name, str):
+            return None
+        for start in range(len(pod_name)):
+            node = self.trie
+            service = None
+            for char in pod_name[start:]:
+                node = node.get(char)
+                if node is None:
+                    break
+                service = node.get(ServiceResolver._END, service)
+            if service is not None:
+                return service
+        return None
+
+    def resolve_series(self, pod_names: pd.Series) -> pd.Series:
+        """
+        Resolve a column of pod names, categorical or not.
+
+        Returns
+        -------
+        Series
+            categorical service names, NaN if no service matches
+        """
+        codes, uniques = pd.factorize(pod_names)
+        services = np.array(
+            [self.resolve(pod_name) for pod_name in uniques] + [None], dtype=object
+        )
+        # code -1 of missing pod names selects the trailing None
+        return pd.Series(
+            pd.Categorical(services[codes]), index=pod_names.index, name="service"
+        )
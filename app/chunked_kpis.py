@@ -0,0 +1,177 @@
+import logging
+import os
+
+import numpy as np
+import pandas as pd
+
+from app.deduplicated_kpis import DeduplicatedKpis
+
+
+class ChunkedKpis:
+    """
+    Combined KPIs of one metric in a column-major memory-mapped matrix, read
+    in chunks that fit into a memory budget.
+
+    The wide CSV is copied into the matrix once, one chunk of rows at a time.
+    As each column is contiguous on disk, selecting the columns of a group
+    only reads that group, and a selection is aggregated one block of rows at
+    a time, so memory is bounded by the budget instead of the metric width.
+
+    Handlers group and reduce it like a DataFrame.
+    """
+
+    FNAME_SUFFIX = "-columns.npy"
+    # copies of a block made by pandas and numpy while aggregating
+    MEMORY_FACTOR = 4
+
+    def __init__(
+        self,
+        matrix: np.ndarray,
+        index: pd.DatetimeIndex,
+        column_names: list,
+        memory_budget: int,
+        positions: np.ndarray = None,
+    ):
+        """
+        Parameters
+        ----------
+        matrix : ndarray
+            the memory-mapped matrix of all KPIs in Fortran order
+        index : DatetimeIndex
+            the timestamps of rows
+        column_names : list
+            the names of the selected columns
+        memory_budget : int
+            the number of bytes a block of rows may take
+        positions : ndarray
+            the positions of the selected columns in the matrix, all by default
+        """
+        self.matrix = matrix
+        self.index = index
+        self.column_names = list(column_names)
+        self.memory_budget = memory_budget
+        self.positions = (
+            np.arange(matrix.shape[1]) if positions is None else np.asarray(positions)
+        )
+
+    @staticmethod
+    def from_csv(path_csv: str, memory_budget: int, dtype=np.float64) -> "ChunkedKpis":
+        """
+        Copy a wide CSV of combined KPIs into a memory-mapped matrix next to it.
+
+        Parameters
+        ----------
+        path_csv : str
+            the path of a combined metric with a timestamp column
+        memory_budget : int
+            the number of bytes a chunk of rows may take
+        dtype : str | type
+            the type of values
+        """
+        column_names = pd.read_csv(path_csv, nrows=0).columns.drop("timestamp")
+        timestamps = pd.to_datetime(
+            pd.read_csv(path_csv, usecols=["timestamp"])["timestamp"], format="ISO8601"
+        )
+        # rows in the order of sorted timestamps
+        order = np.argsort(timestamps.to_numpy(), kind="stable")
+        destinations = np.empty(len(order), dtype=np.int64)
+        destinations[order] = np.arange(len(order))
+        index = pd.DatetimeIndex(timestamps.to_numpy()[order], name="timestamp")
+
+        path_npy = path_csv.removesuffix(".csv") + ChunkedKpis.FNAME_SUFFIX
+        matrix = np.lib.format.open_memmap(
+            path_npy,
+            mode="w+",
+            dtype=dtype,
+            shape=(len(index), len(column_names)),
+            fortran_order=True,
+        )
+        rows_per_chunk = ChunkedKpis.compute_rows_per_block(
+            memory_budget, len(column_names), np.dtype(dtype).itemsize
+        )
+        logging.info(f"Copying {path_csv} in chunks of {rows_per_chunk} rows ...")
+        start = 0
+        for df_chunk in pd.read_csv(
+            path_csv,
+            usecols=list(column_names),
+            dtype={column: dtype for column in column_names},
+            chunksize=rows_per_chunk,
+        ):
+            end = start + len(df_chunk)
+            matrix[destinations[start:end]] = df_chunk[column_names].to_numpy()
+            start = end
+        matrix.flush()
+        del matrix
+        return ChunkedKpis(
+            np.load(path_npy, mmap_mode="r"), index, column_names, memory_budget
+        )
+
+    @staticmethod
+    def compute_rows_per_block(memory_budget: int, num_cols: int, itemsize: int):
+        return max(
+            1,
+            memory_budget // (max(num_cols, 1) * itemsize * ChunkedKpis.MEMORY_FACTOR),
+        )
+
+    @property
+    def columns(self) -> pd.Index:
+        return pd.Index(self.column_names)
+
+    @property
+    def empty(self) -> bool:
+        return len(self.index) == 0 or len(self.column_names) == 0
+
+    def __getitem__(self, columns: list) -> "ChunkedKpis":
+        """Select columns without reading them."""
+        positions = self.columns.get_indexer(columns)
+        if (positions < 0).any():
+            raise KeyError(f"Columns {list(np.asarray(columns)[positions < 0])}!")
+        return ChunkedKpis(
+            self.matrix,
+            self.index,
+            columns,
+            self.memory_budget,
+            self.positions[positions],
+        )
+
+    def iter_blocks(self):
+        """Yield the selected columns in blocks of rows within the budget."""
+        rows_per_block = ChunkedKpis.compute_rows_per_block(
+            self.memory_budget, len(self.positions), self.matrix.dtype.itemsize
+        )
+        for start in range(0, len(self.index), rows_per_block):
+            rows = slice(start, start + rows_per_block)
+            yield pd.DataFrame(
+                self.matrix[rows][:, self.positions],
+                index=self.index[rows],
+                columns=self.column_names,
+            )
+
+    def to_frame(self) -> pd.DataFrame:
+        return pd.DataFrame(
+            self.matrix[:, self.positions],
+            index=self.index,
+            columns=self.column_names,
+        )
+
+    def rename(self, columns: dict) -> pd.DataFrame:
+        # KPIs kept without aggregation are as wide as the metric anyway
+        return self.to_frame().rename(columns=columns)
+
+    def agg(self, agg_methods: list, axis: int = 1) -> pd.DataFrame:
+        """Aggregate the selected KPIs per minute like DataFrame.agg with axis=1."""
+        if axis != 1:
+            return self.to_frame().agg(agg_methods, axis=axis)
+        list_df_agg = []
+        for df_block in self.iter_blocks():
+            deduplicated_kpis = DeduplicatedKpis.from_frame(df_block)
+            kpis = df_block if deduplicated_kpis is None else deduplicated_kpis
+            list_df_agg.append(kpis.agg(agg_methods, axis=1))
+        return pd.concat(list_df_agg)
+
+    def remove(self):
+        """Remove the memory-mapped matrix from disk."""
+        path_npy = self.matrix.filename
+        del self.matrix
+        if path_npy is not None and os.path.exists(path_npy):
+            os.remove(path_npy)
@@ -0,0 +1,293 @@
+import json
+import logging
+
+import numpy as np
+import pandas as pd
+
+from app.feature_matrix import FeatureMatrix
+
+
+class ColumnPruner:
+    """
+    Prune redundant columns of a feature matrix.
+
+    Exact duplicates are found by hashing the bytes of each column and are
+    verified byte by byte. Near duplicates are found among the remaining
+    columns by correlation on a sample of rows, computed block by block
+    against the columns kept so far, so only a block of columns is in memory
+    at a time. A column is dropped if it has the same missing rows as an
+    earlier kept column in the sample and their absolute correlation reaches
+    the threshold.
+
+    A reduction records the kept columns and the representative of each
+    dropped column. It can be applied to other experiments so that their
+    reduced matrices share one schema.
+    """
+
+    PRUNED_SUFFIX = "-pruned"
+    FNAME_REDUCTION_SUFFIX = "-reduction.json"
+
+    def __init__(
+        self,
+        threshold: float = 0.999,
+        sample_size: int = 10000,
+        block_size: int = 1024,
+        seed: int = 0,
+    ):
+        """
+        Parameters
+        ----------
+        threshold : float
+            the absolute correlation from which columns are near duplicates
+        sample_size : int
+            the number of rows sampled to correlate columns
+        block_size : int
+            the number of columns read at once
+        seed : int
+            the seed of sampling rows
+        """
+        self.threshold = threshold
+        self.sample_size = sample_size
+        self.block_size = block_size
+        self.seed = seed
+
+    @staticmethod
+    def hash_columns(matrix: np.ndarray, block_size: int) -> np.ndarray:
+        """Hash the bytes of each column into one 64-bit value."""
+        num_rows, num_cols = matrix.shape
+        row_hashes = pd.util.hash_array(np.arange(num_rows))
+        column_hashes = np.empty(num_cols, dtype=np.uint64)
+        for start in range(0, num_cols, block_size):
+            bits = np.asarray(matrix[:, start : start + block_size]).view(
+                f"u{matrix.dtype.itemsize}"
+            )
+            element_hashes = pd.util.hash_array(bits.ravel(order="F")).reshape(
+                bits.shape, order="F"
+            )
+            column_hashes[start : start + bits.shape[1]] = (
+                element_hashes * row_hashes[:, np.newaxis]
+            ).sum(axis=0)
+        return column_hashes
+
+    @staticmethod
+    def find_exact_duplicates(matrix: np.ndarray, block_size: int) -> dict:
+        """
+        Find columns identical to an earlier column.
+
+        Returns
+        -------
+        dict
+            the position of the earliest identical column keyed by positions
+            of duplicated columns
+        """
+        codes, _ = pd.factorize(ColumnPruner.hash_columns(matrix, block_size))
+        representatives = {}
+        for positions in (
+            pd.Series(np.arange(len(codes))).groupby(codes).indices.values()
+        ):
+            # verify copies byte by byte in case of hash collisions
+            candidates = list(positions)
+            while len(candidates) > 1:
+                first = np.asarray(matrix[:, candidates[0]])
+                remaining = []
+                for position in candidates[1:]:
+                    if np.array_equal(
+                        first.view(f"u{matrix.dtype.itemsize}"),
+                        np.asarray(matrix[:, position]).view(
+                            f"u{matrix.dtype.itemsize}"
+                        ),
+                    ):
+                        representatives[position] = candidates[0]
+                    else:
+                        remaining.append(position)
+                candidates = remaining
+        return representatives
+
+    @staticmethod
+    def standardize(values: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Center columns on their valid rows and scale them to unit norm, so the
+        dot product of two columns with the same valid rows is their
+        correlation. Constant columns become zeros.
+
+        Returns
+        -------
+        tuple[ndarray, ndarray]
+            standardized columns with zeros at missing rows, and the valid
+            rows as floats
+        """
+        values = values.astype(np.float64)
+        valid = ~np.isnan(values)
+        counts = valid.sum(axis=0)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            means = np.where(valid, values, 0).sum(axis=0) / np.maximum(counts, 1)
+            centered = np.where(valid, values - means, 0)
+            norms = np.sqrt((centered**2).sum(axis=0))
+            standardized = np.where(norms > 0, centered / norms, 0)
+        return standardized, valid.astype(np.float64)
+
+    def find_near_duplicates(
+        self, matrix: np.ndarray, positions: np.ndarray, rows: np.ndarray
+    ) -> dict:
+        """
+        Find columns correlated with an earlier kept column.
+
+        Returns
+        -------
+        dict
+            pairs of the position of the kept column and the correlation keyed
+            by positions of dropped columns
+        """
+        kept_blocks = []
+        dropped = {}
+        for start in range(0, len(positions), self.block_size):
+            block_positions = positions[start : start + self.block_size]
+            standardized, valid = ColumnPruner.standardize(
+                np.asarray(matrix[:, block_positions])[rows]
+            )
+            best_correlations = np.zeros(len(block_positions))
+            best_positions = np.full(len(block_positions), -1)
+            for kept_positions, kept_standardized, kept_valid in kept_blocks:
+                correlations = np.abs(standardized.T @ kept_standardized)
+                # missing rows must match in the sample
+                mismatches = valid.T @ (1 - kept_valid) + (1 - valid).T @ kept_valid
+                correlations[mismatches > 0] = 0
+                best = correlations.argmax(axis=1)
+                better = correlations[np.arange(len(best)), best] > best_correlations
+                best_correlations[better] = correlations[np.arange(len(best)), best][
+                    better
+                ]
+                best_positions[better] = kept_positions[best[better]]
+            # greedily keep columns within the block in order
+            correlations = np.abs(standardized.T @ standardized)
+            mismatches = valid.T @ (1 - valid) + (1 - valid).T @ valid
+            correlations[mismatches > 0] = 0
+            kept_in_block = []
+            for i in range(len(block_positions)):
+                if best_correlations[i] < self.threshold and kept_in_block:
+                    j = kept_in_block[correlations[i, kept_in_block].argmax()]
+                    if correlations[i, j] >= self.threshold:
+                        best_correlations[i] = correlations[i, j]
+                        best_positions[i] = block_positions[j]
+                if best_correlations[i] >= self.threshold:
+                    dropped[int(block_positions[i])] = (
+                        int(best_positions[i]),
+                        float(min(best_correlations[i], 1.0)),
+                    )
+                else:
+                    kept_in_block.append(i)
+            kept_blocks.append(
+                (
+                    block_positions[kept_in_block],
+                    standardized[:, kept_in_block],
+                    valid[:, kept_in_block],
+                )
+            )
+        return dropped
+
+    def fit(self, path_prefix: str) -> dict:
+        """
+        Find redundant columns of a feature matrix.
+
+        Returns
+        -------
+        dict
+            the reduction with the kept columns and, keyed by dropped columns,
+            their representative and correlation
+        """
+        feature_matrix = FeatureMatrix(path_prefix)
+        matrix = feature_matrix.matrix
+        columns = feature_matrix.catalog["column"].to_list()
+        num_rows, num_cols = matrix.shape
+        logging.info(f"Finding exact duplicates among {num_cols} columns ...")
+        exact = ColumnPruner.find_exact_duplicates(matrix, self.block_size)
+        candidates = np.array(
+            [position for position in range(num_cols) if position not in exact],
+            dtype=np.int64,
+        )
+        rng = np.random.default_rng(self.seed)
+        rows = np.sort(
+            rng.choice(num_rows, size=min(self.sample_size, num_rows), replace=False)
+        )
+        logging.info(f"Correlating {len(candidates)} columns on {len(rows)} rows ...")
+        near = self.find_near_duplicates(matrix, candidates, rows)
+
+        dropped = {}
+        for position, representative in exact.items():
+            dropped[columns[position]] = {
+                "representative": columns[representative],
+                "correlation": 1.0,
+                "exact": True,
+            }
+            if representative in near:
+                # the earliest copy is itself correlated with a kept column
+                representative, correlation = near[representative]
+                dropped[columns[position]] = {
+                    "representative": columns[representative],
+                    "correlation": correlation,
+                    "exact": False,
+                }
+        for position, (representative, correlation) in near.items():
+            dropped[columns[position]] = {
+                "representative": columns[representative],
+                "correlation": correlation,
+                "exact": False,
+            }
+        kept = [
+            column
+            for position, column in enumerate(columns)
+            if position not in exact and position not in near
+        ]
+        logging.info(f"Keeping {len(kept)} of {num_cols} columns.")
+        return {"threshold": self.threshold, "kept": kept, "dropped": dropped}
+
+    @staticmethod
+    def save_reduction(reduction: dict, path_reduction: str):
+        with open(path_reduction, "w") as file_reduction:
+            json.dump(reduction, file_reduction)
+
+    @staticmethod
+    def load_reduction(path_reduction: str) -> dict:
+        with open(path_reduction) as file_reduction:
+            return json.load(file_reduction)
+
+    @staticmethod
+    def apply(path_prefix: str, reduction: dict, block_size: int = 1024) -> str:
+        """
+        Write the kept columns of a feature matrix into a reduced feature
+        matrix with the reduction next to it. Kept columns missing in the
+        feature matrix are NaN.
+
+        Returns
+        -------
+        str
+            the path prefix of the reduced feature matrix
+        """
+        feature_matrix = FeatureMatrix(path_prefix)
+        path_prefix_pruned = path_prefix + ColumnPruner.PRUNED_SUFFIX
+        kept = reduction["kept"]
+        positions = (
+            pd.Index(feature_matrix.catalog["column"])
+            .get_indexer(kept)
+            .astype(np.int64)
+        )
+        matrix = FeatureMatrix.create(
+            path_prefix_pruned,
+            feature_matrix.matrix.shape[0],
+            kept,
+            feature_matrix.timestamps,
+            feature_matrix.segments,
+        )
+        for start in range(0, len(kept), block_size):
+            block_positions = positions[start : start + block_size]
+            exists = block_positions >= 0
+            block = np.full(
+                (matrix.shape[0], len(block_positions)), np.nan, dtype=matrix.dtype
+            )
+            block[:, exists] = feature_matrix.matrix[:, block_positions[exists]]
+            matrix[:, start : start + len(block_positions)] = block
+        matrix.flush()
+        ColumnPruner.save_reduction(
+            reduction, path_prefix_pruned + ColumnPruner.FNAME_REDUCTION_SUFFIX
+        )
+        return path_prefix_pruned
@@ -2,6 +2,7 @@ import os
 
 import pandas as pd
 from app.gcloud_metrics import GCloudMetrics
+from app.sparse_kpis import SparseKpis
 
 
 def find_constant_metrics(fname_exp_yaml: str, num_days: int = 14):
@@ -47,6 +48,11 @@ def find_constant_metrics(fname_exp_yaml: str, num_days: int = 14):
 
 
 def read_combined_kpis(path_combined_metrics: str, metric_index: int):
+    sparse_metric_path = os.path.join(
+        path_combined_metrics, f"metric-{metric_index}{SparseKpis.FNAME_SUFFIX}"
+    )
+    if os.path.exists(sparse_metric_path):
+        return SparseKpis.load(sparse_metric_path).to_wide()
     metric_path = os.path.join(path_combined_metrics, f"metric-{metric_index}.csv")
     df_metric = pd.read_csv(metric_path)
     df_metric["timestamp"] = pd.to_datetime(df_metric["timestamp"], format="ISO8601")
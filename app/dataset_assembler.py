@@ -0,0 +1,189 @@
+import logging
+import os
+import re
+
+import numpy as np
+import pandas as pd
+
+from app.feature_matrix import FeatureMatrix
+from app.gcloud_metrics import GCloudMetrics
+
+
+class DatasetAssembler:
+    """
+    Assemble merged experiments of several experiment YAMLs into one feature
+    matrix with the union of their columns.
+
+    Only the headers of merged outputs are read to build the union schema.
+    The matrix is then allocated once, and the rows of each experiment are
+    copied block by block into the positions of its columns, from its feature
+    matrix if it is up to date or from its CSV otherwise. Columns missing in an
+    experiment are NaN. The rows of each experiment are recorded as a segment
+    of the catalog with its experiment YAML, time window and label.
+    """
+
+    LABEL_NORMAL = "normal"
+    PATTERN_RUN_SUFFIX = re.compile(r"-\d+$")
+
+    def __init__(self, filenames_exp_yaml: list, block_size: int = 1024):
+        """
+        Parameters
+        ----------
+        filenames_exp_yaml : list
+            filenames of experiment YAMLs
+        block_size : int
+            the number of columns or rows copied at once
+        """
+        self.block_size = block_size
+        self.sources = []
+        for filename_exp_yaml in filenames_exp_yaml:
+            gcloud_metrics = GCloudMetrics(filename_exp_yaml)
+            for experiment in gcloud_metrics.experiments:
+                path_experiment = gcloud_metrics.build_path_experiment(
+                    experiment["name"]
+                )
+                if path_experiment is None:
+                    logging.warning(f'Experiment {experiment["name"]} does not exist!')
+                    continue
+                self.sources.append(
+                    {
+                        "filename_exp_yaml": filename_exp_yaml,
+                        "experiment": experiment,
+                        "path_csv": os.path.join(
+                            path_experiment, f'{experiment["name"]}.csv'
+                        ),
+                    }
+                )
+
+    @staticmethod
+    def build_label(filename_exp_yaml: str) -> str:
+        """Label an experiment by its YAML, e.g. cpu-stress-auth or normal."""
+        stem = filename_exp_yaml.removesuffix(".yaml")
+        if stem.startswith(DatasetAssembler.LABEL_NORMAL):
+            return DatasetAssembler.LABEL_NORMAL
+        return DatasetAssembler.PATTERN_RUN_SUFFIX.sub("", stem)
+
+    @staticmethod
+    def has_feature_matrix(path_csv: str) -> bool:
+        """Check whether the feature matrix of a merged CSV is up to date."""
+        path_matrix = (
+            FeatureMatrix.build_path_prefix(path_csv)
+            + FeatureMatrix.FNAME_MATRIX_SUFFIX
+        )
+        return os.path.exists(path_matrix) and (
+            not os.path.exists(path_csv)
+            or os.path.getmtime(path_matrix) >= os.path.getmtime(path_csv)
+        )
+
+    @staticmethod
+    def read_columns(path_csv: str) -> list:
+        if DatasetAssembler.has_feature_matrix(path_csv):
+            return (
+                FeatureMatrix(FeatureMatrix.build_path_prefix(path_csv))
+                .catalog["column"]
+                .to_list()
+            )
+        return pd.read_csv(path_csv, nrows=0).columns.drop("timestamp").to_list()
+
+    @staticmethod
+    def read_timestamps(path_csv: str) -> np.ndarray:
+        if DatasetAssembler.has_feature_matrix(path_csv):
+            feature_matrix = FeatureMatrix(FeatureMatrix.build_path_prefix(path_csv))
+            if feature_matrix.timestamps is not None:
+                return feature_matrix.timestamps
+        timestamps = pd.to_datetime(
+            pd.read_csv(path_csv, usecols=["timestamp"])["timestamp"],
+            format="ISO8601",
+            utc=True,
+        )
+        return timestamps.dt.tz_localize(None).to_numpy(dtype="datetime64[s]")
+
+    def build_schema(self) -> list:
+        """Build the union of columns in the order of their first appearance."""
+        columns = {}
+        for source in self.sources:
+            for column in DatasetAssembler.read_columns(source["path_csv"]):
+                columns.setdefault(column, len(columns))
+        return list(columns)
+
+    def assemble(self, path_prefix: str) -> str:
+        """
+        Write the assembled feature matrix.
+
+        Returns
+        -------
+        str
+            the path prefix of the assembled feature matrix
+        """
+        columns = self.build_schema()
+        positions = pd.Index(columns)
+        list_timestamps = [
+            DatasetAssembler.read_timestamps(source["path_csv"])
+            for source in self.sources
+        ]
+        segments = []
+        start = 0
+        for source, timestamps in zip(self.sources, list_timestamps):
+            experiment = source["experiment"]
+            segments.append(
+                {
+                    "name": experiment["name"],
+                    "start": start,
+                    "end": start + len(timestamps),
+                    "filename_exp_yaml": source["filename_exp_yaml"],
+                    "label": DatasetAssembler.build_label(source["filename_exp_yaml"]),
+                    "start_time": experiment["start"],
+                    "end_time": experiment["end"],
+                }
+            )
+            start += len(timestamps)
+        logging.info(f"Assembling {start} rows x {len(columns)} columns ...")
+        matrix = FeatureMatrix.create(
+            path_prefix,
+            start,
+            columns,
+            np.concatenate(list_timestamps) if list_timestamps else None,
+            segments,
+        )
+        for source, segment in zip(self.sources, segments):
+            rows = slice(segment["start"], segment["end"])
+            if DatasetAssembler.has_feature_matrix(source["path_csv"]):
+                self.copy_feature_matrix(source["path_csv"], matrix, rows, positions)
+            else:
+                self.copy_csv(source["path_csv"], matrix, rows, positions)
+        matrix.flush()
+        return path_prefix
+
+    @staticmethod
+    def fill_missing(matrix: np.ndarray, rows: slice, destinations: np.ndarray):
+        """Fill columns an experiment does not have with NaN."""
+        missing = np.setdiff1d(np.arange(matrix.shape[1]), destinations)
+        if len(missing) > 0:
+            matrix[rows, missing] = np.nan
+
+    def copy_feature_matrix(
+        self, path_csv: str, matrix: np.ndarray, rows: slice, positions: pd.Index
+    ):
+        feature_matrix = FeatureMatrix(FeatureMatrix.build_path_prefix(path_csv))
+        destinations = positions.get_indexer(feature_matrix.catalog["column"])
+        DatasetAssembler.fill_missing(matrix, rows, destinations)
+        for start in range(0, len(destinations), self.block_size):
+            block = slice(start, start + self.block_size)
+            matrix[rows, destinations[block]] = feature_matrix.matrix[:, block]
+
+    def copy_csv(
+        self, path_csv: str, matrix: np.ndarray, rows: slice, positions: pd.Index
+    ):
+        columns = pd.read_csv(path_csv, nrows=0).columns.drop("timestamp")
+        destinations = positions.get_indexer(columns)
+        DatasetAssembler.fill_missing(matrix, rows, destinations)
+        start = rows.start
+        for df_chunk in pd.read_csv(
+            path_csv,
+            usecols=list(columns),
+            dtype={column: FeatureMatrix.DTYPE for column in columns},
+            chunksize=self.block_size,
+        ):
+            end = start + len(df_chunk)
+            matrix[start:end, destinations] = df_chunk[columns].to_numpy()
+            start = end
@@ -0,0 +1,145 @@
+import numpy as np
+import pandas as pd
+
+from app.agg.agg_method import AggMethod
+
+
+class DeduplicatedKpis:
+    """
+    KPIs of a DataFrame with identical columns stored once with a multiplicity.
+
+    Columns are grouped by a hash of their bytes and verified byte by byte, so
+    only exact copies such as all-zero counters or values repeated across
+    labels are merged. Order statistics (min, max, median and quantiles) are
+    computed from the unique columns weighted by multiplicity and equal those
+    of DataFrame.agg with axis=1. Other methods, e.g. mean and sum, are cheap
+    and are computed from all columns to keep their rounding unchanged.
+    """
+
+    def __init__(self, df_metric: pd.DataFrame, positions: np.ndarray, weights):
+        """
+        Parameters
+        ----------
+        df_metric : DataFrame
+            all KPIs with timestamps as the index
+        positions : ndarray
+            the position of a representative column per group of copies
+        weights : ndarray
+            the number of copies of each representative column
+        """
+        self.df_metric = df_metric
+        self.positions = positions
+        self.weights = weights
+
+    @staticmethod
+    def from_frame(df_metric: pd.DataFrame) -> "DeduplicatedKpis | None":
+        """
+        Find identical columns of a DataFrame.
+
+        Returns
+        -------
+        DeduplicatedKpis | None
+            None if all columns are different or not numeric
+        """
+        num_rows, num_cols = df_metric.shape
+        if num_cols < 2 or num_rows == 0:
+            return None
+        try:
+            matrix = np.asfortranarray(df_metric.to_numpy(dtype=np.float64))
+        except (TypeError, ValueError):
+            return None
+        # hash the bytes of each column into one 64-bit value
+        row_hashes = pd.util.hash_array(np.arange(num_rows))
+        bits = matrix.view(np.uint64)
+        element_hashes = pd.util.hash_array(bits.ravel(order="F")).reshape(
+            (num_rows, num_cols), order="F"
+        )
+        column_hashes = (element_hashes * row_hashes[:, np.newaxis]).sum(axis=0)
+        codes, uniques = pd.factorize(column_hashes)
+        if len(uniques) == num_cols:
+            return None
+        positions = []
+        weights = []
+        for code in range(len(uniques)):
+            candidates = np.flatnonzero(codes == code)
+            # verify copies byte by byte in case of hash collisions
+            while len(candidates) > 0:
+                equal = (bits[:, candidates] == bits[:, [candidates[0]]]).all(axis=0)
+                positions.append(candidates[0])
+                weights.append(int(equal.sum()))
+                candidates = candidates[~equal]
+        if len(positions) == num_cols:
+            return None
+        order = np.argsort(positions)
+        return DeduplicatedKpis(
+            df_metric,
+            np.asarray(positions)[order],
+            np.asarray(weights, dtype=np.int64)[order],
+        )
+
+    def agg(self, agg_methods: list, axis: int = 1) -> pd.DataFrame:
+        """Aggregate KPIs per minute like DataFrame.agg with axis=1."""
+        if axis != 1:
+            return self.df_metric.agg(agg_methods, axis=axis)
+        names = [AggMethod.get_name(method) for method in agg_methods]
+        methods_of_all_columns = [
+            method
+            for method, name in zip(agg_methods, names)
+            if name not in ("min", "max") and AggMethod.get_quantile(name) is None
+        ]
+        if len(methods_of_all_columns) == len(agg_methods):
+            return self.df_metric.agg(agg_methods, axis=1)
+        results = {}
+        if methods_of_all_columns:
+            df_agg = self.df_metric.agg(methods_of_all_columns, axis=1)
+            results.update({name: df_agg[name] for name in df_agg.columns})
+        values = self.df_metric.to_numpy(dtype=np.float64)[:, self.positions]
+        order = np.argsort(values, axis=1)
+        sorted_values = np.take_along_axis(values, order, axis=1)
+        # NaN sorted last and weighted zero
+        sorted_weights = np.where(
+            np.isnan(sorted_values), 0, self.weights[order]
+        ).cumsum(axis=1)
+        counts = sorted_weights[:, -1]
+        empty = counts == 0
+
+        def order_statistic(ranks: np.ndarray) -> np.ndarray:
+            """The value at zero-based ranks of the expanded KPIs per row."""
+            positions = (sorted_weights <= ranks[:, np.newaxis]).sum(axis=1)
+            positions = np.minimum(positions, values.shape[1] - 1)
+            return sorted_values[np.arange(len(values)), positions]
+
+        for name in names:
+            if name in results:
+                continue
+            quantile = AggMethod.get_quantile(name)
+            with np.errstate(invalid="ignore"):
+                if name == "min":
+                    result = sorted_values[:, 0].copy()
+                elif name == "max":
+                    result = order_statistic(np.maximum(counts - 1, 0))
+                elif name == "median":
+                    # the mean of both middle values as numpy.median
+                    lower = order_statistic(np.maximum(counts - 1, 0) // 2)
+                    upper = order_statistic(counts // 2)
+                    result = np.where(counts % 2 == 1, upper, (lower + upper) / 2)
+                else:
+                    virtual = (counts - 1) * quantile
+                    previous = np.floor(virtual)
+                    gamma = virtual - previous
+                    lower = order_statistic(previous.astype(np.int64))
+                    upper = order_statistic(
+                        np.minimum(previous.astype(np.int64) + 1, counts - 1)
+                    )
+                    diff = upper - lower
+                    result = np.where(
+                        gamma >= 0.5,
+                        upper - diff * (1 - gamma),
+                        lower + diff * gamma,
+                    )
+            result[empty] = np.nan
+            results[name] = result
+        # mixed results are floats as in DataFrame.agg
+        return pd.DataFrame(
+            {name: results[name] for name in names}, index=self.df_metric.index
+        ).astype(np.float64)
@@ -0,0 +1,304 @@
+import logging
+import os
+from datetime import datetime
+from multiprocessing import Pool
+
+import numpy as np
+import pandas as pd
+from scipy.special import ndtr
+from scipy.stats import mannwhitneyu, rankdata
+
+# Thresholds
+RESPONSE_TIME_THRESHOLD = 50_000
+FAILURE_RATE_THRESHOLD = 0.05
+SIGNIFICANCE_LEVEL = 0.05
+EFFECT_SIZE_THRESHOLD = 0.474
+# Columns of locust statistics in merged experiments
+COL_RESPONSE_TIME = "lm-95%"
+COL_FAILURE_RATE = "lm-Failures/s"
+
+
+def a12_unpaired(lst1, lst2) -> float:
+    """
+    Compute the Vargha-Delaney A12 effect size from ranks of the pooled sample.
+
+    The result equals the pairwise definition (more + 0.5 * same) / (n * m)
+    in O((n + m) log(n + m)) instead of O(n * m).
+    """
+    x = np.asarray(lst1, dtype=float)
+    y = np.asarray(lst2, dtype=float)
+    n1, n2 = len(x), len(y)
+    ranks = rankdata(np.concatenate([x, y]))
+    u1 = ranks[:n1].sum() - n1 * (n1 + 1) / 2
+    return u1 / (n1 * n2)
+
+
+def sliding_mann_whitney(
+    values: np.ndarray, reference: np.ndarray, window_size: int
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Compare every sliding window of values against a fixed reference sample.
+
+    The reference is sorted once, so the U statistic of each window is a
+    difference of a cumulative sum over per-value contributions, and the tie
+    term of the pooled sample is updated incrementally as the window moves.
+
+    Parameters
+    ----------
+    values : ndarray
+        the series to slide over
+    reference : ndarray
+        the fixed sample to compare with, e.g. values from the normal dataset
+    window_size : int
+        the number of values in each window
+
+    Returns
+    -------
+    tuple[ndarray, ndarray, ndarray]
+        U statistics of the windows, two-sided asymptotic p-values as computed
+        by scipy.stats.mannwhitneyu and the tie terms of the pooled samples,
+        all indexed by window start
+    """
+    num_windows = len(values) - window_size + 1
+    if num_windows <= 0:
+        return np.empty(0), np.empty(0), np.empty(0)
+    n1, n2 = window_size, len(reference)
+    reference = np.sort(reference)
+    uniques, counts = np.unique(reference, return_counts=True)
+    ref_counts = dict(zip(uniques.tolist(), counts.tolist()))
+
+    # contribution of each value to U: #reference below + 0.5 * #reference equal
+    below = np.searchsorted(reference, values, side="left")
+    not_above = np.searchsorted(reference, values, side="right")
+    contributions = below + 0.5 * (not_above - below)
+    cumulative = np.concatenate([[0.0], np.cumsum(contributions)])
+    u1 = cumulative[window_size:] - cumulative[:-window_size]
+
+    # maintain sum(t^3 - t) over tie groups of the pooled sample
+    def tie(t: int) -> int:
+        return t**3 - t
+
+    tie_terms = np.empty(num_windows)
+    tie_term = int(np.sum(counts.astype(np.int64) ** 3 - counts))
+    window_counts = {}
+
+    def add(value: float, step: int):
+        nonlocal tie_term
+        base = ref_counts.get(value, 0)
+        in_window = window_counts.get(value, 0)
+        tie_term += tie(base + in_window + step) - tie(base + in_window)
+        window_counts[value] = in_window + step
+
+    values_list = values.tolist()
+    for value in values_list[:window_size]:
+        add(value, 1)
+    tie_terms[0] = tie_term
+    for i in range(1, num_windows):
+        add(values_list[i - 1], -1)
+        add(values_list[i + window_size - 1], 1)
+        tie_terms[i] = tie_term
+
+    n = n1 + n2
+    u = np.maximum(u1, n1 * n2 - u1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        sigma = np.sqrt(n1 * n2 / 12 * ((n + 1) - tie_terms / (n * (n - 1))))
+        z = (u - n1 * n2 / 2 - 0.5) / sigma
+    p = np.clip(2 * ndtr(-z), 0.0, 1.0)
+    return u1, p, tie_terms
+
+
+def find_first_disruptive_window(
+    start_index: int,
+    values: np.ndarray,
+    reference: np.ndarray,
+    window_size: int,
+    point_threshold: float,
+    average_threshold: float,
+) -> int | None:
+    """
+    Find the first window start from start_index whose values are significantly
+    and largely different from the reference and exceed the thresholds.
+    """
+    u1, p, tie_terms = sliding_mann_whitney(values, reference, window_size)
+    if len(u1) == 0:
+        return None
+    window_sums = np.convolve(values, np.ones(window_size), mode="valid")
+    a12 = u1 / (window_size * len(reference))
+    candidates = (
+        (values[: len(u1)] > point_threshold)
+        & (window_sums / window_size > average_threshold)
+        & (2 * np.abs(a12 - 0.5) >= EFFECT_SIZE_THRESHOLD)
+    )
+    candidates[:start_index] = False
+    # scipy switches to the exact test for small samples without ties
+    use_exact = min(window_size, len(reference)) <= 8
+    for i in np.flatnonzero(candidates):
+        p_value = p[i]
+        if use_exact and tie_terms[i] == 0:
+            _, p_value = mannwhitneyu(values[i : i + window_size], reference)
+        if p_value < SIGNIFICANCE_LEVEL:
+            return int(i)
+    return None
+
+
+def find_disruption_index_by_test(
+    start_failure_index: int,
+    normal_response_time: np.ndarray,
+    faulty_response_time: np.ndarray,
+    normal_http_failure_rate: np.ndarray,
+    faulty_http_failure_rate: np.ndarray,
+) -> int:
+    """
+    Find the index where the system is disrupted after the failure injection.
+
+    The response time is checked first with windows of 10 minutes, then the HTTP
+    failure rate with windows of 5 minutes. If neither is disrupted, the later
+    index of their highest values is returned.
+    """
+    window_size = 10
+    i = find_first_disruptive_window(
+        start_failure_index,
+        faulty_response_time,
+        normal_response_time,
+        window_size,
+        RESPONSE_TIME_THRESHOLD,
+        RESPONSE_TIME_THRESHOLD / 3,
+    )
+    if i is not None:
+        logging.info("Find disruption index from response time.")
+        return i + window_size // 2 - 1
+    window_size = 5
+    i = find_first_disruptive_window(
+        start_failure_index,
+        faulty_http_failure_rate,
+        normal_http_failure_rate,
+        window_size,
+        FAILURE_RATE_THRESHOLD,
+        FAILURE_RATE_THRESHOLD,
+    )
+    if i is not None:
+        logging.info("Find disruption index from HTTP failure rate.")
+        return int(i + window_size / 2 + 0.5 - 1)
+
+    logging.info("Find disruption index from the later point with the highest metric.")
+    max_response_index = np.flatnonzero(
+        faulty_response_time == faulty_response_time[start_failure_index:].max()
+    )[0]
+    max_http_failure_rate_index = np.flatnonzero(
+        faulty_http_failure_rate == faulty_http_failure_rate[start_failure_index:].max()
+    )[0]
+    return int(max(max_response_index, max_http_failure_rate_index))
+
+
+def read_locust_columns(path_csv: str) -> pd.DataFrame:
+    """Read only the timestamp and the locust columns used for disruption tests."""
+    return pd.read_csv(
+        path_csv,
+        usecols=lambda col: col in {"timestamp", COL_RESPONSE_TIME, COL_FAILURE_RATE},
+    )
+
+
+def compute_disruption_index(
+    path_failure_dataset: str,
+    exp_name: str,
+    failure_begin_timestamp: str,
+    experiment_end_timestamp: str,
+    normal_response_time: np.ndarray,
+    normal_failure_rate: np.ndarray,
+) -> int:
+    """Compute the disruption index of one failure experiment."""
+    logging.info(f"Computing disruption index of {exp_name} ...")
+    failure_injection_time = datetime.fromisoformat(failure_begin_timestamp).timestamp()
+    experiment_end_time = datetime.fromisoformat(experiment_end_timestamp).timestamp()
+    df = read_locust_columns(
+        os.path.join(path_failure_dataset, exp_name, exp_name + ".csv")
+    )
+    df["timestamp"] = pd.to_datetime(df["timestamp"]).map(lambda dt: dt.timestamp())
+    df = df.set_index("timestamp").sort_index().loc[:experiment_end_time]
+    response_time = df[COL_RESPONSE_TIME].dropna().to_numpy(dtype=float)
+    failure_rate = df[COL_FAILURE_RATE].dropna().to_numpy(dtype=float)
+    start_failure_index = int(np.abs(df.index - failure_injection_time).argmin())
+    return find_disruption_index_by_test(
+        start_failure_index,
+        normal_response_time,
+        response_time,
+        normal_failure_rate,
+        failure_rate,
+    )
+
+
+def gen_disruptive_indices(
+    df_failure_injection_log: pd.DataFrame,
+    path_normal_csv: str,
+    path_failure_dataset: str,
+    num_processes: int = 8,
+) -> pd.DataFrame:
+    """
+    Compute disruption indices of all failure experiments in parallel.
+
+    Parameters
+    ----------
+    df_failure_injection_log : DataFrame
+        failure injection logs with columns folder_name, failure_begin_timestamp
+        and experiment_end_timestamp
+    path_normal_csv : str
+        path to the merged normal dataset used as the reference sample
+    path_failure_dataset : str
+        path to the folder of failure experiments
+    num_processes : int
+        the maximum number of worker processes
+
+    Returns
+    -------
+    DataFrame
+        a copy of the failure injection logs with the column Disruption
+    """
+    df_normal = read_locust_columns(path_normal_csv)
+    normal_response_time = df_normal[COL_RESPONSE_TIME].dropna().to_numpy(dtype=float)
+    normal_failure_rate = df_normal[COL_FAILURE_RATE].dropna().to_numpy(dtype=float)
+    inputs = [
+        (
+            path_failure_dataset,
+            row["folder_name"],
+            row["failure_begin_timestamp"],
+            row["experiment_end_timestamp"],
+            normal_response_time,
+            normal_failure_rate,
+        )
+        for _, row in df_failure_injection_log.iterrows()
+    ]
+    num_processes = max(min(len(inputs), num_processes), 1)
+    with Pool(processes=num_processes) as pool:
+        disruptive_indices = pool.starmap(compute_disruption_index, inputs)
+    df_failure_disruption = df_failure_injection_log.copy()
+    df_failure_disruption["Disruption"] = disruptive_indices
+    return df_failure_disruption
+
+
+def main():
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s %(levelname)s:%(message)s",
+    )
+    path_normal_csv = (
+        "/Users/ketaiqiu/Projects/train-ticket/dataset/normal-2weeks/normal-2weeks.csv"
+    )
+    path_failure_dataset = (
+        "/Users/ketaiqiu/Projects/train-ticket/dataset/failure-experiments"
+    )
+    df_failure_injection_log = pd.read_csv(
+        os.path.join(path_failure_dataset, "failure-injection-logs.csv")
+    )
+    df_failure_disruption = gen_disruptive_indices(
+        df_failure_injection_log, path_normal_csv, path_failure_dataset
+    )
+    df_failure_disruption.to_csv(
+        os.path.join(
+            path_failure_dataset, "failure-injection-logs-with-disruption.csv"
+        ),
+        index=False,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,6 @@
+from enum import Enum
+
+
+class Engine(Enum):
+    PANDAS = 0
+    POLARS = 1
@@ -0,0 +1,77 @@
+import multiprocessing
+from multiprocessing.pool import Pool
+
+
+class ExperimentContext:
+    """
+    Context shared by all workers processing experiments: parsed YAML files,
+    metric type maps, constant metrics and metadata of nodes and pods.
+
+    The parent process loads the context once and publishes it before a pool
+    is created. Where workers are forked, they inherit the published context
+    copy-on-write, so they neither read these files again nor duplicate the
+    arrays in memory. Otherwise each worker receives a copy once.
+    Workers must treat every item as read-only, so files written while
+    processing, such as aggregation records, are not part of the context.
+    """
+
+    KIND_EXP_YAML = "exp_yaml"
+    KIND_METADATA_YAML = "metadata_yaml"
+    KIND_METRIC_TYPE_MAP = "metric_type_map"
+    KIND_CONSTANT_METRICS = "constant_metrics"
+    KIND_NODES_METADATA = "nodes_metadata"
+    KIND_PODS_METADATA = "pods_metadata"
+
+    # the context published in this process
+    _published = None
+
+    def __init__(self):
+        self.items = {}
+
+    def add(self, kind: str, key, value):
+        self.items.setdefault(kind, {})[key] = value
+
+    @staticmethod
+    def publish(context: "ExperimentContext"):
+        """Publish a context to this process and processes forked afterwards."""
+        ExperimentContext._published = context
+
+    @staticmethod
+    def unpublish():
+        """Remove the published context, e.g. after its pool finished."""
+        ExperimentContext._published = None
+
+    @staticmethod
+    def lookup(kind: str, key):
+        """
+        Look up an item of the published context.
+
+        Returns
+        -------
+        object | None
+            the shared item, None if no context is published or the item is
+            not part of it
+        """
+        if ExperimentContext._published is None:
+            return None
+        return ExperimentContext._published.items.get(kind, {}).get(key)
+
+    @staticmethod
+    def create_pool(context: "ExperimentContext", processes: int) -> Pool:
+        """
+        Create a pool of workers sharing a context with the default start
+        method of the platform.
+
+        Forked workers inherit the context published in this process, workers
+        started otherwise, e.g. spawned on macOS, receive it once through the
+        pool initializer.
+        """
+        mp_context = multiprocessing.get_context()
+        if mp_context.get_start_method() == "fork":
+            ExperimentContext.publish(context)
+            return mp_context.Pool(processes=processes)
+        return mp_context.Pool(
+            processes=processes,
+            initializer=ExperimentContext.publish,
+            initargs=(context,),
+        )
@@ -0,0 +1,316 @@
+import logging
+import os
+import re
+import sqlite3
+
+import pandas as pd
+
+from app.feature_matrix import FeatureMatrix
+from app.gcloud_metrics import GCloudMetrics
+from app.sparse_kpis import SparseKpis
+
+
+class ExperimentSql:
+    """
+    An embedded SQLite database over the combined, aggregated and merged
+    outputs of experiments, queried in process without a server.
+
+    Outputs are stored in a long format of (timestamp, column, value), as wide
+    outputs exceed the column limit of SQLite, and only observed values are
+    kept. Indices lead with the experiment and the column, so a query filtered
+    by columns and a time range only reads the rows of those columns in that
+    range. Label columns are parsed once at registration:
+
+    - kpi_labels: labels of combined KPIs from the KPI maps
+    - columns and column_groups: metric index, aggregation method and group
+      labels of merged columns as in the feature matrix catalog
+    - merged_labeled: merged values with the parsed columns
+    - experiments: names and time windows of registered experiments in UTC
+
+    For example, the maximum container CPU of ts-auth-service per experiment
+    within its window::
+
+        SELECT m.experiment, MAX(m.value) FROM merged_labeled m
+        JOIN column_groups g USING (experiment, column)
+        JOIN experiments e USING (experiment)
+        WHERE m.metric_index = 102 AND m.method = 'max'
+        AND g.name = 'container_name' AND g.value = 'ts-auth-service'
+        AND m.timestamp BETWEEN e.start AND e.end
+        GROUP BY m.experiment
+
+    Files are registered again only if they changed since their registration.
+    """
+
+    # rows of a wide CSV melted at a time
+    CHUNK_SIZE = 1000
+    PATTERN_METRIC = re.compile(r"^metric-(\d+)\.csv$")
+    PATTERN_KPI_MAP = re.compile(r"^metric-(\d+)-kpi-map\.csv$")
+    PATTERN_SPARSE = re.compile(
+        r"^metric-(\d+)" + re.escape(SparseKpis.FNAME_SUFFIX) + "$"
+    )
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS sources (path TEXT PRIMARY KEY, mtime REAL);
+        CREATE TABLE IF NOT EXISTS experiments (
+            experiment TEXT PRIMARY KEY, filename_exp_yaml TEXT,
+            start TEXT, end TEXT
+        );
+        CREATE TABLE IF NOT EXISTS kpi_labels (
+            experiment TEXT, metric_index INTEGER, kpi_index INTEGER,
+            label TEXT, value TEXT
+        );
+        CREATE INDEX IF NOT EXISTS kpi_labels_lookup
+            ON kpi_labels (label, value, experiment, metric_index);
+        CREATE TABLE IF NOT EXISTS combined (
+            experiment TEXT, metric_index INTEGER, kpi_index INTEGER,
+            field TEXT, timestamp TEXT, value REAL
+        );
+        CREATE INDEX IF NOT EXISTS combined_lookup
+            ON combined (experiment, metric_index, kpi_index, timestamp);
+        CREATE TABLE IF NOT EXISTS aggregated (
+            experiment TEXT, metric_index INTEGER, column TEXT,
+            timestamp TEXT, value REAL
+        );
+        CREATE INDEX IF NOT EXISTS aggregated_lookup
+            ON aggregated (experiment, metric_index, column, timestamp);
+        CREATE TABLE IF NOT EXISTS merged (
+            experiment TEXT, column TEXT, timestamp TEXT, value REAL
+        );
+        CREATE INDEX IF NOT EXISTS merged_lookup
+            ON merged (experiment, column, timestamp);
+        CREATE TABLE IF NOT EXISTS columns (
+            experiment TEXT, column TEXT, metric_index INTEGER, field TEXT,
+            method TEXT, label TEXT, PRIMARY KEY (experiment, column)
+        );
+        CREATE TABLE IF NOT EXISTS column_groups (
+            experiment TEXT, column TEXT, name TEXT, value TEXT
+        );
+        CREATE INDEX IF NOT EXISTS column_groups_lookup
+            ON column_groups (name, value, experiment, column);
+        CREATE VIEW IF NOT EXISTS merged_labeled AS
+            SELECT m.experiment, m.column, c.metric_index, c.field, c.method,
+                c.label, m.timestamp, m.value
+            FROM merged m JOIN columns c USING (experiment, column);
+    """
+
+    def __init__(self, path_database: str):
+        self.path_database = path_database
+        self.connection = sqlite3.connect(path_database)
+        self.connection.executescript(ExperimentSql.SCHEMA)
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self) -> "ExperimentSql":
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def query(self, sql: str, params: tuple = ()) -> pd.DataFrame:
+        return pd.read_sql_query(sql, self.connection, params=params)
+
+    def select_merged(
+        self, experiment: str, columns: list, start=None, end=None
+    ) -> pd.DataFrame:
+        """
+        Select merged columns of an experiment within a time range, both bounds
+        inclusive, into a wide DataFrame indexed by timestamp.
+        """
+        sql = (
+            "SELECT timestamp, column, value FROM merged WHERE experiment = ? "
+            f'AND column IN ({",".join("?" * len(columns))})'
+        )
+        params = [experiment, *columns]
+        if start is not None:
+            sql += " AND timestamp >= ?"
+            params.append(ExperimentSql.format_timestamp(start))
+        if end is not None:
+            sql += " AND timestamp <= ?"
+            params.append(ExperimentSql.format_timestamp(end))
+        df = self.query(sql, tuple(params))
+        return (
+            df.pivot(index="timestamp", columns="column", values="value")
+            .reindex(columns=columns)
+            .sort_index()
+        )
+
+    @staticmethod
+    def format_timestamp(ts) -> str:
+        """Format a timestamp as stored in outputs, i.e. in UTC without a zone."""
+        ts = pd.Timestamp(ts)
+        if ts.tzinfo is not None:
+            ts = ts.tz_convert("UTC").tz_localize(None)
+        return str(ts)
+
+    def register(self, filename_exp_yaml: str):
+        """Register the outputs of all experiments in an experiment YAML."""
+        gcloud_metrics = GCloudMetrics(filename_exp_yaml)
+        for experiment in gcloud_metrics.experiments:
+            path_experiment = gcloud_metrics.build_path_experiment(experiment["name"])
+            if path_experiment is None:
+                logging.warning(f'Experiment {experiment["name"]} does not exist!')
+                continue
+            self.connection.execute(
+                "INSERT OR REPLACE INTO experiments VALUES (?, ?, ?, ?)",
+                (
+                    experiment["name"],
+                    filename_exp_yaml,
+                    ExperimentSql.format_timestamp(experiment["start"]),
+                    ExperimentSql.format_timestamp(experiment["end"]),
+                ),
+            )
+            self.register_experiment(experiment["name"], path_experiment)
+        self.connection.commit()
+
+    def register_experiment(self, exp_name: str, path_experiment: str):
+        path_combined = os.path.join(path_experiment, GCloudMetrics.FDNAME_MERGED_KPIS)
+        for filename in ExperimentSql.list_files(path_combined):
+            path = os.path.join(path_combined, filename)
+            match_kpi_map = ExperimentSql.PATTERN_KPI_MAP.match(filename)
+            match_metric = ExperimentSql.PATTERN_METRIC.match(
+                filename
+            ) or ExperimentSql.PATTERN_SPARSE.match(filename)
+            if match_kpi_map is not None:
+                self.register_file(
+                    path,
+                    "kpi_labels",
+                    (exp_name, int(match_kpi_map.group(1))),
+                    self.insert_kpi_labels,
+                )
+            elif match_metric is not None:
+                self.register_file(
+                    path,
+                    "combined",
+                    (exp_name, int(match_metric.group(1))),
+                    self.insert_combined,
+                )
+        path_aggregated = os.path.join(
+            path_experiment, GCloudMetrics.FDNAME_AGGREGATED_KPIS
+        )
+        for filename in ExperimentSql.list_files(path_aggregated):
+            match_metric = ExperimentSql.PATTERN_METRIC.match(filename)
+            if match_metric is not None:
+                self.register_file(
+                    os.path.join(path_aggregated, filename),
+                    "aggregated",
+                    (exp_name, int(match_metric.group(1))),
+                    self.insert_aggregated,
+                )
+        path_merged = os.path.join(path_experiment, f"{exp_name}.csv")
+        if os.path.exists(path_merged):
+            self.register_file(path_merged, "merged", (exp_name,), self.insert_merged)
+
+    @staticmethod
+    def list_files(path_folder: str) -> list:
+        return sorted(os.listdir(path_folder)) if os.path.exists(path_folder) else []
+
+    def register_file(self, path: str, table: str, key: tuple, insert):
+        """Replace the rows of a file in a table if the file changed."""
+        mtime = os.path.getmtime(path)
+        row = self.connection.execute(
+            "SELECT mtime FROM sources WHERE path = ?", (path,)
+        ).fetchone()
+        if row is not None and row[0] == mtime:
+            return
+        logging.info(f"Registering {path} ...")
+        conditions = " AND ".join(["experiment = ?", "metric_index = ?"][: len(key)])
+        self.connection.execute(f"DELETE FROM {table} WHERE {conditions}", key)
+        if table == "merged":
+            for table_columns in ["columns", "column_groups"]:
+                self.connection.execute(
+                    f"DELETE FROM {table_columns} WHERE experiment = ?", key
+                )
+        insert(path, *key)
+        self.connection.execute(
+            "INSERT OR REPLACE INTO sources VALUES (?, ?)", (path, mtime)
+        )
+        self.connection.commit()
+
+    @staticmethod
+    def iter_long_chunks(path_csv: str):
+        """Yield chunks of a wide CSV as observed (timestamp, column, value)."""
+        for df_chunk in pd.read_csv(path_csv, chunksize=ExperimentSql.CHUNK_SIZE):
+            df_long = df_chunk.melt(
+                id_vars="timestamp", var_name="column", value_name="value"
+            ).dropna(subset=["value"])
+            df_long["timestamp"] = df_long["timestamp"].astype(str)
+            yield df_long
+
+    def insert_kpi_labels(self, path: str, exp_name: str, metric_index: int):
+        df_kpi_map = pd.read_csv(path)
+        df_labels = df_kpi_map.melt(
+            id_vars="kpi_index", var_name="label", value_name="value"
+        ).dropna(subset=["value"])
+        df_labels["value"] = df_labels["value"].astype(str)
+        df_labels.assign(experiment=exp_name, metric_index=metric_index)[
+            ["experiment", "metric_index", "kpi_index", "label", "value"]
+        ].to_sql("kpi_labels", self.connection, if_exists="append", index=False)
+
+    def insert_combined(self, path: str, exp_name: str, metric_index: int):
+        if path.endswith(SparseKpis.FNAME_SUFFIX):
+            df_wide = SparseKpis.load(path).to_wide()
+            df_wide.index = df_wide.index.astype(str)
+            chunks = [
+                df_wide.rename_axis("timestamp")
+                .reset_index()
+                .melt(id_vars="timestamp", var_name="column", value_name="value")
+                .dropna(subset=["value"])
+            ]
+        else:
+            chunks = ExperimentSql.iter_long_chunks(path)
+        for df_long in chunks:
+            kpi_columns = df_long["column"].str.extract(SparseKpis.PATTERN_COLUMN)
+            df_long.assign(
+                experiment=exp_name,
+                metric_index=metric_index,
+                kpi_index=kpi_columns[0].astype(int),
+                field=kpi_columns[1],
+            )[
+                [
+                    "experiment",
+                    "metric_index",
+                    "kpi_index",
+                    "field",
+                    "timestamp",
+                    "value",
+                ]
+            ].to_sql(
+                "combined", self.connection, if_exists="append", index=False
+            )
+
+    def insert_aggregated(self, path: str, exp_name: str, metric_index: int):
+        for df_long in ExperimentSql.iter_long_chunks(path):
+            df_long.assign(experiment=exp_name, metric_index=metric_index)[
+                ["experiment", "metric_index", "column", "timestamp", "value"]
+            ].to_sql("aggregated", self.connection, if_exists="append", index=False)
+
+    def insert_merged(self, path: str, exp_name: str):
+        columns = pd.read_csv(path, nrows=0).columns.drop("timestamp")
+        list_column = []
+        list_group = []
+        for column in columns:
+            item = FeatureMatrix.parse_column(column)
+            list_column.append(
+                (
+                    exp_name,
+                    column,
+                    item["metric_index"],
+                    item["field"],
+                    item["method"],
+                    item["label"],
+                )
+            )
+            list_group.extend(
+                (exp_name, column, name, value)
+                for name, value in item["groups"].items()
+            )
+        self.connection.executemany(
+            "INSERT INTO columns VALUES (?, ?, ?, ?, ?, ?)", list_column
+        )
+        self.connection.executemany(
+            "INSERT INTO column_groups VALUES (?, ?, ?, ?)", list_group
+        )
+        for df_long in ExperimentSql.iter_long_chunks(path):
+            df_long.assign(experiment=exp_name)[
+                ["experiment", "column", "timestamp", "value"]
+            ].to_sql("merged", self.connection, if_exists="append", index=False)
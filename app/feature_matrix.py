@@ -0,0 +1,288 @@
+import json
+import os
+import re
+
+import numpy as np
+import pandas as pd
+
+
+class FeatureMatrix:
+    """
+    A memory-mapped float32 matrix (time x columns) of a merged experiment
+    with a catalog of its columns.
+
+    The matrix is stored in column-major order, so reading a few columns of a
+    wide experiment only touches the pages of those columns.
+    """
+
+    FNAME_MATRIX_SUFFIX = ".npy"
+    FNAME_TIMESTAMPS_SUFFIX = "-timestamps.npy"
+    FNAME_CATALOG_SUFFIX = "-catalog.json"
+    DTYPE = np.float32
+    AGG_METHODS = [
+        "first_quartile",
+        "third_quartile",
+        "median",
+        "count",
+        "mean",
+        "min",
+        "max",
+        "sum",
+    ]
+    PATTERN_METRIC_COLUMN = re.compile(r"^metric-(\d+)-(.*)$")
+    PATTERN_PERCENTILE = re.compile(r"^(.*?)-?(percentile_\d+)$")
+    PATTERN_DISTRIBUTION = re.compile(
+        r"^(.*?)-?distribut_(count|mean|sum_of_squared_deviation)$"
+    )
+    PATTERN_ROLLING = re.compile(r"^(.*)-rolling_(\d+)m_([a-z]+)$")
+    PATTERN_GROUP = re.compile(r"([A-Z][A-Z0-9_]*)-(.*?)(?=-[A-Z][A-Z0-9_]*-|$)")
+
+    def __init__(self, path_prefix: str):
+        self.path_prefix = path_prefix
+        self.matrix = np.load(
+            path_prefix + FeatureMatrix.FNAME_MATRIX_SUFFIX, mmap_mode="r"
+        )
+        with open(path_prefix + FeatureMatrix.FNAME_CATALOG_SUFFIX) as file_catalog:
+            catalog = json.load(file_catalog)
+        self.catalog = pd.DataFrame(catalog["columns"])
+        # row ranges of experiments, the whole matrix is one experiment by default
+        self.segments = catalog.get("segments") or [
+            {
+                "name": os.path.basename(path_prefix),
+                "start": 0,
+                "end": self.matrix.shape[0],
+            }
+        ]
+        path_timestamps = path_prefix + FeatureMatrix.FNAME_TIMESTAMPS_SUFFIX
+        self.timestamps = (
+            np.load(path_timestamps) if os.path.exists(path_timestamps) else None
+        )
+
+    @staticmethod
+    def build_path_prefix(path_csv: str) -> str:
+        return path_csv.removesuffix(".csv")
+
+    @staticmethod
+    def parse_column(column: str) -> dict:
+        """
+        Parse a merged column name into its metric index, group labels,
+        distribution field and aggregation method.
+
+        Group names are upper case and group values are lower case, e.g.
+        metric-102-CONTAINER_NAME-ts-auth-service-POD_PHASE-running-max.
+        """
+        item = {
+            "column": column,
+            "metric_index": None,
+            "groups": {},
+            "field": None,
+            "method": None,
+            "label": None,
+        }
+        match_rolling = FeatureMatrix.PATTERN_ROLLING.match(column)
+        if match_rolling is not None:
+            # rolling statistics of a merged column
+            column, window, statistic = match_rolling.groups()
+            item["rolling_window"] = int(window)
+            item["rolling_statistic"] = statistic
+        match = FeatureMatrix.PATTERN_METRIC_COLUMN.match(column)
+        if match is None:
+            # e.g. locust statistics
+            item["label"] = column
+            return item
+        item["metric_index"] = int(match.group(1))
+        rest = match.group(2)
+        match_percentile = FeatureMatrix.PATTERN_PERCENTILE.match(rest)
+        if match_percentile is not None:
+            rest, item["method"] = match_percentile.groups()
+        else:
+            for method in FeatureMatrix.AGG_METHODS:
+                if rest == method or rest.endswith("-" + method):
+                    item["method"] = method
+                    rest = rest.removesuffix(method).removesuffix("-")
+                    break
+        match_distribution = FeatureMatrix.PATTERN_DISTRIBUTION.match(rest)
+        if match_distribution is not None:
+            rest, item["field"] = match_distribution.groups()
+        groups = {
+            name.lower(): value
+            for name, value in FeatureMatrix.PATTERN_GROUP.findall(rest)
+        }
+        if groups:
+            item["groups"] = groups
+        elif rest:
+            # columns renamed to a single KPI label, e.g. a container name
+            item["label"] = rest
+        return item
+
+    @staticmethod
+    def write(df: pd.DataFrame, path_prefix: str, experiments: pd.Series = None):
+        """
+        Write a merged DataFrame as a float32 memory-mapped matrix with a column
+        catalog and, if the index holds timestamps, a timestamp array.
+
+        Parameters
+        ----------
+        df : DataFrame
+            the merged DataFrame
+        path_prefix : str
+            the path of output files without suffixes
+        experiments : Series
+            the experiment name of each row if df concatenates several experiments,
+            recorded as row ranges in the catalog
+        """
+        timestamps = None
+        if not isinstance(df.index, pd.RangeIndex):
+            timestamps = pd.to_datetime(df.index, format="ISO8601", utc=True)
+            timestamps = timestamps.tz_localize(None).to_numpy(dtype="datetime64[s]")
+        segments = None
+        if experiments is not None:
+            names = experiments.to_numpy()
+            starts = np.flatnonzero(np.r_[True, names[1:] != names[:-1]])
+            ends = np.r_[starts[1:], len(names)]
+            segments = [
+                {"name": str(names[start]), "start": int(start), "end": int(end)}
+                for start, end in zip(starts, ends)
+            ]
+        matrix = FeatureMatrix.create(
+            path_prefix,
+            len(df),
+            [str(column) for column in df.columns],
+            timestamps,
+            segments,
+        )
+        # fill column by column to avoid a float64 copy of the whole frame
+        for position in range(len(df.columns)):
+            matrix[:, position] = df.iloc[:, position].to_numpy(
+                dtype=FeatureMatrix.DTYPE, na_value=np.nan
+            )
+        matrix.flush()
+
+    @staticmethod
+    def create(
+        path_prefix: str,
+        num_rows: int,
+        columns: list,
+        timestamps: np.ndarray = None,
+        segments: list = None,
+    ) -> np.memmap:
+        """
+        Create an empty feature matrix with its catalog and timestamps.
+
+        Returns
+        -------
+        memmap
+            the writable matrix to be filled by the caller
+        """
+        if timestamps is not None:
+            np.save(path_prefix + FeatureMatrix.FNAME_TIMESTAMPS_SUFFIX, timestamps)
+        elif os.path.exists(path_prefix + FeatureMatrix.FNAME_TIMESTAMPS_SUFFIX):
+            os.remove(path_prefix + FeatureMatrix.FNAME_TIMESTAMPS_SUFFIX)
+        catalog_columns = []
+        for position, column in enumerate(columns):
+            item = FeatureMatrix.parse_column(column)
+            item["position"] = position
+            catalog_columns.append(item)
+        with open(
+            path_prefix + FeatureMatrix.FNAME_CATALOG_SUFFIX, "w"
+        ) as file_catalog:
+            json.dump(
+                {
+                    "shape": [num_rows, len(columns)],
+                    "dtype": np.dtype(FeatureMatrix.DTYPE).name,
+                    "columns": catalog_columns,
+                    "segments": segments,
+                },
+                file_catalog,
+            )
+        return np.lib.format.open_memmap(
+            path_prefix + FeatureMatrix.FNAME_MATRIX_SUFFIX,
+            mode="w+",
+            dtype=FeatureMatrix.DTYPE,
+            shape=(num_rows, len(columns)),
+            fortran_order=True,
+        )
+
+    def find_columns(self, pattern: str = None, metric_index: int = None) -> list:
+        """Find positions of columns matching a regex pattern and a metric index."""
+        mask = np.ones(len(self.catalog), dtype=bool)
+        if pattern is not None:
+            mask &= self.catalog["column"].str.contains(pattern, regex=True).to_numpy()
+        if metric_index is not None:
+            mask &= (self.catalog["metric_index"] == metric_index).to_numpy()
+        return self.catalog.loc[mask, "position"].to_list()
+
+    def find_rows(self, start=None, end=None) -> slice:
+        """
+        Find the row range between start and end, both inclusive. Bounds are
+        timestamps if the matrix has timestamps, otherwise row positions.
+        """
+        if self.timestamps is None:
+            return slice(start, None if end is None else end + 1)
+        start_row = (
+            0
+            if start is None
+            else np.searchsorted(self.timestamps, FeatureMatrix.to_datetime64(start))
+        )
+        end_row = (
+            len(self.timestamps)
+            if end is None
+            else np.searchsorted(
+                self.timestamps, FeatureMatrix.to_datetime64(end), side="right"
+            )
+        )
+        return slice(start_row, end_row)
+
+    @staticmethod
+    def to_datetime64(ts) -> np.datetime64:
+        ts = pd.Timestamp(ts)
+        if ts.tzinfo is not None:
+            ts = ts.tz_convert("UTC").tz_localize(None)
+        return ts.to_datetime64().astype("datetime64[s]")
+
+    def select(
+        self, pattern: str = None, start=None, end=None, metric_index: int = None
+    ) -> np.ndarray:
+        """
+        Select columns by pattern or metric index within a time range.
+
+        Returns
+        -------
+        ndarray
+            a read-only view on the memory map if the selected columns are
+            adjacent, otherwise an array gathered only from the selected columns
+        """
+        rows = self.find_rows(start, end)
+        positions = self.find_columns(pattern, metric_index)
+        if not positions:
+            return self.matrix[rows, 0:0]
+        if positions[-1] - positions[0] + 1 == len(positions):
+            return self.matrix[rows, positions[0] : positions[-1] + 1]
+        return self.matrix[rows][:, positions]
+
+    def select_columns(
+        self, pattern: str = None, start=None, end=None, metric_index: int = None
+    ) -> dict:
+        """Select columns as a dict of zero-copy 1-D views keyed by column name."""
+        rows = self.find_rows(start, end)
+        return {
+            self.catalog.loc[position, "column"]: self.matrix[rows, position]
+            for position in self.find_columns(pattern, metric_index)
+        }
+
+    def to_frame(
+        self, pattern: str = None, start=None, end=None, metric_index: int = None
+    ) -> pd.DataFrame:
+        """Select columns into a DataFrame indexed by timestamp."""
+        rows = self.find_rows(start, end)
+        positions = self.find_columns(pattern, metric_index)
+        index = (
+            pd.Index(self.timestamps[rows], name="timestamp")
+            if self.timestamps is not None
+            else None
+        )
+        return pd.DataFrame(
+            self.select(pattern, start, end, metric_index),
+            index=index,
+            columns=self.catalog.loc[positions, "column"].to_list(),
+        )
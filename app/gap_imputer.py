@@ -0,0 +1,317 @@
+import logging
+
+import numpy as np
+import pandas as pd
+
+from app.feature_matrix import FeatureMatrix
+
+
+class GapImputer:
+    """
+    Reindex a merged feature matrix to the exact minute grid of each of its
+    experiments, report the gaps of every column and impute them.
+
+    Each experiment segment is reindexed to the minutes from its start to its
+    end, so minutes missing in all metrics become gaps as well. Gap statistics
+    and imputation run on a block of columns at a time as array operations
+    over all columns of the block, and gaps never cross segments.
+
+    Policies:
+    - ffill: carry the last value forward for at most limit minutes
+    - linear: interpolate gaps of at most limit minutes between two values
+    - zero: fill all gaps with zeros, e.g. for counters without increments
+    - none: keep gaps
+    """
+
+    FNAME_SUFFIX = "-imputed"
+    FNAME_REPORT_SUFFIX = "-gaps.csv"
+    SUPPORTED_POLICIES = {"ffill", "linear", "zero", "none"}
+    MINUTE = np.timedelta64(60, "s")
+
+    def __init__(
+        self,
+        policies: dict = None,
+        counter_metrics: set = None,
+        limit: int = 5,
+        block_size: int = 1024,
+    ):
+        """
+        Parameters
+        ----------
+        policies : dict
+            policies keyed by regex patterns of columns, where the first
+            matching pattern applies; other columns of counter metrics are
+            filled with zeros and the rest forward
+        counter_metrics : set
+            indices of cumulative and delta metrics
+        limit : int
+            the number of minutes filled forward or the longest gap
+            interpolated, unlimited if None
+        block_size : int
+            the number of columns processed at once to bound memory
+        """
+        self.policies = policies if policies is not None else {}
+        unsupported = set(self.policies.values()) - GapImputer.SUPPORTED_POLICIES
+        if unsupported:
+            raise ValueError(f"Imputation policies {unsupported} are not supported!")
+        self.counter_metrics = counter_metrics if counter_metrics is not None else set()
+        self.limit = limit
+        self.block_size = block_size
+
+    def select_policies(self, catalog: pd.DataFrame) -> np.ndarray:
+        """Select the policy of each column of a catalog."""
+        policies = np.where(
+            catalog["metric_index"].isin(self.counter_metrics).to_numpy(),
+            "zero",
+            "ffill",
+        ).astype(object)
+        selected = np.zeros(len(catalog), dtype=bool)
+        for pattern, policy in self.policies.items():
+            matched = catalog["column"].str.contains(pattern, regex=True).to_numpy()
+            policies[matched & ~selected] = policy
+            selected |= matched
+        return policies
+
+    @staticmethod
+    def to_minute(ts, ceil: bool) -> np.datetime64:
+        """Convert a time to a UTC minute without time zone."""
+        ts = pd.Timestamp(ts)
+        if ts.tzinfo is not None:
+            ts = ts.tz_convert("UTC").tz_localize(None)
+        ts = ts.ceil("min") if ceil else ts.floor("min")
+        return np.datetime64(ts, "s")
+
+    @staticmethod
+    def build_grid(timestamps: np.ndarray, start=None, end=None) -> np.ndarray:
+        """Build the minutes from start to end, the first and last rows by default."""
+        if start is None and end is None and len(timestamps) == 0:
+            return np.array([], dtype="datetime64[s]")
+        first = GapImputer.to_minute(
+            timestamps.min() if start is None else start, ceil=True
+        )
+        last = GapImputer.to_minute(
+            timestamps.max() if end is None else end, ceil=False
+        )
+        return np.arange(first, last + GapImputer.MINUTE, GapImputer.MINUTE)
+
+    @staticmethod
+    def locate(
+        timestamps: np.ndarray, grid: np.ndarray
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Locate rows of a segment on its grid.
+
+        Returns
+        -------
+        tuple[ndarray, ndarray]
+            positions of rows on the grid and of the grid rows they fill
+        """
+        if len(grid) == 0:
+            return np.array([], dtype=np.int64), np.array([], dtype=np.int64)
+        offsets = (timestamps - grid[0]) / GapImputer.MINUTE
+        on_grid = (
+            (offsets == np.round(offsets)) & (offsets >= 0) & (offsets < len(grid))
+        )
+        return np.flatnonzero(on_grid), offsets[on_grid].astype(np.int64)
+
+    @staticmethod
+    def compute_gap_statistics(missing: np.ndarray) -> dict:
+        """
+        Compute gap statistics of all columns of a block at once.
+
+        Returns
+        -------
+        dict
+            arrays of the number of missing minutes, the number of gaps, the
+            longest gap and the leading and trailing missing minutes per column
+        """
+        num_rows, num_cols = missing.shape
+        if num_rows == 0:
+            zeros = np.zeros(num_cols, dtype=np.int64)
+            return {
+                "missing": zeros,
+                "gaps": zeros,
+                "longest_gap": zeros,
+                "leading": zeros,
+                "trailing": zeros,
+            }
+        valid = ~missing
+        starts = missing.copy()
+        starts[1:] &= valid[:-1]
+        # lengths of runs of missing minutes restart after each valid minute
+        counts = np.cumsum(missing, axis=0)
+        runs = counts - np.maximum.accumulate(np.where(valid, counts, 0), axis=0)
+        any_valid = valid.any(axis=0)
+        return {
+            "missing": counts[-1],
+            "gaps": starts.sum(axis=0),
+            "longest_gap": runs.max(axis=0),
+            "leading": np.where(any_valid, valid.argmax(axis=0), num_rows),
+            "trailing": np.where(any_valid, valid[::-1].argmax(axis=0), num_rows),
+        }
+
+    @staticmethod
+    def find_previous(valid: np.ndarray) -> np.ndarray:
+        """Find the row of the last valid value at or before each row, -1 if none."""
+        rows = np.arange(len(valid))[:, np.newaxis]
+        return np.maximum.accumulate(np.where(valid, rows, -1), axis=0)
+
+    @staticmethod
+    def find_next(valid: np.ndarray) -> np.ndarray:
+        """Find the row of the next valid value at or after each row, len if none."""
+        rows = np.arange(len(valid))[:, np.newaxis]
+        following = np.where(valid, rows, len(valid))[::-1]
+        return np.minimum.accumulate(following, axis=0)[::-1]
+
+    @staticmethod
+    def fill_forward(values: np.ndarray, limit: int = None) -> np.ndarray:
+        """Fill gaps of all columns with their last value as ffill(limit=limit)."""
+        missing = np.isnan(values)
+        previous = GapImputer.find_previous(~missing)
+        fill = missing & (previous >= 0)
+        if limit is not None:
+            fill &= np.arange(len(values))[:, np.newaxis] - previous <= limit
+        rows, cols = np.nonzero(fill)
+        filled = values.copy()
+        filled[rows, cols] = values[previous[rows, cols], cols]
+        return filled
+
+    @staticmethod
+    def fill_linear(values: np.ndarray, limit: int = None) -> np.ndarray:
+        """Interpolate gaps of all columns between the values around them."""
+        missing = np.isnan(values)
+        previous = GapImputer.find_previous(~missing)
+        following = GapImputer.find_next(~missing)
+        fill = missing & (previous >= 0) & (following < len(values))
+        if limit is not None:
+            fill &= following - previous - 1 <= limit
+        rows, cols = np.nonzero(fill)
+        before = values[previous[rows, cols], cols]
+        after = values[following[rows, cols], cols]
+        weights = (rows - previous[rows, cols]) / (
+            following[rows, cols] - previous[rows, cols]
+        )
+        filled = values.copy()
+        filled[rows, cols] = before + (after - before) * weights
+        return filled
+
+    def fill(self, values: np.ndarray, policies: np.ndarray) -> np.ndarray:
+        """Fill gaps of a block of columns by their policies."""
+        for policy in np.unique(policies):
+            selected = policies == policy
+            if policy == "ffill":
+                values[:, selected] = GapImputer.fill_forward(
+                    values[:, selected], self.limit
+                )
+            elif policy == "linear":
+                values[:, selected] = GapImputer.fill_linear(
+                    values[:, selected], self.limit
+                )
+            elif policy == "zero":
+                values[:, selected] = np.nan_to_num(values[:, selected], nan=0.0)
+        return values
+
+    def impute(
+        self, path_prefix_in: str, path_prefix_out: str = None, start=None, end=None
+    ) -> pd.DataFrame:
+        """
+        Impute a feature matrix on its minute grid into a new feature matrix
+        and write the gap report next to it.
+
+        Parameters
+        ----------
+        path_prefix_in : str
+            the path prefix of the merged feature matrix
+        path_prefix_out : str
+            the path prefix of the imputed feature matrix, the input path
+            prefix with the suffix -imputed by default
+        start, end : str | Timestamp
+            the window of the grid of a single experiment, otherwise each
+            segment spans its start_time and end_time if recorded or its first
+            and last rows
+
+        Returns
+        -------
+        DataFrame
+            gap statistics, the policy and the number of imputed minutes per
+            column
+        """
+        if path_prefix_out is None:
+            path_prefix_out = path_prefix_in + GapImputer.FNAME_SUFFIX
+        feature_matrix = FeatureMatrix(path_prefix_in)
+        if feature_matrix.timestamps is None:
+            raise ValueError(f"Feature matrix {path_prefix_in} has no timestamps!")
+        if (start is not None or end is not None) and len(feature_matrix.segments) > 1:
+            raise ValueError("A window is only supported for a single experiment!")
+        num_cols = feature_matrix.matrix.shape[1]
+        policies = self.select_policies(feature_matrix.catalog)
+
+        grids = []
+        segments = []
+        num_rows = 0
+        for segment in feature_matrix.segments:
+            timestamps = feature_matrix.timestamps[segment["start"] : segment["end"]]
+            grid = GapImputer.build_grid(
+                timestamps,
+                start if start is not None else segment.get("start_time"),
+                end if end is not None else segment.get("end_time"),
+            )
+            grids.append(grid)
+            segments.append({**segment, "start": num_rows, "end": num_rows + len(grid)})
+            num_rows += len(grid)
+        output = FeatureMatrix.create(
+            path_prefix_out,
+            num_rows,
+            feature_matrix.catalog["column"].to_list(),
+            np.concatenate(grids),
+            segments,
+        )
+
+        statistics = {
+            name: np.zeros(num_cols, dtype=np.int64)
+            for name in ["missing", "gaps", "longest_gap", "leading", "trailing"]
+        }
+        imputed = np.zeros(num_cols, dtype=np.int64)
+        for segment, segment_out, grid in zip(feature_matrix.segments, segments, grids):
+            rows_in, rows_grid = GapImputer.locate(
+                feature_matrix.timestamps[segment["start"] : segment["end"]], grid
+            )
+            rows_in += segment["start"]
+            rows_out = slice(segment_out["start"], segment_out["end"])
+            logging.info(
+                f'Imputing {len(grid) - len(rows_in)} missing minutes of {segment["name"]} ...'
+            )
+            for block_start in range(0, num_cols, self.block_size):
+                block = slice(block_start, min(block_start + self.block_size, num_cols))
+                values = np.full(
+                    (len(grid), block.stop - block.start), np.nan, dtype=np.float64
+                )
+                values[rows_grid] = feature_matrix.matrix[rows_in, block]
+                missing = np.isnan(values)
+                for name, values_statistic in GapImputer.compute_gap_statistics(
+                    missing
+                ).items():
+                    if name == "longest_gap":
+                        statistics[name][block] = np.maximum(
+                            statistics[name][block], values_statistic
+                        )
+                    else:
+                        statistics[name][block] += values_statistic
+                values = self.fill(values, policies[block])
+                imputed[block] += (missing & ~np.isnan(values)).sum(axis=0)
+                output[rows_out, block] = values
+        output.flush()
+
+        df_report = pd.DataFrame(
+            {
+                "column": feature_matrix.catalog["column"],
+                "policy": policies,
+                **statistics,
+                "imputed": imputed,
+            }
+        )
+        df_report.to_csv(path_prefix_out + GapImputer.FNAME_REPORT_SUFFIX, index=False)
+        logging.info(
+            f'Imputed {imputed.sum()} of {statistics["missing"].sum()} missing values.'
+        )
+        return df_report
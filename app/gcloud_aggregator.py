@@ -4,6 +4,7 @@ import os
 import re
 import warnings
 
+import numpy as np
 import pandas as pd
 import yaml
 from app.agg.compute_agg_handler import ComputeAggHandler
@@ -12,12 +13,29 @@ from app.agg.logging_agg_handler import LoggingAggHandler
 from app.agg.networking_agg_handler import NetworkingAggHandler
 from app.agg.prometheus_agg_handler import PrometheusAggHandler
 from app.agg.strategy import Strategy
+from app.chunked_kpis import ChunkedKpis
+from app.engine import Engine
+from app.experiment_context import ExperimentContext
+from app.feature_matrix import FeatureMatrix
+from app.gap_imputer import GapImputer
 from app.gcloud_metric_kind import GCloudMetricKind
 from app.gcloud_metrics import GCloudMetrics
+from app.metric_profiler import MetricProfiler
+from app.polars_kpis import PolarsKpis
+from app.rolling_features import RollingFeatures
+from app.sparse_kpis import SparseKpis
+from app.time_series_pyramid import TimeSeriesPyramid
 
 
 class GCloudAggregator(GCloudMetrics):
     PATH_CONSTANT_METRIC = os.path.join("aggregations", "constant_metrics.csv")
+    HANDLER_PREFIXES = {
+        "compute.googleapis.com": "compute",
+        "kubernetes.io": "kubernetes",
+        "logging.googleapis.com": "logging",
+        "networking.googleapis.com": "networking",
+        "prometheus.googleapis.com": "prometheus",
+    }
 
     def __init__(
         self,
@@ -28,8 +46,20 @@ class GCloudAggregator(GCloudMetrics):
         for_normal_dataset: bool,
         enforce_existing_aggregations: bool,
         only_pod_metrics: bool = False,
+        dtype: str = None,
+        memory_budget: int = None,
+        engine: Engine = Engine.PANDAS,
+        profiler: MetricProfiler = None,
     ):
         super().__init__(filename_exp_yaml)
+        # read, aggregate and store values as float32 if set, float64 by default
+        self.dtype = dtype
+        # aggregate combined metrics in chunks of at most this number of bytes
+        self.memory_budget = memory_budget
+        # read and aggregate combined metrics with Polars if set to Engine.POLARS
+        self.engine = engine
+        if engine == Engine.POLARS:
+            PolarsKpis.check_installed()
         self.experiment = self.experiments[exp_index]
         self.metadata = GCloudAggregator.parse_metadata_yaml(filename_metadata_yaml)
         self.strategy = strategy
@@ -51,49 +81,123 @@ class GCloudAggregator(GCloudMetrics):
         self.df_metric_type_map = self.read_metric_type_map(self.experiment["name"])
         self.for_normal_dataset = for_normal_dataset
         self.only_pod_metrics = only_pod_metrics
-        self.constant_metrics = pd.read_csv(GCloudAggregator.PATH_CONSTANT_METRIC)
+        # profile slow or selected metrics, configured by the environment by default
+        self.profiler = (
+            profiler if profiler is not None else MetricProfiler.from_environment()
+        )
+        self.constant_metrics = GCloudAggregator.read_constant_metrics()
 
     @staticmethod
     def parse_metadata_yaml(filename_metadata_yaml: str):
         """Parse the YAML file of metadata."""
+        metadata = ExperimentContext.lookup(
+            ExperimentContext.KIND_METADATA_YAML, filename_metadata_yaml
+        )
+        if metadata is not None:
+            return metadata
         path_metadata_yaml = os.path.join(
             GCloudMetrics.PATH_METADATA_YAML, filename_metadata_yaml
         )
         with open(path_metadata_yaml) as file_metadata_yaml:
             return yaml.safe_load(file_metadata_yaml)
 
-    def read_combined_kpis(self, metric_index: int) -> pd.DataFrame:
+    @staticmethod
+    def read_constant_metrics() -> pd.DataFrame:
+        constant_metrics = ExperimentContext.lookup(
+            ExperimentContext.KIND_CONSTANT_METRICS,
+            GCloudAggregator.PATH_CONSTANT_METRIC,
+        )
+        if constant_metrics is not None:
+            return constant_metrics
+        return pd.read_csv(GCloudAggregator.PATH_CONSTANT_METRIC)
+
+    def read_combined_kpis(
+        self, metric_index: int
+    ) -> pd.DataFrame | SparseKpis | ChunkedKpis | PolarsKpis:
+        sparse_metric_path = os.path.join(
+            self.combined_metrics_path,
+            f"metric-{metric_index}{SparseKpis.FNAME_SUFFIX}",
+        )
+        if os.path.exists(sparse_metric_path):
+            # handlers group and reduce directly from the long format
+            sparse_kpis = SparseKpis.load(sparse_metric_path)
+            return sparse_kpis if self.dtype is None else sparse_kpis.astype(self.dtype)
         metric_path = os.path.join(
             self.combined_metrics_path, f"metric-{metric_index}.csv"
         )
-        df_metric = pd.read_csv(metric_path)
+        if self.engine == Engine.POLARS:
+            return PolarsKpis.from_csv(
+                metric_path, np.float64 if self.dtype is None else self.dtype
+            )
+        if self.memory_budget is not None:
+            # stream the metric into columns and read groups within the budget
+            return ChunkedKpis.from_csv(
+                metric_path,
+                self.memory_budget,
+                np.float64 if self.dtype is None else self.dtype,
+            )
+        df_metric = GCloudMetrics.read_values_csv(metric_path, self.dtype)
         df_metric["timestamp"] = pd.to_datetime(
             df_metric["timestamp"], format="ISO8601"
         )
         return df_metric.set_index("timestamp").sort_index()
 
+    def is_constant_metric(self, metric_index: int, metric_name: str) -> bool:
+        constant_metric = self.constant_metrics[
+            (self.constant_metrics["index"] == metric_index)
+            & (self.constant_metrics["name"] == metric_name)
+        ]
+        return not constant_metric.empty
+
     def aggregate_one_metric(self, metric_index: int):
         """Aggregate all available KPIs in one metric to reduce dimensionality."""
         metric_name = self.df_metric_type_map.loc[metric_index]["name"]
-        df_kpi_map = pd.read_csv(
-            os.path.join(
-                self.combined_metrics_path, f"metric-{metric_index}-kpi-map.csv"
+        df_kpi_map = GCloudMetrics.to_categorical(
+            pd.read_csv(
+                os.path.join(
+                    self.combined_metrics_path, f"metric-{metric_index}-kpi-map.csv"
+                )
             )
         )
-        df_metric = self.read_combined_kpis(metric_index)
-
         # skip constant metrics
-        constant_metric = self.constant_metrics[
-            (self.constant_metrics["index"] == metric_index)
-            & (self.constant_metrics["name"] == metric_name)
-        ]
-        if not constant_metric.empty:
+        if self.is_constant_metric(metric_index, metric_name):
             return
+        df_metric = self.read_combined_kpis(metric_index)
 
         logging.info(f"Aggregating metric {metric_index} {metric_name} ...")
+        try:
+            df_agg_metric = self.aggregate_kpis(
+                metric_index, metric_name, df_kpi_map, df_metric
+            )
+        finally:
+            # remove spilled columns even if a handler fails
+            if isinstance(df_metric, ChunkedKpis):
+                df_metric.remove()
+        if df_agg_metric is not None and not df_agg_metric.empty:
+            logging.info(f"KPIs after aggregation are {df_agg_metric.columns}")
+            df_agg_metric.to_csv(
+                os.path.join(self.aggregated_metrics_path, f"metric-{metric_index}.csv")
+            )
 
+    @staticmethod
+    def get_handler_name(metric_name: str) -> str | None:
+        """Get the name of the handler aggregating a metric by its source prefix."""
+        for prefix, handler_name in GCloudAggregator.HANDLER_PREFIXES.items():
+            if metric_name.startswith(prefix):
+                return handler_name
+        return None
+
+    def aggregate_kpis(
+        self,
+        metric_index: int,
+        metric_name: str,
+        df_kpi_map: pd.DataFrame,
+        df_metric: pd.DataFrame | SparseKpis | ChunkedKpis | PolarsKpis,
+    ) -> pd.DataFrame | None:
+        """Aggregate combined KPIs of one metric with the handler of its source."""
         df_agg_metric = None
-        if metric_name.startswith("compute.googleapis.com"):
+        handler_name = GCloudAggregator.get_handler_name(metric_name)
+        if handler_name == "compute":
             df_agg_metric = ComputeAggHandler(
                 metric_index,
                 metric_name,
@@ -101,7 +205,7 @@ class GCloudAggregator(GCloudMetrics):
                 df_metric,
                 self.enforce_existing_aggregations,
             ).aggregate_kpis()
-        elif metric_name.startswith("networking.googleapis.com"):
+        elif handler_name == "networking":
             df_agg_metric = NetworkingAggHandler(
                 metric_index,
                 metric_name,
@@ -111,7 +215,7 @@ class GCloudAggregator(GCloudMetrics):
                 self.strategy,
                 self.enforce_existing_aggregations,
             ).aggregate_kpis()
-        elif metric_name.startswith("prometheus.googleapis.com"):
+        elif handler_name == "prometheus":
             df_agg_metric = PrometheusAggHandler(
                 metric_index,
                 metric_name,
@@ -120,7 +224,7 @@ class GCloudAggregator(GCloudMetrics):
                 self.metadata,
                 self.enforce_existing_aggregations,
             ).aggregate_kpis()
-        elif metric_name.startswith("logging.googleapis.com"):
+        elif handler_name == "logging":
             df_agg_metric = LoggingAggHandler(
                 metric_index,
                 metric_name,
@@ -128,7 +232,7 @@ class GCloudAggregator(GCloudMetrics):
                 df_metric,
                 self.enforce_existing_aggregations,
             ).aggregate_kpis()
-        elif metric_name.startswith("kubernetes.io"):
+        elif handler_name == "kubernetes":
             df_agg_metric = KubernetesAggHandler(
                 metric_index,
                 metric_name,
@@ -139,12 +243,9 @@ class GCloudAggregator(GCloudMetrics):
             ).aggregate_kpis()
         else:
             logging.error(f"Metric {metric_name} is not supported!")
-
-        if df_agg_metric is not None and not df_agg_metric.empty:
-            logging.info(f"KPIs after aggregation are {df_agg_metric.columns}")
-            df_agg_metric.to_csv(
-                os.path.join(self.aggregated_metrics_path, f"metric-{metric_index}.csv")
-            )
+        if df_agg_metric is not None and self.dtype is not None:
+            df_agg_metric = df_agg_metric.astype(self.dtype)
+        return df_agg_metric
 
     def aggregate_all_metrics(self):
         """Aggregate all available metrics to reduce dimensionality."""
@@ -154,9 +255,16 @@ class GCloudAggregator(GCloudMetrics):
                 os.path.join(self.aggregated_metrics_path, f"metric-{metric_index}.csv")
             ):
                 continue
-            self.aggregate_one_metric(metric_index)
+            with self.profiler.profile(
+                self.build_path_experiment(self.experiment["name"]),
+                "aggregate",
+                metric_index,
+            ):
+                self.aggregate_one_metric(metric_index)
 
-    def merge_all_metrics(self, ignore_buffer: bool = False):
+    def merge_all_metrics(
+        self, ignore_buffer: bool = False, save_feature_matrix: bool = True
+    ):
         """
         Merge all metrics into one dataframe.
 
@@ -164,6 +272,9 @@ class GCloudAggregator(GCloudMetrics):
         ----------
         ignore_buffer : bool
             if set, ignore starting 1 hour and trailing 1 hour
+        save_feature_matrix : bool
+            if set, also save a memory-mapped feature matrix with a column catalog
+            and its pyramid of 5, 15 and 60 minutes
         """
         df_all_list = []
         metric_indices = self.get_metric_indices_from_aggregated_dataset()
@@ -172,7 +283,11 @@ class GCloudAggregator(GCloudMetrics):
             metric_path = os.path.join(
                 self.aggregated_metrics_path, f"metric-{metric_index}.csv"
             )
-            df_metric = pd.read_csv(metric_path).set_index("timestamp").sort_index()
+            df_metric = (
+                GCloudMetrics.read_values_csv(metric_path, self.dtype)
+                .set_index("timestamp")
+                .sort_index()
+            )
             df_all_list.append(df_metric.add_prefix(f"metric-{metric_index}-"))
         df_all = pd.concat(df_all_list, axis=1)
         if ignore_buffer:
@@ -182,6 +297,69 @@ class GCloudAggregator(GCloudMetrics):
         num_rows = len(df_all)
         print(f"{num_rows} rows x {num_cols} columns")
         df_all.to_csv(self.complete_time_series_path)
+        if save_feature_matrix:
+            path_prefix = FeatureMatrix.build_path_prefix(
+                self.complete_time_series_path
+            )
+            FeatureMatrix.write(df_all, path_prefix)
+            TimeSeriesPyramid.build(path_prefix)
+
+    def compute_rolling_features(
+        self, windows: list = None, statistics: list = None, block_size: int = 256
+    ):
+        """
+        Compute rolling statistics of all merged columns next to the merged file.
+
+        Parameters
+        ----------
+        windows : list
+            window lengths in minutes, 5, 15 and 60 by default
+        statistics : list
+            a subset of mean, std, min, max and slope, all by default
+        block_size : int
+            the number of columns processed at once to bound memory
+        """
+        RollingFeatures(windows, statistics, block_size).compute(
+            FeatureMatrix.build_path_prefix(self.complete_time_series_path)
+        )
+
+    def impute_gaps(
+        self, policies: dict = None, limit: int = 5, start=None, end=None
+    ) -> pd.DataFrame:
+        """
+        Impute the merged feature matrix on the minute grid of the experiment
+        next to the merged file, with a gap report per column.
+
+        Parameters
+        ----------
+        policies : dict
+            ffill, linear, zero or none keyed by regex patterns of columns;
+            columns of cumulative and delta metrics are filled with zeros and
+            other columns forward by default
+        limit : int
+            the number of minutes filled forward or the longest gap
+            interpolated
+        start, end : str
+            the window of the grid, the window of the experiment by default,
+            e.g. without the buffers dropped by merge_all_metrics
+
+        Returns
+        -------
+        DataFrame
+            the gap report
+        """
+        counter_metrics = set(
+            self.df_metric_type_map.index[
+                self.df_metric_type_map["kind"].isin(
+                    [GCloudMetricKind.CUMULATIVE.value, GCloudMetricKind.DELTA.value]
+                )
+            ]
+        )
+        return GapImputer(policies, counter_metrics, limit).impute(
+            FeatureMatrix.build_path_prefix(self.complete_time_series_path),
+            start=self.experiment["start"] if start is None else start,
+            end=self.experiment["end"] if end is None else end,
+        )
 
     def get_metric_indices_from_combined_dataset(self) -> list:
         metric_indices = [
@@ -1,12 +1,14 @@
-import jsonlines
 import json
+import numpy as np
 import pandas as pd
 import os
 import yaml
 from datetime import datetime
 import logging
 import sys
+import zipfile
 from json.decoder import JSONDecodeError
+from app.experiment_context import ExperimentContext
 
 
 class GCloudMetrics:
@@ -17,6 +19,10 @@ class GCloudMetrics:
     FNAME_KPI_PREFIX = "kpi-"
     FNAME_KPI_SUFFIX = ".csv"
     FNAME_KPI_MAP = "kpi_map.jsonl"
+    FDNAME_KPI_MAP_CACHE = "kpi_map_cache"
+    FNAME_POINTS_PREFIX = "points-"
+    FNAME_POINTS_CATALOG = "points.json"
+    FNAME_POINTS_OFFSETS = "offsets"
     FNAME_NODES_INFO = "nodes_info"
     FNAME_PODS_INFO = "pods_info"
     FDNAME_ORIGINAL_KPIS = "gcloud_metrics"
@@ -33,8 +39,14 @@ class GCloudMetrics:
         )
 
     def read_metric_type_map(self, exp_name: str) -> pd.DataFrame:
+        path_experiment = self.build_path_experiment(exp_name)
+        df_metric_type_map = ExperimentContext.lookup(
+            ExperimentContext.KIND_METRIC_TYPE_MAP, path_experiment
+        )
+        if df_metric_type_map is not None:
+            return df_metric_type_map
         path_metric_type_map = os.path.join(
-            self.build_path_experiment(exp_name),
+            path_experiment,
             GCloudMetrics.FDNAME_ORIGINAL_KPIS,
             GCloudMetrics.FNAME_METRIC_TYPE_MAP,
         )
@@ -69,6 +81,11 @@ class GCloudMetrics:
         """
         Parse the experiment YAML file.
         """
+        exp_yaml = ExperimentContext.lookup(
+            ExperimentContext.KIND_EXP_YAML, filename_exp_yaml
+        )
+        if exp_yaml is not None:
+            return exp_yaml
         path_exp_yaml = os.path.join(
             GCloudMetrics.PATH_EXPERIMENTS_YAML, filename_exp_yaml
         )
@@ -89,6 +106,12 @@ class GCloudMetrics:
         DataFrame
             metadata of nodes in pandas DataFrame, including name and instance_id
         """
+        df_nodes_metadata = ExperimentContext.lookup(
+            ExperimentContext.KIND_NODES_METADATA,
+            (self.path_experiments, experiment["start"], experiment["end"]),
+        )
+        if df_nodes_metadata is not None:
+            return df_nodes_metadata
         start_dt = datetime.fromisoformat(experiment["start"]).timestamp()
         end_dt = datetime.fromisoformat(experiment["end"]).timestamp()
         path_nodes_info = os.path.join(
@@ -139,6 +162,12 @@ class GCloudMetrics:
         DataFrame
             metadata of pods in pandas DataFrame, including names and phases
         """
+        df_pods_metadata = ExperimentContext.lookup(
+            ExperimentContext.KIND_PODS_METADATA,
+            (self.path_experiments, start_ts, end_ts),
+        )
+        if df_pods_metadata is not None:
+            return df_pods_metadata
         pods_metadata = {"timestamp": [], "pod_name": [], "pod_phase": []}
         path_pods_info = os.path.join(
             self.path_experiments, GCloudMetrics.FNAME_PODS_INFO
@@ -165,6 +194,11 @@ class GCloudMetrics:
         """
         Read KPI map for a metric type.
 
+        The JSONL file is parsed in one pass and string labels are stored as
+        categoricals. The result is cached as arrays of category codes in the
+        experiment folder, which are used as long as the size and modification
+        time of the JSONL file are those it was built from.
+
         Parameters
         ----------
         metric_index : int
@@ -176,14 +210,112 @@ class GCloudMetrics:
             a KPI map for the metric type in pandas DataFrame
         """
         path_kpi_map = self.build_path_kpi_map(metric_index, exp_name)
-        with jsonlines.open(path_kpi_map) as reader:
-            kpi_map_list = [obj for obj in reader]
-        kpi_maps = [kpi_map["kpi"] for kpi_map in kpi_map_list]
-        indices = [kpi_map["index"] for kpi_map in kpi_map_list]
-        return pd.DataFrame(kpi_maps, index=indices).sort_index(axis=1)
+        path_kpi_map_cache = self.build_path_kpi_map_cache(metric_index, exp_name)
+        stat = os.stat(path_kpi_map)
+        signature = np.array([stat.st_size, stat.st_mtime_ns], dtype=np.int64)
+        df_kpi_map = GCloudMetrics.read_kpi_map_cache(path_kpi_map_cache, signature)
+        if df_kpi_map is not None:
+            return df_kpi_map
+        with open(path_kpi_map) as file_kpi_map:
+            lines = [line for line in file_kpi_map.read().splitlines() if line]
+        kpi_map_list = json.loads("[" + ",".join(lines) + "]")
+        df_kpi_map = pd.DataFrame.from_records(
+            [kpi_map["kpi"] for kpi_map in kpi_map_list],
+            index=[kpi_map["index"] for kpi_map in kpi_map_list],
+        ).sort_index(axis=1)
+        df_kpi_map = GCloudMetrics.to_categorical(df_kpi_map)
+        try:
+            GCloudMetrics.write_kpi_map_cache(path_kpi_map_cache, signature, df_kpi_map)
+        except OSError:
+            logging.warning(f"Fail to cache KPI map of metric {metric_index}!")
+        return df_kpi_map
+
+    def build_path_kpi_map_cache(self, metric_index: int, exp_name: str) -> str:
+        return os.path.join(
+            self.build_path_experiment(exp_name),
+            GCloudMetrics.FDNAME_KPI_MAP_CACHE,
+            f"{GCloudMetrics.FNAME_METRIC_TYPE_PREFIX}{metric_index}.npz",
+        )
+
+    @staticmethod
+    def write_kpi_map_cache(
+        path_cache: str, signature: np.ndarray, df_kpi_map: pd.DataFrame
+    ):
+        """
+        Write a KPI map as the category codes and categories of categorical
+        columns and the values of numeric columns, skipping KPI maps with
+        other columns, e.g. of mixed types.
+        """
+        arrays = {
+            "signature": signature,
+            "index": df_kpi_map.index.to_numpy(dtype=np.int64),
+            "columns": np.array(df_kpi_map.columns, dtype=str),
+        }
+        for i, column in enumerate(df_kpi_map.columns):
+            series = df_kpi_map[column]
+            if isinstance(series.dtype, pd.CategoricalDtype):
+                arrays[f"codes_{i}"] = series.cat.codes.to_numpy()
+                arrays[f"categories_{i}"] = np.array(series.cat.categories, dtype=str)
+            elif pd.api.types.is_numeric_dtype(series.dtype):
+                arrays[f"values_{i}"] = series.to_numpy()
+            else:
+                return
+        os.makedirs(os.path.dirname(path_cache), exist_ok=True)
+        path_tmp = path_cache + ".tmp"
+        with open(path_tmp, "wb") as file_cache:
+            np.savez(file_cache, **arrays)
+        os.replace(path_tmp, path_cache)
+
+    @staticmethod
+    def read_kpi_map_cache(path_cache: str, signature: np.ndarray) -> pd.DataFrame:
+        """
+        Read a KPI map written by write_kpi_map_cache.
+
+        Returns
+        -------
+        DataFrame | None
+            the KPI map, None if there is no cache of the signature
+        """
+        if not os.path.exists(path_cache):
+            return None
+        try:
+            with np.load(path_cache, allow_pickle=False) as npz:
+                if not np.array_equal(npz["signature"], signature):
+                    return None
+                columns = {}
+                for i, column in enumerate(npz["columns"].tolist()):
+                    if f"codes_{i}" in npz:
+                        columns[column] = pd.Categorical.from_codes(
+                            npz[f"codes_{i}"], categories=npz[f"categories_{i}"]
+                        )
+                    else:
+                        columns[column] = npz[f"values_{i}"]
+                return pd.DataFrame(columns, index=npz["index"])
+        except (OSError, ValueError, KeyError, zipfile.BadZipFile):
+            logging.warning(f"Fail to read the KPI map cache {path_cache}!")
+            return None
+
+    @staticmethod
+    def to_categorical(df_kpi_map: pd.DataFrame) -> pd.DataFrame:
+        """
+        Convert string label columns of a KPI map to categoricals, so that
+        string operations, nunique and groupby run on category codes.
+        """
+        df_kpi_map = df_kpi_map.copy()
+        for column in df_kpi_map.columns:
+            if pd.api.types.infer_dtype(df_kpi_map[column], skipna=True) == "string":
+                df_kpi_map[column] = df_kpi_map[column].astype("category")
+        return df_kpi_map
 
     def read_kpi(
-        self, metric_index: int, kpi_index: int, exp_name: str, start_ts, end_ts
+        self,
+        metric_index: int,
+        kpi_index: int,
+        exp_name: str,
+        start_ts,
+        end_ts,
+        dtype=None,
+        packed_points: tuple[np.ndarray, dict] = None,
     ) -> pd.DataFrame:
         """
         Read values of a KPI per minute given the index.
@@ -200,14 +332,26 @@ class GCloudMetrics:
             the UNIX timestamp in seconds at the start of the experiment
         end_ts : int
             the UNIX timestamp in seconds at the end of the experiment
+        dtype : str | type
+            the type of values, float64 if not given
+        packed_points : tuple[ndarray, dict]
+            the packed points of the metric type if already read by
+            read_packed_points, read again if not given
 
         Returns
         -------
         DataFrame
             values of a KPI in pandas DataFrame with timestamps in rounded minutes as the index
         """
-        path_kpi = self.build_path_kpi(metric_index, kpi_index, exp_name)
-        df_kpi = pd.read_csv(path_kpi)
+        if packed_points is None:
+            packed_points = GCloudMetrics.read_packed_points(
+                self.build_path_metric_type(metric_index, exp_name)
+            )
+        if packed_points is not None:
+            df_kpi = GCloudMetrics.slice_packed_points(packed_points, kpi_index, dtype)
+        else:
+            path_kpi = self.build_path_kpi(metric_index, kpi_index, exp_name)
+            df_kpi = GCloudMetrics.read_values_csv(path_kpi, dtype)
         df_kpi = df_kpi[
             (df_kpi["timestamp"] >= start_ts) & (df_kpi["timestamp"] <= end_ts)
         ]
@@ -228,19 +372,30 @@ class GCloudMetrics:
         else:
             return None
 
-    def build_path_kpi_map(self, metric_index: int, exp_name: str) -> str:
+    def build_path_metric_type(self, metric_index: int, exp_name: str) -> str:
         return os.path.join(
             self.build_path_experiment(exp_name),
             GCloudMetrics.FDNAME_ORIGINAL_KPIS,
             GCloudMetrics.FNAME_METRIC_TYPE_PREFIX + str(metric_index),
+        )
+
+    def build_path_kpi_map(self, metric_index: int, exp_name: str) -> str:
+        return os.path.join(
+            self.build_path_metric_type(metric_index, exp_name),
             GCloudMetrics.FNAME_KPI_MAP,
         )
 
+    def has_packed_points(self, metric_index: int, exp_name: str) -> bool:
+        return os.path.exists(
+            os.path.join(
+                self.build_path_metric_type(metric_index, exp_name),
+                GCloudMetrics.FNAME_POINTS_CATALOG,
+            )
+        )
+
     def build_path_kpi(self, metric_index: int, kpi_index: int, exp_name: str) -> str:
         return os.path.join(
-            self.build_path_experiment(exp_name),
-            GCloudMetrics.FDNAME_ORIGINAL_KPIS,
-            GCloudMetrics.FNAME_METRIC_TYPE_PREFIX + str(metric_index),
+            self.build_path_metric_type(metric_index, exp_name),
             GCloudMetrics.FNAME_KPI_PREFIX
             + str(kpi_index)
             + GCloudMetrics.FNAME_KPI_SUFFIX,
@@ -255,8 +410,98 @@ class GCloudMetrics:
             os.mkdir(path_folder_merged_kpis)
         return path_folder_merged_kpis
 
+    @staticmethod
+    def read_values_csv(path_csv: str, dtype=None) -> pd.DataFrame:
+        """Read a CSV of values with a timestamp column, values as dtype if given."""
+        if dtype is None:
+            return pd.read_csv(path_csv)
+        columns = pd.read_csv(path_csv, nrows=0).columns
+        return pd.read_csv(
+            path_csv,
+            dtype={column: dtype for column in columns if column != "timestamp"},
+        )
+
+    @staticmethod
+    def build_path_points(path_metric_type: str, column: str) -> str:
+        return os.path.join(
+            path_metric_type, GCloudMetrics.FNAME_POINTS_PREFIX + column + ".npy"
+        )
+
+    @staticmethod
+    def write_packed_points(path_metric_type: str, offsets: np.ndarray, columns: dict):
+        """
+        Write points of all KPIs of a metric type as one array per column,
+        sorted by KPI index, with the offset of each KPI into the arrays.
+        The catalog of columns is written last, so a metric type is only
+        read as packed once all arrays are complete.
+        """
+        np.save(
+            GCloudMetrics.build_path_points(
+                path_metric_type, GCloudMetrics.FNAME_POINTS_OFFSETS
+            ),
+            offsets.astype(np.int64),
+        )
+        for column, values in columns.items():
+            np.save(GCloudMetrics.build_path_points(path_metric_type, column), values)
+        with open(
+            os.path.join(path_metric_type, GCloudMetrics.FNAME_POINTS_CATALOG), "w"
+        ) as file_catalog:
+            json.dump({"columns": list(columns)}, file_catalog)
+
+    @staticmethod
+    def read_packed_points(path_metric_type: str) -> tuple[np.ndarray, dict] | None:
+        """
+        Map packed points of a metric type into memory.
+
+        Returns
+        -------
+        tuple[ndarray, dict] | None
+            offsets of KPIs and arrays keyed by columns, or None if the points
+            of the metric type are not packed
+        """
+        path_catalog = os.path.join(
+            path_metric_type, GCloudMetrics.FNAME_POINTS_CATALOG
+        )
+        if not os.path.exists(path_catalog):
+            return None
+        with open(path_catalog) as file_catalog:
+            catalog = json.load(file_catalog)
+        offsets = np.load(
+            GCloudMetrics.build_path_points(
+                path_metric_type, GCloudMetrics.FNAME_POINTS_OFFSETS
+            )
+        )
+        columns = {
+            column: np.load(
+                GCloudMetrics.build_path_points(path_metric_type, column),
+                mmap_mode="r",
+            )
+            for column in catalog["columns"]
+        }
+        return offsets, columns
+
+    @staticmethod
+    def slice_packed_points(
+        packed_points: tuple[np.ndarray, dict], kpi_index: int, dtype=None
+    ) -> pd.DataFrame:
+        """Read the points of a KPI as read_values_csv reads its CSV."""
+        offsets, columns = packed_points
+        rows = slice(offsets[kpi_index], offsets[kpi_index + 1])
+        return pd.DataFrame(
+            {
+                column: np.array(
+                    values[rows],
+                    dtype=None if dtype is None or column == "timestamp" else dtype,
+                )
+                for column, values in columns.items()
+            }
+        )
+
     @staticmethod
     def reduce_cumulative(series: pd.Series) -> pd.Series:
+        # difference counters in float64 even if values are stored in float32
+        dtype = series.dtype
+        series = series.astype(np.float64)
         series = series.sub(series.shift())
         series = series.mask(series < 0)
-        return series
+        return series.astype(dtype) if dtype == np.float32 else series
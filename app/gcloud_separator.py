@@ -1,9 +1,15 @@
 import os
 from app.agg.strategy import Strategy
+from app.engine import Engine
 from app.gcloud_aggregator import GCloudAggregator
 from app.gcloud_metric_kind import GCloudMetricKind
 from app.gcloud_metrics import GCloudMetrics
+from app.kpi_label_index import KpiLabelIndex
+from app.metric_profiler import MetricProfiler
+from app.polars_kpis import PolarsKpis
+from app.sparse_kpis import SparseKpis
 import logging
+import numpy as np
 import pandas as pd
 from datetime import datetime
 
@@ -15,36 +21,70 @@ class GCloudSeparator(GCloudMetrics):
         exp_index: int,
         strategy: Strategy,
         only_pod_metrics: bool = False,
+        sparse: bool = False,
+        use_label_index: bool = True,
+        dtype: str = None,
+        engine: Engine = Engine.PANDAS,
+        profiler: MetricProfiler = None,
     ):
         super().__init__(filename_exp_yaml)
+        # store values as float32 if set, float64 by default
+        self.dtype = dtype
+        # combine KPIs with lazy Polars plans if set to Engine.POLARS
+        self.engine = engine
+        if engine == Engine.POLARS:
+            PolarsKpis.check_installed()
+            if sparse:
+                raise ValueError("Sparse KPIs are not supported by the Polars engine!")
         self.only_pod_metrics = only_pod_metrics
+        # store combined KPIs in the long format instead of a wide CSV
+        self.sparse = sparse
         self.strategy = strategy
         self.experiment = self.experiments[exp_index]
         self.df_metric_type_map = self.read_metric_type_map(self.experiment["name"])
+        self.df_node_metadata = None
+        self.metric_index_to_filter = None
+        # look up KPIs of the experiment by labels instead of scanning KPI maps
+        self.label_index = (
+            KpiLabelIndex.load_or_build(self, self.experiment["name"])
+            if use_label_index
+            else None
+        )
+        # profile slow or selected metrics, configured by the environment by default
+        self.profiler = (
+            profiler if profiler is not None else MetricProfiler.from_environment()
+        )
 
     def separate_kpis(self):
         logging.info("Separating KPIs by experiments ...")
         logging.info(
             "Processing experiment {name} ...".format(name=self.experiment["name"])
         )
+        path_experiment = self.build_path_experiment(self.experiment["name"])
         for metric_index in self.get_metric_indices_from_raw_dataset(
             self.experiment["name"], self.only_pod_metrics
         ):
-            metric_name = self.df_metric_type_map.loc[metric_index, "name"]
-            logging.info(f"Processing metric type {metric_name} ...")
-            df_kpi_map = self.read_kpi_map(
-                metric_index, self.experiment["name"]
-            ).reset_index(names="kpi_index")
-
-            # skip metrics that are already separated
-            if not self.only_pod_metrics and self.metric_merged_kpis_exists(
-                metric_index, self.experiment["name"]
-            ):
-                continue
-            df_exp_kpi_map = self.filter_kpis_in_one_experiment(metric_name, df_kpi_map)
-            if df_exp_kpi_map is None or df_exp_kpi_map.empty:
-                continue
-            self.merge_kpis_in_one_experiment(metric_index, df_exp_kpi_map)
+            with self.profiler.profile(path_experiment, "separate", metric_index):
+                self.separate_one_metric(metric_index)
+
+    def separate_one_metric(self, metric_index: int):
+        metric_name = self.df_metric_type_map.loc[metric_index, "name"]
+        logging.info(f"Processing metric type {metric_name} ...")
+        df_kpi_map = self.read_kpi_map(
+            metric_index, self.experiment["name"]
+        ).reset_index(names="kpi_index")
+
+        # skip metrics that are already separated
+        if not self.only_pod_metrics and self.metric_merged_kpis_exists(
+            metric_index, self.experiment["name"]
+        ):
+            return
+        df_exp_kpi_map = self.filter_kpis_in_one_experiment(
+            metric_name, df_kpi_map, metric_index
+        )
+        if df_exp_kpi_map is None or df_exp_kpi_map.empty:
+            return
+        self.merge_kpis_in_one_experiment(metric_index, df_exp_kpi_map)
 
     def merge_kpis_in_one_experiment(
         self, metric_index: int, df_exp_kpi_map: pd.DataFrame
@@ -54,6 +94,25 @@ class GCloudSeparator(GCloudMetrics):
         df_pods_metadata = self.read_pods_metadata(
             self.experiment["name"], start_ts, end_ts
         )
+        metric_kind = self.df_metric_type_map.loc[metric_index]["kind"]
+        is_cumulative = metric_kind == GCloudMetricKind.CUMULATIVE.value
+        # read counters in float64 to difference them before downcasting
+        read_dtype = None if is_cumulative else self.dtype
+        if self.strategy == Strategy.CONSIDER_ONLY_RUNNING_PODS:
+            # skip KPIs of pods that never ran before reading any KPI data
+            pod_timelines = GCloudSeparator.build_pod_timelines(df_pods_metadata)
+            df_exp_kpi_map = GCloudSeparator.filter_kpis_of_running_pods(
+                df_exp_kpi_map, pod_timelines
+            )
+        if self.engine == Engine.POLARS:
+            self.merge_kpis_with_polars(
+                metric_index, df_exp_kpi_map, df_pods_metadata, start_ts, end_ts
+            )
+            return
+        # map packed points of the metric type once for all of its KPIs
+        packed_points = GCloudMetrics.read_packed_points(
+            self.build_path_metric_type(metric_index, self.experiment["name"])
+        )
         kpi_list = []
         new_kpi_map = []
         for i in df_exp_kpi_map.index:
@@ -61,10 +120,34 @@ class GCloudSeparator(GCloudMetrics):
             new_kpi_map_item["kpi_index"] = len(new_kpi_map)
             kpi_index = df_exp_kpi_map.loc[i]["kpi_index"]
             df_kpi = self.read_kpi(
-                metric_index, kpi_index, self.experiment["name"], start_ts, end_ts
+                metric_index,
+                kpi_index,
+                self.experiment["name"],
+                start_ts,
+                end_ts,
+                read_dtype,
+                packed_points,
             )
 
-            if self.strategy != Strategy.IGNORE_POD_PHASES:
+            if self.strategy == Strategy.CONSIDER_ONLY_RUNNING_PODS:
+                pod_name = GCloudSeparator.get_pod_name_if_exists(df_exp_kpi_map, i)
+                if pod_name is not None and not pd.isna(pod_name):
+                    # drop values observed while the pod was not running
+                    df_kpi = df_kpi[
+                        GCloudSeparator.is_running(
+                            pod_timelines[pod_name], df_kpi.index
+                        )
+                    ]
+                    if df_kpi.empty:
+                        continue
+                    # keep the phase so that aggregation records grouped by
+                    # pod_phase still apply
+                    new_kpi_map_item["pod_phase"] = "Running"
+                new_kpi_map.append(new_kpi_map_item)
+                kpi_list.append(
+                    df_kpi.add_prefix(f'kpi-{new_kpi_map_item["kpi_index"]}-')
+                )
+            elif self.strategy != Strategy.IGNORE_POD_PHASES:
                 pod_name = GCloudSeparator.get_pod_name_if_exists(df_exp_kpi_map, i)
                 if pod_name is None:
                     new_kpi_map.append(new_kpi_map_item)
@@ -101,6 +184,34 @@ class GCloudSeparator(GCloudMetrics):
                     df_kpi.add_prefix(f'kpi-{new_kpi_map_item["kpi_index"]}-')
                 )
 
+        if not kpi_list:
+            logging.info(f"No KPIs of metric {metric_index} left in the experiment.")
+            return
+        path_folder_merged_kpis = self.build_path_folder_merged_kpis(
+            self.experiment["name"]
+        )
+        if self.sparse:
+            sparse_kpis = SparseKpis.from_frames(
+                kpi_list, np.float64 if read_dtype is None else read_dtype
+            )
+            if is_cumulative:
+                sparse_kpis = sparse_kpis.reduce_cumulative().dropna()
+            if self.dtype is not None:
+                sparse_kpis = sparse_kpis.astype(self.dtype)
+            sparse_kpis.save(
+                os.path.join(
+                    path_folder_merged_kpis,
+                    f"metric-{metric_index}{SparseKpis.FNAME_SUFFIX}",
+                )
+            )
+            pd.DataFrame(new_kpi_map).to_csv(
+                os.path.join(
+                    path_folder_merged_kpis, f"metric-{metric_index}-kpi-map.csv"
+                ),
+                index=False,
+            )
+            return
+
         try:
             df_kpis = pd.concat(kpi_list, axis=1).sort_index()
         except:
@@ -111,13 +222,11 @@ class GCloudSeparator(GCloudMetrics):
         # aggregate duplicated minutes
         if len(df_kpis.index) != len(df_kpis.index.drop_duplicates()):
             df_kpis = df_kpis.groupby("timestamp").agg("mean")
-        metric_kind = self.df_metric_type_map.loc[metric_index]["kind"]
-        if metric_kind == GCloudMetricKind.CUMULATIVE.value:
+        if is_cumulative:
             df_kpis = df_kpis.apply(GCloudMetrics.reduce_cumulative)
+        if self.dtype is not None:
+            df_kpis = df_kpis.astype(self.dtype)
 
-        path_folder_merged_kpis = self.build_path_folder_merged_kpis(
-            self.experiment["name"]
-        )
         # save both KPI values and KPI map
         df_kpis.to_csv(
             os.path.join(
@@ -130,6 +239,70 @@ class GCloudSeparator(GCloudMetrics):
             index=False,
         )
 
+    def merge_kpis_with_polars(
+        self,
+        metric_index: int,
+        df_exp_kpi_map: pd.DataFrame,
+        df_pods_metadata: pd.DataFrame,
+        start_ts: float,
+        end_ts: float,
+    ):
+        """Merge KPIs in one experiment into the same files with Polars."""
+        if self.has_packed_points(metric_index, self.experiment["name"]):
+            raise ValueError("Packed KPIs are not supported by the Polars engine!")
+        if self.strategy == Strategy.CONSIDER_ONLY_RUNNING_PODS:
+            pod_timelines = GCloudSeparator.build_pod_timelines(df_pods_metadata)
+        raw_kpis = []
+        for i in df_exp_kpi_map.index:
+            kpi_map_item = df_exp_kpi_map.loc[i].to_dict()
+            pod_name = GCloudSeparator.get_pod_name_if_exists(df_exp_kpi_map, i)
+            df_pod_phases = None
+            if self.strategy == Strategy.CONSIDER_ONLY_RUNNING_PODS:
+                if pod_name is not None and not pd.isna(pod_name):
+                    snapshot_minutes, running = pod_timelines[pod_name]
+                    df_pod_phases = pd.DataFrame(
+                        {
+                            "timestamp": snapshot_minutes,
+                            "pod_phase": np.where(running, "Running", ""),
+                        }
+                    )
+            elif self.strategy != Strategy.IGNORE_POD_PHASES and pod_name is not None:
+                df_pod_phases = df_pods_metadata[
+                    df_pods_metadata["pod_name"] == pod_name
+                ]
+            raw_kpis.append(
+                (
+                    self.build_path_kpi(
+                        metric_index, kpi_map_item["kpi_index"], self.experiment["name"]
+                    ),
+                    kpi_map_item,
+                    df_pod_phases,
+                )
+            )
+        metric_kind = self.df_metric_type_map.loc[metric_index]["kind"]
+        polars_kpis, new_kpi_map = PolarsKpis.from_raw_kpis(
+            raw_kpis,
+            start_ts,
+            end_ts,
+            self.strategy,
+            metric_kind == GCloudMetricKind.CUMULATIVE.value,
+        )
+        if not new_kpi_map:
+            logging.info(f"No KPIs of metric {metric_index} left in the experiment.")
+            return
+        if self.dtype is not None:
+            polars_kpis = polars_kpis.astype(self.dtype)
+        path_folder_merged_kpis = self.build_path_folder_merged_kpis(
+            self.experiment["name"]
+        )
+        polars_kpis.write_csv(
+            os.path.join(path_folder_merged_kpis, f"metric-{metric_index}.csv")
+        )
+        pd.DataFrame(new_kpi_map).to_csv(
+            os.path.join(path_folder_merged_kpis, f"metric-{metric_index}-kpi-map.csv"),
+            index=False,
+        )
+
     @staticmethod
     def get_pod_name_if_exists(df_exp_kpi_map: pd.DataFrame, index: int) -> str | None:
         if "pod_name" in df_exp_kpi_map.columns:
@@ -139,40 +312,100 @@ class GCloudSeparator(GCloudMetrics):
         else:
             return None
 
+    @staticmethod
+    def build_pod_timelines(df_pods_metadata: pd.DataFrame) -> dict:
+        """
+        Build the timeline of phases of pods that were running in the experiment.
+
+        Returns
+        -------
+        dict
+            sorted snapshot minutes and whether the pod was running at each of
+            them, keyed by pod names
+        """
+        df_pods_metadata = df_pods_metadata.sort_values("timestamp").drop_duplicates(
+            subset=["timestamp", "pod_name"], keep="last"
+        )
+        pod_timelines = {}
+        for pod_name, df_pod in df_pods_metadata.groupby("pod_name"):
+            running = (df_pod["pod_phase"] == "Running").to_numpy()
+            if running.any():
+                pod_timelines[pod_name] = (df_pod["timestamp"].to_numpy(), running)
+        return pod_timelines
+
+    @staticmethod
+    def filter_kpis_of_running_pods(
+        df_exp_kpi_map: pd.DataFrame, pod_timelines: dict
+    ) -> pd.DataFrame:
+        """Keep KPIs without pods and KPIs of pods that were running."""
+        for col_pod in ["pod_name", "pod"]:
+            if col_pod in df_exp_kpi_map.columns:
+                return df_exp_kpi_map[
+                    df_exp_kpi_map[col_pod].isna()
+                    | df_exp_kpi_map[col_pod].isin(pod_timelines.keys())
+                ]
+        return df_exp_kpi_map
+
+    @staticmethod
+    def is_running(pod_timeline: tuple, timestamps: pd.Index) -> np.ndarray:
+        """
+        Check whether a pod was running at the given minutes, where each minute
+        takes the phase of the next pod snapshot as in CONSIDER_POD_PHASES.
+        """
+        snapshot_minutes, running = pod_timeline
+        positions = np.searchsorted(snapshot_minutes, timestamps.to_numpy())
+        in_timeline = positions < len(running)
+        is_running = np.zeros(len(timestamps), dtype=bool)
+        is_running[in_timeline] = running[positions[in_timeline]]
+        return is_running
+
     def metric_merged_kpis_exists(self, metric_index: int, exp_name: str) -> bool:
         path_folder_merged_kpis = self.build_path_folder_merged_kpis(exp_name)
         path_merged_kpis = os.path.join(
             path_folder_merged_kpis,
             f"metric-{metric_index}.csv",
         )
+        path_sparse_kpis = os.path.join(
+            path_folder_merged_kpis,
+            f"metric-{metric_index}{SparseKpis.FNAME_SUFFIX}",
+        )
         path_merged_kpis_map = os.path.join(
             path_folder_merged_kpis, f"metric-{metric_index}-kpi-map.csv"
         )
-        return os.path.exists(path_merged_kpis) and os.path.exists(path_merged_kpis_map)
+        return (
+            os.path.exists(path_merged_kpis) or os.path.exists(path_sparse_kpis)
+        ) and os.path.exists(path_merged_kpis_map)
 
     def filter_kpis_in_one_experiment(
-        self, metric_name: str, df_kpi_map: pd.DataFrame
+        self, metric_name: str, df_kpi_map: pd.DataFrame, metric_index: int = None
     ) -> pd.DataFrame | None:
         """
         Filter KPIs in one experiment from the KPI map.
 
+        If the metric index is given and the label index is enabled, candidate
+        KPIs are looked up in the label index, and the exact filters below only
+        run on those candidates.
+
         Returns
         -------
         DataFrame | None
             the filtered KPI map which only includes KPI indices from one experiment
         """
+        self.metric_index_to_filter = metric_index
         cluster_suffix = self.experiment["cluster_suffix"]
         if metric_name.startswith("compute.googleapis.com"):
             df_exp_kpi_map = self._filter_kpis_from_compute(df_kpi_map)
         elif metric_name.startswith("networking.googleapis.com"):
             df_exp_kpi_map = self._filter_kpis_from_networking(df_kpi_map)
         elif metric_name.startswith("prometheus.googleapis.com"):
+            df_kpi_map = self._prefilter_by_cluster(df_kpi_map, "cluster")
             df_exp_kpi_map = df_kpi_map[
                 df_kpi_map["cluster"].str.contains(cluster_suffix)
             ]
         elif metric_name.startswith("logging.googleapis.com"):
             df_exp_kpi_map = self._filter_kpis_from_logging(df_kpi_map)
         elif metric_name.startswith("kubernetes.io"):
+            df_kpi_map = self._prefilter_by_cluster(df_kpi_map, "cluster_name")
             df_exp_kpi_map = df_kpi_map[
                 df_kpi_map["cluster_name"].str.contains(cluster_suffix)
             ]
@@ -181,12 +414,49 @@ class GCloudSeparator(GCloudMetrics):
             return None
         return df_exp_kpi_map
 
+    def _prefilter(
+        self, df_kpi_map: pd.DataFrame, label: str, values: list
+    ) -> pd.DataFrame:
+        """
+        Select candidate KPIs having any of the label values from the label index,
+        or return the KPI map unchanged if the label index is not used.
+        """
+        if self.label_index is None or self.metric_index_to_filter is None:
+            return df_kpi_map
+        kpi_indices = self.label_index.lookup(
+            label, values, self.metric_index_to_filter
+        )
+        return df_kpi_map[df_kpi_map["kpi_index"].isin(kpi_indices)]
+
+    def _prefilter_by_cluster(
+        self, df_kpi_map: pd.DataFrame, label: str
+    ) -> pd.DataFrame:
+        if self.label_index is None:
+            return df_kpi_map
+        cluster_names = self.label_index.find_values(self.experiment["cluster_suffix"])
+        return self._prefilter(df_kpi_map, label, cluster_names)
+
+    def _prefilter_by_nodes(self, df_kpi_map: pd.DataFrame) -> pd.DataFrame:
+        df_node_metadata = self.read_nodes_metadata(self.experiment)
+        return self._prefilter(
+            df_kpi_map,
+            "instance_id",
+            df_node_metadata["instance_id"].to_list(),
+        )
+
+    def read_nodes_metadata(self, experiment: dict) -> pd.DataFrame:
+        """Read metadata of nodes once per experiment, see GCloudMetrics."""
+        if self.df_node_metadata is None:
+            self.df_node_metadata = super().read_nodes_metadata(experiment)
+        return self.df_node_metadata
+
     def _filter_kpis_from_compute(self, df_kpi_map: pd.DataFrame) -> pd.DataFrame:
         df_node_metadata = self.read_nodes_metadata(self.experiment)
         if (
             "instance_name" in df_kpi_map.columns
             and "instance_id" in df_kpi_map.columns
         ):
+            df_kpi_map = self._prefilter_by_nodes(df_kpi_map)
             filter_fields = ["instance_name", "instance_id"]
             return (
                 df_kpi_map.set_index(filter_fields)
@@ -197,6 +467,7 @@ class GCloudSeparator(GCloudMetrics):
                 .reset_index()
             )
         elif "instance_id" in df_kpi_map.columns:
+            df_kpi_map = self._prefilter_by_nodes(df_kpi_map)
             filter_fields = ["instance_id"]
             return (
                 df_kpi_map.set_index(filter_fields)
@@ -213,15 +484,18 @@ class GCloudSeparator(GCloudMetrics):
                 .iloc[0, 0]
             )
             grp_name = f"gke-train-ticket-cluster-default-pool-{grp_id}-grp"
+            df_kpi_map = self._prefilter(df_kpi_map, "instance_group_name", [grp_name])
             return df_kpi_map[df_kpi_map["instance_group_name"] == grp_name]
         else:
             return None
 
     def _filter_kpis_from_networking(self, df_kpi_map: pd.DataFrame) -> pd.DataFrame:
         if "cluster_name" in df_kpi_map.columns:
+            df_kpi_map = self._prefilter_by_cluster(df_kpi_map, "cluster_name")
             cluster_suffix = self.experiment["cluster_suffix"]
             return df_kpi_map[df_kpi_map["cluster_name"].str.contains(cluster_suffix)]
         elif "instance_id" in df_kpi_map.columns:
+            df_kpi_map = self._prefilter_by_nodes(df_kpi_map)
             df_node_metadata = self.read_nodes_metadata(self.experiment)
             return (
                 df_kpi_map.set_index("instance_id")
@@ -235,6 +509,15 @@ class GCloudSeparator(GCloudMetrics):
             return None
 
     def _filter_kpis_from_logging(self, df_kpi_map: pd.DataFrame) -> pd.DataFrame:
+        # keep KPIs of either nodes or clusters of the experiment
+        if self.label_index is not None and self.metric_index_to_filter is not None:
+            df_kpi_map = pd.concat(
+                [
+                    self._prefilter_by_nodes(df_kpi_map),
+                    self._prefilter_by_cluster(df_kpi_map, "cluster_name"),
+                ]
+            )
+            df_kpi_map = df_kpi_map[~df_kpi_map.index.duplicated()].sort_index()
         df_node_metadata = self.read_nodes_metadata(self.experiment)
         df_instance_id = (
             df_kpi_map[~df_kpi_map["instance_id"].isna()]
@@ -0,0 +1,174 @@
+import logging
+import os
+
+import numpy as np
+import pandas as pd
+
+from app.gcloud_metrics import GCloudMetrics
+
+
+class KpiLabelIndex:
+    """
+    An inverted index from label values to (metric_index, kpi_index) pairs
+    across all KPI maps of a raw dataset.
+
+    Label names and values are stored as categorical codes, and postings are
+    sorted by (label, value) so that a lookup is a binary search.
+    """
+
+    FNAME_INDEX = "kpi_label_index.npz"
+    INDEXED_LABELS = [
+        "cluster",
+        "cluster_name",
+        "instance_group_name",
+        "instance_id",
+        "instance_name",
+        "pod",
+        "pod_name",
+    ]
+
+    def __init__(
+        self,
+        values: np.ndarray,
+        keys: np.ndarray,
+        metric_indices: np.ndarray,
+        kpi_indices: np.ndarray,
+    ):
+        """
+        Parameters
+        ----------
+        values : ndarray
+            the vocabulary of label values, coded by position
+        keys : ndarray
+            label code * len(values) + value code of each posting, sorted
+        metric_indices : ndarray
+            the metric index of each posting
+        kpi_indices : ndarray
+            the KPI index of each posting
+        """
+        self.values = values
+        self.value_codes = {value: code for code, value in enumerate(values.tolist())}
+        self.keys = keys
+        self.metric_indices = metric_indices
+        self.kpi_indices = kpi_indices
+
+    @staticmethod
+    def build_path_index(gcloud_metrics: GCloudMetrics, exp_name: str) -> str:
+        return os.path.join(
+            gcloud_metrics.build_path_experiment(exp_name), KpiLabelIndex.FNAME_INDEX
+        )
+
+    @staticmethod
+    def build_signature(
+        gcloud_metrics: GCloudMetrics, exp_name: str, metric_indices: list
+    ) -> np.ndarray:
+        """Sign the KPI maps by metric index, size and modification time."""
+        signature = []
+        for metric_index in metric_indices:
+            stat = os.stat(gcloud_metrics.build_path_kpi_map(metric_index, exp_name))
+            signature.append((metric_index, stat.st_size, stat.st_mtime_ns))
+        return np.array(signature, dtype=np.int64).reshape(-1, 3)
+
+    @staticmethod
+    def load_or_build(gcloud_metrics: GCloudMetrics, exp_name: str) -> "KpiLabelIndex":
+        """
+        Load the index of a raw dataset next to the outputs of the experiment,
+        rebuilding it if the indexed metrics or any KPI map changed.
+        """
+        path_index = KpiLabelIndex.build_path_index(gcloud_metrics, exp_name)
+        metric_indices = gcloud_metrics.get_metric_indices_from_raw_dataset(exp_name)
+        signature = KpiLabelIndex.build_signature(
+            gcloud_metrics, exp_name, metric_indices
+        )
+        if os.path.exists(path_index):
+            with np.load(path_index, allow_pickle=False) as npz:
+                if "signature" in npz and np.array_equal(npz["signature"], signature):
+                    return KpiLabelIndex(
+                        npz["values"],
+                        npz["keys"],
+                        npz["metric_indices"],
+                        npz["kpi_indices"],
+                    )
+        logging.info("Building the KPI label index of the raw dataset ...")
+        label_index = KpiLabelIndex.build(gcloud_metrics, exp_name, metric_indices)
+        np.savez(
+            path_index,
+            values=label_index.values,
+            keys=label_index.keys,
+            metric_indices=label_index.metric_indices,
+            kpi_indices=label_index.kpi_indices,
+            signature=signature,
+        )
+        return label_index
+
+    @staticmethod
+    def build(
+        gcloud_metrics: GCloudMetrics, exp_name: str, metric_indices: list
+    ) -> "KpiLabelIndex":
+        list_postings = []
+        for metric_index in metric_indices:
+            df_kpi_map = gcloud_metrics.read_kpi_map(metric_index, exp_name)
+            for label_code, label in enumerate(KpiLabelIndex.INDEXED_LABELS):
+                if label not in df_kpi_map.columns:
+                    continue
+                series_label = df_kpi_map[label].dropna()
+                list_postings.append(
+                    pd.DataFrame(
+                        {
+                            "label": label_code,
+                            "value": series_label.astype(str).to_numpy(),
+                            "metric_index": metric_index,
+                            "kpi_index": series_label.index.to_numpy(),
+                        }
+                    )
+                )
+        if list_postings:
+            df_postings = pd.concat(list_postings, ignore_index=True)
+        else:
+            df_postings = pd.DataFrame(
+                columns=["label", "value", "metric_index", "kpi_index"]
+            )
+        values = pd.Categorical(df_postings["value"].astype(str))
+        keys = df_postings["label"].to_numpy(dtype=np.int64) * len(
+            values.categories
+        ) + values.codes.astype(np.int64)
+        order = np.argsort(keys, kind="stable")
+        return KpiLabelIndex(
+            values.categories.to_numpy(dtype=str),
+            keys[order],
+            df_postings["metric_index"].to_numpy(dtype=np.int32)[order],
+            df_postings["kpi_index"].to_numpy(dtype=np.int32)[order],
+        )
+
+    def find_values(self, contains: str) -> list:
+        """Find label values containing a substring, e.g. a cluster suffix."""
+        return [value for value in self.value_codes if contains in value]
+
+    def lookup(self, label: str, values: list, metric_index: int = None) -> set:
+        """
+        Look up KPIs having any of the values of a label.
+
+        Returns
+        -------
+        set
+            KPI indices if metric_index is given, otherwise
+            (metric_index, kpi_index) pairs
+        """
+        if label not in KpiLabelIndex.INDEXED_LABELS:
+            raise ValueError(f"Label {label} is not indexed!")
+        label_code = KpiLabelIndex.INDEXED_LABELS.index(label)
+        kpis = set()
+        for value in values:
+            value_code = self.value_codes.get(str(value))
+            if value_code is None:
+                continue
+            key = label_code * len(self.values) + value_code
+            start = np.searchsorted(self.keys, key, side="left")
+            end = np.searchsorted(self.keys, key, side="right")
+            metric_indices = self.metric_indices[start:end]
+            kpi_indices = self.kpi_indices[start:end]
+            if metric_index is not None:
+                kpis.update(kpi_indices[metric_indices == metric_index].tolist())
+            else:
+                kpis.update(zip(metric_indices.tolist(), kpi_indices.tolist()))
+        return kpis
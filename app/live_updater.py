@@ -0,0 +1,661 @@
+import io
+import json
+import logging
+import os
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from app.agg.strategy import Strategy
+from app.gcloud_aggregator import GCloudAggregator
+from app.gcloud_metric_kind import GCloudMetricKind
+from app.gcloud_metrics import GCloudMetrics
+from app.gcloud_separator import GCloudSeparator
+
+
+class LiveUpdater:
+    """
+    Extend the combined, aggregated and merged outputs of a running experiment
+    by the minutes collected since the last update.
+
+    A state file next to the outputs keeps the high-water mark, i.e. the last
+    processed minute, the byte offset of every raw KPI file, the last raw row
+    of each cumulative metric and the combined KPI of each pair of raw KPI and
+    pod phase. An update only reads raw rows after the offsets and pods
+    snapshots after the high-water mark, and appends the new minutes to the
+    outputs.
+
+    Minutes are processed up to the latest pods snapshot, so that the phase of
+    each new minute is known: a minute takes the phase of the next snapshot
+    containing the pod. As raw rows are rounded to minutes, a minute is also
+    only processed once the latest raw row is more than half a minute after
+    it or beyond the end of the experiment. Raw rows are expected to be
+    appended in time order, and rows of minutes before the high-water mark
+    that arrive late are skipped, as are minutes of a pod before its first
+    snapshot.
+
+    Columns first seen in an update are added to the outputs, and their
+    earlier minutes are aggregated from KPIs without values as in batch
+    aggregation. The feature matrix and its pyramid are only built by
+    merge_all_metrics.
+
+    Without a state file, the high-water mark is taken from existing outputs
+    of a batch run, and the state is seeded by reading the raw rows up to it
+    without writing, so that only later minutes are appended. The size and
+    last timestamp of every raw KPI are kept as well, so that an update only
+    reads the last rows of raw KPIs that grew.
+    """
+
+    FNAME_STATE = "live_state.json"
+    # the number of bytes read from the end of a raw KPI to find its last row
+    TAIL_SIZE = 4096
+
+    def __init__(
+        self,
+        filename_exp_yaml: str,
+        filename_metadata_yaml: str,
+        exp_index: int,
+        strategy: Strategy,
+        dtype: str = None,
+    ):
+        self.separator = GCloudSeparator(
+            filename_exp_yaml, exp_index, strategy, dtype=dtype
+        )
+        self.aggregator = GCloudAggregator(
+            filename_exp_yaml,
+            filename_metadata_yaml,
+            exp_index,
+            strategy=strategy,
+            for_normal_dataset=True,
+            enforce_existing_aggregations=False,
+            dtype=dtype,
+        )
+        self.strategy = strategy
+        self.experiment = self.separator.experiment
+        self.exp_name = self.experiment["name"]
+        self.path_state = os.path.join(
+            self.separator.build_path_experiment(self.exp_name), LiveUpdater.FNAME_STATE
+        )
+        self.state = self.load_state()
+
+    def load_state(self) -> dict:
+        if not os.path.exists(self.path_state):
+            return {"high_water_mark": None, "metrics": {}}
+        with open(self.path_state) as file_state:
+            return json.load(file_state)
+
+    def get_state_metric(self, metric_index: int) -> dict:
+        state_metric = self.state["metrics"].setdefault(str(metric_index), {})
+        for key in ("offsets", "kpis", "last_row", "tails"):
+            state_metric.setdefault(key, {})
+        return state_metric
+
+    def save_state(self):
+        path_tmp = self.path_state + ".tmp"
+        with open(path_tmp, "w") as file_state:
+            json.dump(self.state, file_state)
+        os.replace(path_tmp, self.path_state)
+
+    def update(self) -> int:
+        """
+        Process the minutes collected since the last update.
+
+        Returns
+        -------
+        int
+            the number of new minutes in the merged experiment
+        """
+        start_ts = datetime.fromisoformat(self.experiment["start"]).timestamp()
+        end_ts = datetime.fromisoformat(self.experiment["end"]).timestamp()
+        if not os.path.exists(self.path_state):
+            self.seed_state(start_ts, end_ts)
+        high_water_mark = self.state["high_water_mark"]
+        lower = (
+            None if high_water_mark is None else pd.Timestamp(high_water_mark, unit="s")
+        )
+        upper = self.find_latest_snapshot_minute(start_ts, end_ts)
+        if upper is not None:
+            upper = self.find_last_complete_minute(upper, end_ts)
+        if upper is None or (lower is not None and upper <= lower):
+            logging.info("No new minutes to process.")
+            # keep the last timestamps of raw KPIs read to find no new minutes
+            self.save_state()
+            return 0
+        logging.info(f"Processing minutes from {lower} to {upper} ...")
+
+        df_pods_metadata = self.separator.read_pods_metadata(
+            self.exp_name, start_ts if lower is None else lower.timestamp(), end_ts
+        )
+        if lower is not None:
+            df_pods_metadata = df_pods_metadata[df_pods_metadata["timestamp"] > lower]
+        pod_timelines = LiveUpdater.build_phase_timelines(df_pods_metadata)
+
+        list_df_agg_metric = []
+        list_df_agg_earlier = []
+        for metric_index in self.separator.get_metric_indices_from_raw_dataset(
+            self.exp_name
+        ):
+            df_agg_metric, df_agg_earlier = self.update_metric(
+                metric_index, lower, upper, start_ts, end_ts, pod_timelines
+            )
+            if df_agg_metric is not None and not df_agg_metric.empty:
+                list_df_agg_metric.append(
+                    df_agg_metric.add_prefix(f"metric-{metric_index}-")
+                )
+            if df_agg_earlier is not None:
+                list_df_agg_earlier.append(
+                    df_agg_earlier.add_prefix(f"metric-{metric_index}-")
+                )
+        num_minutes = 0
+        if list_df_agg_metric:
+            df_all = pd.concat(list_df_agg_metric, axis=1).sort_index()
+            LiveUpdater.append_rows(
+                self.aggregator.complete_time_series_path,
+                df_all,
+                (
+                    pd.concat(list_df_agg_earlier, axis=1)
+                    if list_df_agg_earlier
+                    else None
+                ),
+            )
+            num_minutes = len(df_all)
+        self.state["high_water_mark"] = int(upper.timestamp())
+        self.save_state()
+        return num_minutes
+
+    def find_output_high_water_mark(self):
+        """
+        Find the last minute in existing outputs of the experiment, preferring
+        the merged experiment over aggregated and combined metrics.
+
+        Returns
+        -------
+        Timestamp | None
+            the last minute, None if there are no outputs
+        """
+        if os.path.exists(self.aggregator.complete_time_series_path):
+            return LiveUpdater.read_last_minute(
+                self.aggregator.complete_time_series_path
+            )
+        for path_folder in (
+            self.aggregator.aggregated_metrics_path,
+            self.separator.build_path_folder_merged_kpis(self.exp_name),
+        ):
+            if not os.path.isdir(path_folder):
+                continue
+            last_minutes = [
+                LiveUpdater.read_last_minute(os.path.join(path_folder, fname))
+                for fname in os.listdir(path_folder)
+                if fname.startswith("metric-")
+                and fname.endswith(".csv")
+                and not fname.endswith("-kpi-map.csv")
+            ]
+            last_minutes = [minute for minute in last_minutes if minute is not None]
+            if last_minutes:
+                return max(last_minutes)
+        return None
+
+    @staticmethod
+    def read_last_minute(path_csv: str):
+        """Read the timestamp of the last row of a CSV indexed by timestamp."""
+        with open(path_csv, "rb") as file_csv:
+            file_csv.seek(0, os.SEEK_END)
+            file_csv.seek(max(file_csv.tell() - LiveUpdater.TAIL_SIZE, 0))
+            last_line = file_csv.read().strip().rsplit(b"\n", 1)[-1]
+        try:
+            return pd.Timestamp(last_line.split(b",", 1)[0].decode())
+        except ValueError:
+            # only a header
+            return None
+
+    def seed_state(self, start_ts: float, end_ts: float):
+        """
+        Seed the state from existing outputs of a batch run by reading the raw
+        rows up to their last minute as an update from the start would.
+
+        Raises
+        ------
+        ValueError
+            if the combined KPIs read up to the last minute differ from the
+            existing KPI map of a metric
+        """
+        high_water_mark = self.find_output_high_water_mark()
+        if high_water_mark is None:
+            logging.info("Starting live updates from the start of the experiment.")
+            return
+        logging.info(
+            f"Seeding live updates from existing outputs at {high_water_mark} ..."
+        )
+        pod_timelines = LiveUpdater.build_phase_timelines(
+            self.separator.read_pods_metadata(self.exp_name, start_ts, end_ts)
+        )
+        path_folder_merged_kpis = self.separator.build_path_folder_merged_kpis(
+            self.exp_name
+        )
+        for metric_index in self.separator.get_metric_indices_from_raw_dataset(
+            self.exp_name
+        ):
+            combined_kpis = self.read_metric(
+                metric_index, None, high_water_mark, start_ts, end_ts, pod_timelines
+            )
+            if combined_kpis is None:
+                continue
+            path_kpi_map = os.path.join(
+                path_folder_merged_kpis, f"metric-{metric_index}-kpi-map.csv"
+            )
+            if not os.path.exists(path_kpi_map) or not LiveUpdater.is_same_kpi_map(
+                combined_kpis[1],
+                pd.read_csv(path_kpi_map, dtype=str, keep_default_na=False),
+            ):
+                msg = f"Fail to seed live updates of metric {metric_index} from existing outputs, remove them to start over!"
+                logging.error(msg)
+                raise ValueError(msg)
+        self.state["high_water_mark"] = int(high_water_mark.timestamp())
+        self.save_state()
+
+    @staticmethod
+    def is_same_kpi_map(new_kpi_map: list, df_kpi_map: pd.DataFrame) -> bool:
+        """Compare a KPI map with one read as strings from its CSV."""
+        buffer = io.StringIO()
+        pd.DataFrame(new_kpi_map).to_csv(buffer, index=False)
+        buffer.seek(0)
+        return pd.read_csv(buffer, dtype=str, keep_default_na=False).equals(df_kpi_map)
+
+    def find_latest_snapshot_minute(self, start_ts: float, end_ts: float):
+        path_pods_info = os.path.join(
+            self.separator.path_experiments, GCloudMetrics.FNAME_PODS_INFO
+        )
+        snapshot_ts = [
+            int(filename.removesuffix(".json"))
+            for filename in os.listdir(path_pods_info)
+        ]
+        snapshot_ts = [ts for ts in snapshot_ts if start_ts <= ts <= end_ts]
+        if not snapshot_ts:
+            return None
+        return pd.Timestamp(max(snapshot_ts), unit="s").round("min")
+
+    @staticmethod
+    def read_last_timestamp(path_kpi: str) -> float | None:
+        """Read the timestamp of the last complete row of a raw KPI."""
+        with open(path_kpi, "rb") as file_kpi:
+            file_kpi.seek(0, os.SEEK_END)
+            file_kpi.seek(max(file_kpi.tell() - LiveUpdater.TAIL_SIZE, 0))
+            tail = file_kpi.read()
+        # skip a partially written last line and the header
+        for line in reversed(tail[: tail.rfind(b"\n")].split(b"\n")):
+            try:
+                return float(line.split(b",", 1)[0])
+            except ValueError:
+                continue
+        return None
+
+    def find_last_complete_minute(self, upper, end_ts: float):
+        """
+        Limit a minute to the last minute whose raw rows are complete, where
+        the latest raw row of all KPIs is more than half a minute later. Only
+        raw KPIs whose size changed since the last update are read.
+
+        Returns
+        -------
+        Timestamp | None
+            the last complete minute up to upper, None if there are no raw rows
+        """
+        last_ts = None
+        for metric_index in self.separator.get_metric_indices_from_raw_dataset(
+            self.exp_name
+        ):
+            tails = self.get_state_metric(metric_index)["tails"]
+            path_metric_type = self.separator.build_path_metric_type(
+                metric_index, self.exp_name
+            )
+            with os.scandir(path_metric_type) as entries:
+                for entry in entries:
+                    if not (
+                        entry.name.startswith(GCloudMetrics.FNAME_KPI_PREFIX)
+                        and entry.name.endswith(GCloudMetrics.FNAME_KPI_SUFFIX)
+                    ):
+                        continue
+                    size = entry.stat().st_size
+                    tail = tails.get(entry.name)
+                    if tail is None or tail[0] != size:
+                        tail = [size, LiveUpdater.read_last_timestamp(entry.path)]
+                        tails[entry.name] = tail
+                    ts = tail[1]
+                    if ts is not None and (last_ts is None or ts > last_ts):
+                        last_ts = ts
+        if last_ts is None:
+            return None
+        if last_ts > end_ts:
+            # all rows of the experiment arrived
+            return upper
+        # rows up to 30 seconds after a minute are rounded to it
+        last_complete = pd.Timestamp(np.ceil((last_ts - 30) / 60) * 60 - 60, unit="s")
+        return min(upper, last_complete)
+
+    @staticmethod
+    def build_phase_timelines(df_pods_metadata: pd.DataFrame) -> dict:
+        """
+        Build the timeline of phases of each pod.
+
+        Returns
+        -------
+        dict
+            sorted snapshot minutes and the phases at them, keyed by pod names
+        """
+        df_pods_metadata = df_pods_metadata.sort_values("timestamp").drop_duplicates(
+            subset=["timestamp", "pod_name"], keep="last"
+        )
+        return {
+            pod_name: (
+                df_pod["timestamp"].to_numpy(),
+                df_pod["pod_phase"].to_numpy(dtype=object),
+            )
+            for pod_name, df_pod in df_pods_metadata.groupby("pod_name")
+        }
+
+    @staticmethod
+    def find_phases(pod_timeline: tuple | None, timestamps: pd.Index) -> np.ndarray:
+        """Find the phase of the next snapshot of a pod at each minute, or None."""
+        phases = np.full(len(timestamps), None, dtype=object)
+        if pod_timeline is None:
+            return phases
+        snapshot_minutes, snapshot_phases = pod_timeline
+        positions = np.searchsorted(snapshot_minutes, timestamps.to_numpy())
+        in_timeline = positions < len(snapshot_phases)
+        phases[in_timeline] = snapshot_phases[positions[in_timeline]]
+        return phases
+
+    @staticmethod
+    def read_new_rows(
+        path_kpi: str, offset: int, lower, upper, start_ts: float, end_ts: float
+    ) -> tuple[pd.DataFrame, int]:
+        """
+        Read rows of a raw KPI appended after a byte offset up to a minute.
+
+        Returns
+        -------
+        tuple[DataFrame, int]
+            values per minute after lower as GCloudMetrics.read_kpi reads them,
+            and the offset of the first row left for the next update
+        """
+        with open(path_kpi, "rb") as file_kpi:
+            header = file_kpi.readline()
+            start = max(offset, len(header))
+            file_kpi.seek(start)
+            data = file_kpi.read()
+        columns = header.decode().strip().split(",")
+        # skip a partially written last line
+        line_ends = np.flatnonzero(np.frombuffer(data, dtype=np.uint8) == 10) + 1
+        if len(line_ends) == 0:
+            return pd.DataFrame(columns=columns).set_index("timestamp"), start
+        df_kpi = pd.read_csv(
+            io.BytesIO(data[: line_ends[-1]]), names=columns, header=None
+        )
+        minutes = pd.to_datetime(df_kpi["timestamp"], unit="s").dt.round("min")
+        beyond = (minutes > upper).to_numpy()
+        num_rows = int(beyond.argmax()) if beyond.any() else len(df_kpi)
+        new_offset = start + (int(line_ends[num_rows - 1]) if num_rows > 0 else 0)
+        df_kpi = df_kpi.iloc[:num_rows]
+        minutes = minutes.iloc[:num_rows]
+        in_range = (df_kpi["timestamp"] >= start_ts) & (df_kpi["timestamp"] <= end_ts)
+        if lower is not None:
+            in_range &= minutes > lower
+        df_kpi = df_kpi[in_range].assign(timestamp=minutes[in_range])
+        return (
+            df_kpi.drop_duplicates(subset=["timestamp"], keep="last").set_index(
+                "timestamp"
+            ),
+            new_offset,
+        )
+
+    def read_metric(
+        self,
+        metric_index: int,
+        lower,
+        upper,
+        start_ts: float,
+        end_ts: float,
+        pod_timelines: dict,
+    ) -> tuple[pd.DataFrame, list, int] | None:
+        """
+        Read the new minutes of one metric as combined KPIs and advance its
+        state.
+
+        Returns
+        -------
+        tuple[DataFrame, list, int] | None
+            the combined KPIs of the new minutes, the combined KPI map and its
+            number of KPIs before this update, None if there are no new rows
+        """
+        if self.separator.has_packed_points(metric_index, self.exp_name):
+            raise ValueError("Packed KPIs cannot be read incrementally!")
+        metric_name = self.separator.df_metric_type_map.loc[metric_index, "name"]
+        state_metric = self.get_state_metric(metric_index)
+        df_kpi_map = self.separator.read_kpi_map(
+            metric_index, self.exp_name
+        ).reset_index(names="kpi_index")
+        df_exp_kpi_map = self.separator.filter_kpis_in_one_experiment(
+            metric_name, df_kpi_map, metric_index
+        )
+        if df_exp_kpi_map is None or df_exp_kpi_map.empty:
+            return None
+
+        path_kpi_map = os.path.join(
+            self.separator.build_path_folder_merged_kpis(self.exp_name),
+            f"metric-{metric_index}-kpi-map.csv",
+        )
+        new_kpi_map = (
+            pd.read_csv(path_kpi_map).to_dict("records")
+            if os.path.exists(path_kpi_map) and state_metric["kpis"]
+            else []
+        )
+        num_kpis = len(new_kpi_map)
+        kpi_list = []
+        for i in df_exp_kpi_map.index:
+            kpi_index = int(df_exp_kpi_map.loc[i, "kpi_index"])
+            df_kpi, state_metric["offsets"][str(kpi_index)] = LiveUpdater.read_new_rows(
+                self.separator.build_path_kpi(metric_index, kpi_index, self.exp_name),
+                state_metric["offsets"].get(str(kpi_index), 0),
+                lower,
+                upper,
+                start_ts,
+                end_ts,
+            )
+            if df_kpi.empty:
+                continue
+            pod_name = GCloudSeparator.get_pod_name_if_exists(df_exp_kpi_map, i)
+            if self.strategy == Strategy.IGNORE_POD_PHASES or pod_name is None:
+                kpi_phases = [(None, df_kpi)]
+            elif self.strategy == Strategy.CONSIDER_ONLY_RUNNING_PODS:
+                if pd.isna(pod_name):
+                    kpi_phases = [(None, df_kpi)]
+                else:
+                    phases = LiveUpdater.find_phases(
+                        pod_timelines.get(pod_name), df_kpi.index
+                    )
+                    kpi_phases = [("Running", df_kpi[phases == "Running"])]
+            else:
+                phases = LiveUpdater.find_phases(
+                    pod_timelines.get(pod_name), df_kpi.index
+                )
+                kpi_phases = [
+                    (phase, df_kpi[phases == phase])
+                    for phase in pd.unique(phases[phases != None])  # noqa: E711
+                ]
+            for phase, df_kpi_phase in kpi_phases:
+                if df_kpi_phase.empty:
+                    continue
+                key = f"{kpi_index}|{phase}"
+                if key not in state_metric["kpis"]:
+                    new_kpi_map_item = df_exp_kpi_map.loc[i].to_dict()
+                    new_kpi_map_item["kpi_index"] = len(new_kpi_map)
+                    if phase is not None:
+                        new_kpi_map_item["pod_phase"] = phase
+                    state_metric["kpis"][key] = len(new_kpi_map)
+                    new_kpi_map.append(new_kpi_map_item)
+                kpi_list.append(
+                    df_kpi_phase.add_prefix(f'kpi-{state_metric["kpis"][key]}-')
+                )
+        if not kpi_list:
+            return None
+
+        df_kpis = pd.concat(kpi_list, axis=1).sort_index()
+        if len(df_kpis.index) != len(df_kpis.index.drop_duplicates()):
+            df_kpis = df_kpis.groupby("timestamp").agg("mean")
+        metric_kind = self.separator.df_metric_type_map.loc[metric_index]["kind"]
+        if metric_kind == GCloudMetricKind.CUMULATIVE.value:
+            df_kpis = self.reduce_cumulative(df_kpis, state_metric)
+        if self.separator.dtype is not None:
+            df_kpis = df_kpis.astype(self.separator.dtype)
+        return df_kpis, new_kpi_map, num_kpis
+
+    def update_metric(
+        self,
+        metric_index: int,
+        lower,
+        upper,
+        start_ts: float,
+        end_ts: float,
+        pod_timelines: dict,
+    ) -> tuple[pd.DataFrame | None, pd.DataFrame | None]:
+        """
+        Append the new minutes of one metric to its combined and aggregated
+        outputs.
+
+        Returns
+        -------
+        tuple[DataFrame | None, DataFrame | None]
+            the aggregated new minutes and the earlier minutes of aggregated
+            columns first seen in this update
+        """
+        combined_kpis = self.read_metric(
+            metric_index, lower, upper, start_ts, end_ts, pod_timelines
+        )
+        if combined_kpis is None:
+            return None, None
+        df_kpis, new_kpi_map, num_kpis = combined_kpis
+        metric_name = self.separator.df_metric_type_map.loc[metric_index, "name"]
+        path_folder_merged_kpis = self.separator.build_path_folder_merged_kpis(
+            self.exp_name
+        )
+        path_metric = os.path.join(
+            path_folder_merged_kpis, f"metric-{metric_index}.csv"
+        )
+        path_kpi_map = os.path.join(
+            path_folder_merged_kpis, f"metric-{metric_index}-kpi-map.csv"
+        )
+        if len(new_kpi_map) != num_kpis or not os.path.exists(path_kpi_map):
+            pd.DataFrame(new_kpi_map).to_csv(path_kpi_map, index=False)
+        LiveUpdater.append_rows(path_metric, df_kpis)
+
+        if self.aggregator.is_constant_metric(metric_index, metric_name):
+            return None, None
+        # read the KPI map back to infer label types as in batch aggregation
+        df_kpi_map_combined = GCloudMetrics.to_categorical(pd.read_csv(path_kpi_map))
+        columns = pd.read_csv(path_metric, nrows=0).columns.drop("timestamp")
+        df_agg_metric = self.aggregator.aggregate_kpis(
+            metric_index,
+            metric_name,
+            df_kpi_map_combined,
+            df_kpis.reindex(columns=columns),
+        )
+        if df_agg_metric is None or df_agg_metric.empty:
+            return None, None
+        path_aggregated = os.path.join(
+            self.aggregator.aggregated_metrics_path, f"metric-{metric_index}.csv"
+        )
+        df_agg_earlier = self.aggregate_earlier_minutes(
+            metric_index,
+            metric_name,
+            df_kpi_map_combined,
+            columns,
+            path_aggregated,
+            df_agg_metric.columns,
+        )
+        LiveUpdater.append_rows(path_aggregated, df_agg_metric, df_agg_earlier)
+        return df_agg_metric, df_agg_earlier
+
+    def aggregate_earlier_minutes(
+        self,
+        metric_index: int,
+        metric_name: str,
+        df_kpi_map: pd.DataFrame,
+        kpi_columns: pd.Index,
+        path_aggregated: str,
+        agg_columns: pd.Index,
+    ) -> pd.DataFrame | None:
+        """
+        Aggregate the minutes already in an aggregated metric for its columns
+        first seen in this update. The KPIs of these columns have no values in
+        earlier minutes, which batch aggregation reduces to e.g. a zero sum.
+
+        Returns
+        -------
+        DataFrame | None
+            the new columns in earlier minutes, None if there are none
+        """
+        if not os.path.exists(path_aggregated):
+            return None
+        columns = pd.read_csv(path_aggregated, nrows=0).columns.drop("timestamp")
+        new_columns = agg_columns.difference(columns)
+        if new_columns.empty:
+            return None
+        index = pd.read_csv(
+            path_aggregated,
+            usecols=["timestamp"],
+            index_col="timestamp",
+            parse_dates=True,
+        ).index
+        df_agg_earlier = self.aggregator.aggregate_kpis(
+            metric_index,
+            metric_name,
+            df_kpi_map.copy(),
+            pd.DataFrame(np.nan, index=index, columns=kpi_columns),
+        )
+        return df_agg_earlier[new_columns]
+
+    @staticmethod
+    def reduce_cumulative(df_kpis: pd.DataFrame, state_metric: dict) -> pd.DataFrame:
+        """
+        Difference cumulative KPIs continuing from the last raw row of the
+        previous update, and keep the last raw row of this update.
+        """
+        last_row = {
+            column: np.nan if value is None else value
+            for column, value in state_metric["last_row"].items()
+        }
+        has_previous = bool(last_row)
+        state_metric["last_row"] = {
+            column: None if pd.isna(value) else float(value)
+            for column, value in df_kpis.iloc[-1].items()
+        }
+        if has_previous:
+            df_previous = pd.DataFrame([last_row]).reindex(columns=df_kpis.columns)
+            df_kpis = pd.concat([df_previous.set_axis([pd.NaT]), df_kpis])
+        df_kpis = df_kpis.apply(GCloudMetrics.reduce_cumulative)
+        return df_kpis.iloc[1:] if has_previous else df_kpis
+
+    @staticmethod
+    def append_rows(path_csv: str, df: pd.DataFrame, df_earlier: pd.DataFrame = None):
+        """
+        Append rows to a CSV indexed by timestamp, rewriting it if new columns
+        appear, with their values in existing rows taken from df_earlier or
+        NaN.
+        """
+        df = df.rename_axis("timestamp")
+        if not os.path.exists(path_csv):
+            df.to_csv(path_csv)
+            return
+        columns = pd.read_csv(path_csv, nrows=0).columns.drop("timestamp")
+        if df.columns.isin(columns).all():
+            df.reindex(columns=columns).to_csv(path_csv, mode="a", header=False)
+            return
+        logging.info(f"Rewriting {path_csv} with new columns ...")
+        df_existing = pd.read_csv(path_csv, index_col="timestamp", parse_dates=True)
+        if df_earlier is not None:
+            df_earlier = df_earlier.drop(columns=df_existing.columns, errors="ignore")
+            df_existing = pd.concat(
+                [df_existing, df_earlier.reindex(df_existing.index)], axis=1
+            )
+        pd.concat([df_existing, df]).to_csv(path_csv)
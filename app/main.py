@@ -1,16 +1,31 @@
 import os
 from app.agg.strategy import Strategy
+from app.column_pruner import ColumnPruner
+from app.dataset_assembler import DatasetAssembler
+from app.experiment_context import ExperimentContext
+from app.feature_matrix import FeatureMatrix
 from app.gcloud_aggregator import GCloudAggregator
 from app.gcloud_metrics import GCloudMetrics
 from app.gcloud_separator import GCloudSeparator
+from app.stacked_aggregator import StackedAggregator
+from app.time_series_ingester import TimeSeriesIngester
 import logging
-from multiprocessing import Pool
+from datetime import datetime
 import pandas as pd
 
 from app.locust_aggregator import LocustAggregator
 
+COL_EXPERIMENT = "experiment"
 
-def aggregate_metrics(fname_exp_yaml: str, filename_metadata_yaml: str, exp_index: int):
+
+def aggregate_metrics(
+    fname_exp_yaml: str,
+    filename_metadata_yaml: str,
+    exp_index: int,
+    dtype=None,
+    rolling_features: bool = False,
+    impute_gaps: bool = False,
+):
     gcloud_aggregator = GCloudAggregator(
         fname_exp_yaml,
         filename_metadata_yaml,
@@ -18,20 +33,59 @@ def aggregate_metrics(fname_exp_yaml: str, filename_metadata_yaml: str, exp_inde
         strategy=Strategy.CONSIDER_POD_PHASES,
         enforce_existing_aggregations=False,
         for_normal_dataset=True,
+        dtype=dtype,
     )
     gcloud_aggregator.aggregate_all_metrics()
     gcloud_aggregator.merge_all_metrics()
+    if rolling_features:
+        gcloud_aggregator.compute_rolling_features()
+    if impute_gaps:
+        gcloud_aggregator.impute_gaps()
 
 
-def separate_metrics(fname_exp_yaml: str, exp_index: int):
+def aggregate_metrics_stacked(
+    fname_exp_yaml: str,
+    filename_metadata_yaml: str,
+    dtype=None,
+    rolling_features: bool = False,
+    impute_gaps: bool = False,
+):
+    """Aggregate metrics of all experiments in a YAML together, then merge each."""
+    stacked_aggregator = StackedAggregator(
+        fname_exp_yaml,
+        filename_metadata_yaml,
+        strategy=Strategy.CONSIDER_POD_PHASES,
+        enforce_existing_aggregations=False,
+        for_normal_dataset=True,
+        dtype=dtype,
+    )
+    stacked_aggregator.aggregate_all_metrics()
+    for gcloud_aggregator in stacked_aggregator.aggregators:
+        gcloud_aggregator.merge_all_metrics()
+        if rolling_features:
+            gcloud_aggregator.compute_rolling_features()
+        if impute_gaps:
+            gcloud_aggregator.impute_gaps()
+
+
+def separate_metrics(fname_exp_yaml: str, exp_index: int, dtype=None):
     gcloud_separator = GCloudSeparator(
-        fname_exp_yaml, exp_index, strategy=Strategy.CONSIDER_POD_PHASES
+        fname_exp_yaml, exp_index, strategy=Strategy.CONSIDER_POD_PHASES, dtype=dtype
     )
     gcloud_separator.separate_kpis()
 
 
+def astype_values(df: pd.DataFrame, dtype) -> pd.DataFrame:
+    """Convert float64 columns to dtype if given."""
+    if dtype is None:
+        return df
+    return df.astype(
+        {column: dtype for column in df.select_dtypes(include="float64").columns}
+    )
+
+
 def merge_normal_experiments(
-    fname_exp_yaml: str, ignore_timestamp: bool, separated_locust: bool
+    fname_exp_yaml: str, ignore_timestamp: bool, separated_locust: bool, dtype=None
 ):
     """
     Merge DataFrames of normal experiments into one DataFrame.
@@ -45,6 +99,8 @@ def merge_normal_experiments(
     separated_locust : bool
         set True to process locust statistics from a list of experiments,
         otherwise process locust statistics from path_experiments only
+    dtype : str | type
+        the type of merged values, e.g. float32, float64 if not given
     """
     exp_yaml = GCloudMetrics.parse_experiment_yaml(fname_exp_yaml)
     normal_exps = []
@@ -55,7 +111,7 @@ def merge_normal_experiments(
         path_experiment_csv = os.path.join(
             exp_yaml["path_experiments"], exp_name, exp_name + ".csv"
         )
-        df_exp = pd.read_csv(path_experiment_csv)
+        df_exp = GCloudMetrics.read_values_csv(path_experiment_csv, dtype)
         df_exp["timestamp"] = pd.to_datetime(df_exp["timestamp"])
         if separated_locust:
             # read locust KPIs from the specified experiment folder into a DataFrame
@@ -67,6 +123,8 @@ def merge_normal_experiments(
             df_exp = df_exp.set_index("timestamp").join(df_locust, how="inner")
             if ignore_timestamp:
                 df_exp.reset_index(drop=True, inplace=True)
+        # keep track of experiment boundaries for the feature matrix
+        df_exp[COL_EXPERIMENT] = exp_name
         normal_exps.append(df_exp)
     output_path = os.path.join(
         exp_yaml["path_experiments"], fname_exp_yaml.removesuffix(".yaml") + ".csv"
@@ -83,17 +141,26 @@ def merge_normal_experiments(
             .reset_index()
         )
 
+    experiments = df_normal_exps.pop(COL_EXPERIMENT)
+    df_normal_exps = astype_values(df_normal_exps, dtype)
     df_normal_exps.to_csv(output_path, index=False)
+    if "timestamp" in df_normal_exps.columns:
+        df_normal_exps = df_normal_exps.set_index("timestamp")
+    elif df_normal_exps.index.name != "timestamp":
+        df_normal_exps = df_normal_exps.reset_index(drop=True)
+    FeatureMatrix.write(
+        df_normal_exps, FeatureMatrix.build_path_prefix(output_path), experiments
+    )
 
 
-def merge_experiment_with_locust_stats(fname_exp_yaml: str):
+def merge_experiment_with_locust_stats(fname_exp_yaml: str, dtype=None):
     exp_yaml = GCloudMetrics.parse_experiment_yaml(fname_exp_yaml)
     experiment = exp_yaml["experiments"][0]
     exp_name = experiment["name"]
     print(f"Merging {exp_name}")
     # read gcloud KPIs into a DataFrame
     path_experiment_csv = os.path.join(exp_yaml["path_experiments"], exp_name + ".csv")
-    df_exp = pd.read_csv(path_experiment_csv)
+    df_exp = GCloudMetrics.read_values_csv(path_experiment_csv, dtype)
     df_exp["timestamp"] = pd.to_datetime(df_exp["timestamp"])
     df_locust = LocustAggregator.read_locust_kpi(exp_yaml["path_experiments"], None)
     df_locust = LocustAggregator.aggregate_all_metrics(df_locust)
@@ -101,9 +168,138 @@ def merge_experiment_with_locust_stats(fname_exp_yaml: str):
     df_normal_exps = (
         df_exp.set_index("timestamp").join(df_locust, how="inner").reset_index()
     )
+    df_normal_exps = astype_values(df_normal_exps, dtype)
     df_normal_exps.to_csv(path_experiment_csv, index=False)
 
 
+def assemble_experiments(fnames_exp_yaml: list, path_prefix: str):
+    """
+    Assemble merged experiments of several experiment YAMLs into one feature
+    matrix with the union of their columns.
+
+    Parameters
+    ----------
+    fnames_exp_yaml : list
+        filenames of experiment YAMLs
+    path_prefix : str
+        the path of the assembled feature matrix without suffixes
+    """
+    DatasetAssembler(fnames_exp_yaml).assemble(path_prefix)
+
+
+def ingest_time_series(
+    fname_exp_yaml: str,
+    exp_index: int,
+    path_pages: str,
+    path_metric_type_map: str = None,
+):
+    """
+    Ingest saved pages of timeSeries.list responses into the raw dataset of
+    an experiment.
+
+    Parameters
+    ----------
+    fname_exp_yaml : str
+        filename of the experiment YAML
+    exp_index : int
+        the index of the experiment in the YAML
+    path_pages : str
+        the folder of saved pages
+    path_metric_type_map : str
+        a metric type map to take indices of new metric types from
+    """
+    exp_yaml = GCloudMetrics.parse_experiment_yaml(fname_exp_yaml)
+    path_raw_dataset = os.path.join(
+        exp_yaml["path_experiments"],
+        exp_yaml["experiments"][exp_index]["name"],
+        GCloudMetrics.FDNAME_ORIGINAL_KPIS,
+    )
+    TimeSeriesIngester(path_raw_dataset, path_metric_type_map).ingest(path_pages)
+
+
+def prune_columns(fname_exp_yaml: str, exp_index: int, path_reduction: str = None):
+    """
+    Write a reduced feature matrix of a merged experiment without redundant
+    columns.
+
+    Parameters
+    ----------
+    fname_exp_yaml : str
+        filename of the experiment YAML
+    exp_index : int
+        the index of the experiment in the YAML
+    path_reduction : str
+        a reduction found for another experiment to keep the same columns,
+        otherwise redundant columns of this experiment are found
+    """
+    gcloud_metrics = GCloudMetrics(fname_exp_yaml)
+    exp_name = gcloud_metrics.experiments[exp_index]["name"]
+    path_prefix = FeatureMatrix.build_path_prefix(
+        os.path.join(gcloud_metrics.build_path_experiment(exp_name), exp_name + ".csv")
+    )
+    if path_reduction is None:
+        reduction = ColumnPruner().fit(path_prefix)
+    else:
+        reduction = ColumnPruner.load_reduction(path_reduction)
+    ColumnPruner.apply(path_prefix, reduction)
+
+
+def load_experiment_context(
+    inputs: list, filename_metadata_yaml: str = None
+) -> ExperimentContext:
+    """
+    Load the context of experiments once for all workers of a pool.
+
+    Parameters
+    ----------
+    inputs : list
+        pairs of the filename of an experiment YAML and the experiment index
+    filename_metadata_yaml : str
+        filename of the metadata YAML, set it to load what aggregation needs
+    """
+    context = ExperimentContext()
+    for fname_exp_yaml, exp_index in inputs:
+        gcloud_metrics = GCloudMetrics(fname_exp_yaml)
+        context.add(
+            ExperimentContext.KIND_EXP_YAML,
+            fname_exp_yaml,
+            GCloudMetrics.parse_experiment_yaml(fname_exp_yaml),
+        )
+        experiment = gcloud_metrics.experiments[exp_index]
+        context.add(
+            ExperimentContext.KIND_METRIC_TYPE_MAP,
+            gcloud_metrics.build_path_experiment(experiment["name"]),
+            gcloud_metrics.read_metric_type_map(experiment["name"]),
+        )
+        if filename_metadata_yaml is not None:
+            # aggregation does not read metadata of nodes and pods
+            continue
+        start_ts = datetime.fromisoformat(experiment["start"]).timestamp()
+        end_ts = datetime.fromisoformat(experiment["end"]).timestamp()
+        context.add(
+            ExperimentContext.KIND_NODES_METADATA,
+            (gcloud_metrics.path_experiments, experiment["start"], experiment["end"]),
+            gcloud_metrics.read_nodes_metadata(experiment),
+        )
+        context.add(
+            ExperimentContext.KIND_PODS_METADATA,
+            (gcloud_metrics.path_experiments, start_ts, end_ts),
+            gcloud_metrics.read_pods_metadata(experiment["name"], start_ts, end_ts),
+        )
+    if filename_metadata_yaml is not None:
+        context.add(
+            ExperimentContext.KIND_METADATA_YAML,
+            filename_metadata_yaml,
+            GCloudAggregator.parse_metadata_yaml(filename_metadata_yaml),
+        )
+        context.add(
+            ExperimentContext.KIND_CONSTANT_METRICS,
+            GCloudAggregator.PATH_CONSTANT_METRIC,
+            GCloudAggregator.read_constant_metrics(),
+        )
+    return context
+
+
 def separate_metrics_with_multiprocess():
     inputs = [
         ("memory-stress-ts-auth-service-111717.yaml", 0),
@@ -111,10 +307,15 @@ def separate_metrics_with_multiprocess():
         ("network-delay-ts-auth-service-112515.yaml", 0),
     ]
     num_processes = min(len(inputs), 8)
-    with Pool(processes=num_processes) as pool:
-        pool.starmap(separate_metrics, inputs)
-        pool.close()
-        pool.join()
+    # workers share the context loaded once in this process
+    context = load_experiment_context(inputs)
+    try:
+        with ExperimentContext.create_pool(context, num_processes) as pool:
+            pool.starmap(separate_metrics, inputs)
+            pool.close()
+            pool.join()
+    finally:
+        ExperimentContext.unpublish()
 
 
 def aggregate_metrics_with_multiprocess():
@@ -126,10 +327,18 @@ def aggregate_metrics_with_multiprocess():
         ("network-delay-ts-auth-service-112515.yaml", "train_ticket.yaml", 0),
     ]
     num_processes = min(len(inputs), 8)
-    with Pool(processes=num_processes) as pool:
-        pool.starmap(aggregate_metrics, inputs)
-        pool.close()
-        pool.join()
+    # workers share the context loaded once in this process
+    context = load_experiment_context(
+        [(fname_exp_yaml, exp_index) for fname_exp_yaml, _, exp_index in inputs],
+        "train_ticket.yaml",
+    )
+    try:
+        with ExperimentContext.create_pool(context, num_processes) as pool:
+            pool.starmap(aggregate_metrics, inputs)
+            pool.close()
+            pool.join()
+    finally:
+        ExperimentContext.unpublish()
 
 
 def process_single_experiment(fname_exp_yaml: str):
@@ -0,0 +1,162 @@
+import cProfile
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+
+class StackSampler:
+    """
+    Sample the Python stack of one thread at a fixed interval from a
+    background thread and count identical stacks.
+
+    Stacks are written in the folded format of flame graphs, one
+    semicolon-separated stack from the root per line followed by its count,
+    which flamegraph.pl and speedscope render.
+    """
+
+    def __init__(self, thread_id: int, interval: float):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.counts = Counter()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(
+                    f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+                )
+                frame = frame.f_back
+            if stack:
+                self.counts[";".join(reversed(stack))] += 1
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+
+    def write(self, path_folded: str):
+        with open(path_folded, "w") as file_folded:
+            for stack, count in self.counts.most_common():
+                file_folded.write(f"{stack} {count}\n")
+
+
+class MetricProfiler:
+    """
+    Profile the processing of single metrics on demand.
+
+    Metrics in a list of metric indices are profiled deterministically with
+    cProfile into a .prof file. If a threshold is set, every other metric is
+    sampled at a low rate, and the samples are written as folded stacks of a
+    flame graph only if the metric takes at least the threshold. Profiles are
+    written to the folder profiles of the experiment, named by the stage and
+    the metric, e.g. aggregate-metric-102.folded.
+
+    The profiler is configured by the environment variables
+    GCLOUD_METRICS_PROFILE_METRICS, e.g. 102,115,
+    GCLOUD_METRICS_PROFILE_THRESHOLD in seconds and
+    GCLOUD_METRICS_PROFILE_INTERVAL in seconds, 0.01 by default, so that
+    workers of a pool inherit it. It is disabled if neither metrics nor a
+    threshold are set.
+    """
+
+    ENV_METRICS = "GCLOUD_METRICS_PROFILE_METRICS"
+    ENV_THRESHOLD = "GCLOUD_METRICS_PROFILE_THRESHOLD"
+    ENV_INTERVAL = "GCLOUD_METRICS_PROFILE_INTERVAL"
+    FDNAME_PROFILES = "profiles"
+    FNAME_PROFILE_SUFFIX = ".prof"
+    FNAME_FOLDED_SUFFIX = ".folded"
+
+    def __init__(
+        self,
+        metric_indices: list = None,
+        threshold: float = None,
+        interval: float = 0.01,
+    ):
+        """
+        Parameters
+        ----------
+        metric_indices : list
+            indices of metrics always profiled with cProfile
+        threshold : float
+            the number of seconds from which a sampled metric is written
+        interval : float
+            the number of seconds between samples
+        """
+        self.metric_indices = set(metric_indices) if metric_indices else set()
+        self.threshold = threshold
+        self.interval = interval
+
+    @staticmethod
+    def from_environment() -> "MetricProfiler":
+        metrics = os.environ.get(MetricProfiler.ENV_METRICS, "")
+        threshold = os.environ.get(MetricProfiler.ENV_THRESHOLD)
+        interval = os.environ.get(MetricProfiler.ENV_INTERVAL)
+        return MetricProfiler(
+            [int(metric_index) for metric_index in metrics.split(",") if metric_index],
+            float(threshold) if threshold else None,
+            float(interval) if interval else 0.01,
+        )
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.metric_indices) or self.threshold is not None
+
+    @staticmethod
+    def build_path_profile(
+        path_experiment: str, stage: str, metric_index: int, suffix: str
+    ) -> str:
+        path_profiles = os.path.join(path_experiment, MetricProfiler.FDNAME_PROFILES)
+        os.makedirs(path_profiles, exist_ok=True)
+        return os.path.join(path_profiles, f"{stage}-metric-{metric_index}{suffix}")
+
+    @contextmanager
+    def profile(self, path_experiment: str, stage: str, metric_index: int):
+        """Profile the processing of a metric within the context if requested."""
+        if metric_index in self.metric_indices:
+            profiler = cProfile.Profile()
+            profiler.enable()
+            try:
+                yield
+            finally:
+                profiler.disable()
+                path_profile = MetricProfiler.build_path_profile(
+                    path_experiment,
+                    stage,
+                    metric_index,
+                    MetricProfiler.FNAME_PROFILE_SUFFIX,
+                )
+                profiler.dump_stats(path_profile)
+                logging.info(f"Profile of metric {metric_index} in {path_profile}.")
+        elif self.threshold is not None:
+            sampler = StackSampler(threading.get_ident(), self.interval)
+            start = time.perf_counter()
+            sampler.start()
+            try:
+                yield
+            finally:
+                sampler.stop()
+                elapsed = time.perf_counter() - start
+                if elapsed >= self.threshold:
+                    path_folded = MetricProfiler.build_path_profile(
+                        path_experiment,
+                        stage,
+                        metric_index,
+                        MetricProfiler.FNAME_FOLDED_SUFFIX,
+                    )
+                    sampler.write(path_folded)
+                    logging.info(
+                        f"Metric {metric_index} took {elapsed:.1f} s, samples in {path_folded}."
+                    )
+        else:
+            yield
@@ -0,0 +1,342 @@
+import numpy as np
+import pandas as pd
+
+from app.agg.agg_method import AggMethod
+from app.agg.strategy import Strategy
+
+try:
+    import polars as pl
+except ImportError:
+    pl = None
+
+
+class PolarsKpis:
+    """
+    Combined KPIs of one metric in a Polars DataFrame with a timestamp column,
+    built and aggregated by lazy plans that Polars runs multi-threaded with its
+    streaming engine.
+
+    Separation scans all raw KPIs of a metric in one plan: it filters the
+    experiment window, rounds timestamps to minutes, assigns pod phases,
+    averages duplicated minutes and differences counters as the pandas engine.
+
+    Handlers reduce it like a DataFrame with horizontal expressions.
+    """
+
+    DATETIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+    # unpivoted values, named apart from raw fields such as value
+    COL_VALUE = "__value"
+
+    def __init__(self, df: "pl.DataFrame", column_names: list = None):
+        """
+        Parameters
+        ----------
+        df : polars.DataFrame
+            KPIs with a timestamp column, sorted by timestamps
+        column_names : list
+            the names of the selected columns, all but timestamp by default
+        """
+        self.df = df
+        self.column_names = (
+            [column for column in df.columns if column != "timestamp"]
+            if column_names is None
+            else list(column_names)
+        )
+
+    @staticmethod
+    def check_installed():
+        if pl is None:
+            raise ImportError("Polars is required by the Polars engine!")
+
+    @staticmethod
+    def collect(lf: "pl.LazyFrame") -> "pl.DataFrame":
+        """Collect a lazy plan with the streaming engine."""
+        try:
+            return lf.collect(engine="streaming")
+        except TypeError:
+            # versions before the engine argument
+            return lf.collect(streaming=True)
+
+    @staticmethod
+    def to_polars_dtype(dtype) -> "pl.DataType":
+        return pl.Float32 if np.dtype(dtype) == np.float32 else pl.Float64
+
+    @staticmethod
+    def round_minutes(seconds: "pl.Expr") -> "pl.Expr":
+        """Round UNIX seconds to minutes with ties to even as pandas rounds."""
+        minutes = (seconds / 60).floor()
+        remainders = seconds - minutes * 60
+        round_up = (remainders > 30) | ((remainders == 30) & (minutes % 2 == 1))
+        return pl.from_epoch(
+            ((minutes + round_up.cast(pl.Float64)) * 60).cast(pl.Int64),
+            time_unit="s",
+        ).cast(pl.Datetime("us"))
+
+    @staticmethod
+    def scan_kpi(path_kpi: str, start_ts: float, end_ts: float) -> "pl.LazyFrame":
+        """Scan values of a KPI per minute as GCloudMetrics.read_kpi reads them."""
+        lf = pl.scan_csv(path_kpi)
+        return (
+            lf.with_columns(pl.exclude("timestamp").cast(pl.Float64))
+            .filter(pl.col("timestamp").is_between(start_ts, end_ts))
+            .with_columns(
+                PolarsKpis.round_minutes(pl.col("timestamp").cast(pl.Float64))
+            )
+            .unique(subset=["timestamp"], keep="last", maintain_order=True)
+        )
+
+    @staticmethod
+    def scan_pod_phases(df_pod_phases: pd.DataFrame) -> "pl.LazyFrame":
+        return pl.LazyFrame(
+            {
+                "timestamp": df_pod_phases["timestamp"].to_numpy(
+                    dtype="datetime64[us]"
+                ),
+                "pod_phase": df_pod_phases["pod_phase"].astype(str).tolist(),
+            }
+        ).with_columns(pl.col("timestamp").cast(pl.Datetime("us")))
+
+    @staticmethod
+    def reduce_cumulative(column: "pl.Expr") -> "pl.Expr":
+        column = column.cast(pl.Float64)
+        deltas = column - column.shift(1)
+        # null where counters reset, named after the column
+        return pl.when(deltas >= 0).then(deltas)
+
+    @staticmethod
+    def from_raw_kpis(
+        raw_kpis: list,
+        start_ts: float,
+        end_ts: float,
+        strategy: Strategy,
+        is_cumulative: bool,
+    ) -> tuple["PolarsKpis", list]:
+        """
+        Combine raw KPIs of one metric in one lazy plan.
+
+        Parameters
+        ----------
+        raw_kpis : list
+            tuples of the path of a raw KPI, its KPI map item and the snapshots
+            of its pod as a DataFrame of timestamp and pod_phase, where the
+            snapshots are None if the KPI is not separated by pod phases
+        start_ts : float
+            the UNIX timestamp in seconds at the start of the experiment
+        end_ts : float
+            the UNIX timestamp in seconds at the end of the experiment
+        strategy : Strategy
+            CONSIDER_ONLY_RUNNING_PODS keeps minutes whose next snapshot phase
+            is Running, other strategies split KPIs by the next observed phase
+        is_cumulative : bool
+            set True to difference counters
+
+        Returns
+        -------
+        tuple[PolarsKpis, list]
+            the combined KPIs and the combined KPI map
+        """
+        PolarsKpis.check_installed()
+        plans = []
+        fields_of_kpis = []
+        for position, (path_kpi, _, df_pod_phases) in enumerate(raw_kpis):
+            lf = PolarsKpis.scan_kpi(path_kpi, start_ts, end_ts)
+            fields = [
+                name for name in lf.collect_schema().names() if name != "timestamp"
+            ]
+            fields_of_kpis.append(fields)
+            lf = lf.with_row_index("row")
+            if df_pod_phases is None:
+                lf = lf.with_columns(pod_phase=pl.lit(None, dtype=pl.String))
+            else:
+                lf_pod_phases = PolarsKpis.scan_pod_phases(df_pod_phases)
+                if strategy == Strategy.CONSIDER_ONLY_RUNNING_PODS:
+                    # the phase of the next snapshot
+                    lf = lf.sort("timestamp").join_asof(
+                        lf_pod_phases.sort("timestamp"),
+                        on="timestamp",
+                        strategy="forward",
+                    )
+                    lf = lf.filter(pl.col("pod_phase") == "Running")
+                else:
+                    # the next observed phase over rows of the KPI
+                    lf = (
+                        lf.join(lf_pod_phases, on="timestamp", how="left")
+                        .sort("row")
+                        .with_columns(pl.col("pod_phase").backward_fill())
+                        .filter(pl.col("pod_phase").is_not_null())
+                    )
+            plans.append(
+                lf.unpivot(
+                    on=fields,
+                    index=["row", "timestamp", "pod_phase"],
+                    variable_name="field",
+                    value_name=PolarsKpis.COL_VALUE,
+                ).with_columns(position=pl.lit(position, dtype=pl.Int64))
+            )
+        df_long = PolarsKpis.collect(pl.concat(plans, how="vertical"))
+
+        # phases of each KPI in the order of their first rows
+        phases_of_kpis = {}
+        for position, pod_phase in (
+            df_long.group_by(["position", "pod_phase"])
+            .agg(pl.col("row").min())
+            .sort(["position", "row"])
+            .select(["position", "pod_phase"])
+            .iter_rows()
+        ):
+            phases_of_kpis.setdefault(position, []).append(pod_phase)
+        new_kpi_map = []
+        column_names = []
+        keys = []
+        for position, (_, kpi_map_item, df_pod_phases) in enumerate(raw_kpis):
+            phases = (
+                [None] if df_pod_phases is None else phases_of_kpis.get(position, [])
+            )
+            for pod_phase in phases:
+                new_kpi_map_item = dict(kpi_map_item, kpi_index=len(new_kpi_map))
+                if pod_phase is not None:
+                    new_kpi_map_item["pod_phase"] = pod_phase
+                keys.append((position, pod_phase or "", len(new_kpi_map)))
+                column_names.extend(
+                    f"kpi-{len(new_kpi_map)}-{field}"
+                    for field in fields_of_kpis[position]
+                )
+                new_kpi_map.append(new_kpi_map_item)
+        if not new_kpi_map:
+            return PolarsKpis(pl.DataFrame({"timestamp": []})), new_kpi_map
+
+        lf_keys = pl.LazyFrame(
+            keys, schema=["position", "pod_phase", "kpi_index"], orient="row"
+        )
+        lf_long = (
+            df_long.lazy()
+            .with_columns(pl.col("pod_phase").fill_null(""))
+            .join(lf_keys, on=["position", "pod_phase"], how="inner")
+            .select(
+                "timestamp",
+                pl.format("kpi-{}-{}", "kpi_index", "field").alias("column"),
+                PolarsKpis.COL_VALUE,
+            )
+            # average duplicated minutes
+            .group_by(["timestamp", "column"])
+            .agg(pl.col(PolarsKpis.COL_VALUE).mean())
+        )
+        df_wide = (
+            PolarsKpis.collect(lf_long)
+            .pivot(on="column", index="timestamp", values=PolarsKpis.COL_VALUE)
+            .sort("timestamp")
+        )
+        df_wide = df_wide.select(
+            "timestamp",
+            *[
+                (
+                    pl.col(column)
+                    if column in df_wide.columns
+                    else pl.lit(None, dtype=pl.Float64).alias(column)
+                )
+                for column in column_names
+            ],
+        )
+        if is_cumulative:
+            df_wide = df_wide.with_columns(
+                [
+                    PolarsKpis.reduce_cumulative(pl.col(column))
+                    for column in column_names
+                ]
+            )
+        return PolarsKpis(df_wide), new_kpi_map
+
+    @staticmethod
+    def from_csv(path_csv: str, dtype=np.float64) -> "PolarsKpis":
+        """Read combined KPIs of one metric from a wide CSV."""
+        PolarsKpis.check_installed()
+        lf = pl.scan_csv(path_csv, schema_overrides={"timestamp": pl.String})
+        return PolarsKpis(
+            PolarsKpis.collect(
+                lf.with_columns(
+                    pl.col("timestamp").str.to_datetime(),
+                    pl.exclude("timestamp").cast(PolarsKpis.to_polars_dtype(dtype)),
+                ).sort("timestamp")
+            )
+        )
+
+    def write_csv(self, path_csv: str):
+        self.df.select("timestamp", *self.column_names).write_csv(
+            path_csv, datetime_format=PolarsKpis.DATETIME_FORMAT
+        )
+
+    def astype(self, dtype) -> "PolarsKpis":
+        return PolarsKpis(
+            self.df.with_columns(
+                pl.col(self.column_names).cast(PolarsKpis.to_polars_dtype(dtype))
+            ),
+            self.column_names,
+        )
+
+    @property
+    def columns(self) -> pd.Index:
+        return pd.Index(self.column_names)
+
+    @property
+    def empty(self) -> bool:
+        return self.df.height == 0 or len(self.column_names) == 0
+
+    def __getitem__(self, columns: list) -> "PolarsKpis":
+        missing = [column for column in columns if column not in self.df.columns]
+        if missing:
+            raise KeyError(f"Columns {missing}!")
+        return PolarsKpis(self.df.select("timestamp", *columns), columns)
+
+    def to_frame(self) -> pd.DataFrame:
+        return pd.DataFrame(
+            {column: self.df[column].to_numpy() for column in self.column_names},
+            index=pd.DatetimeIndex(self.df["timestamp"].to_numpy(), name="timestamp"),
+        )
+
+    def rename(self, columns: dict) -> pd.DataFrame:
+        return self.to_frame().rename(columns=columns)
+
+    @staticmethod
+    def build_row_statistic(name: str, columns: list) -> "pl.Expr | None":
+        """Build a horizontal expression of a method, None if not supported."""
+        if name == "min":
+            return pl.min_horizontal(columns)
+        if name == "max":
+            return pl.max_horizontal(columns)
+        if name == "mean":
+            return pl.mean_horizontal(columns)
+        if name == "sum":
+            return pl.sum_horizontal(columns)
+        if name == "count":
+            return pl.sum_horizontal([column.is_not_null() for column in columns])
+        quantile = AggMethod.get_quantile(name)
+        if quantile is None:
+            return None
+        # linear interpolation as numpy.percentile
+        return (
+            pl.concat_list(columns)
+            .list.eval(
+                pl.element().drop_nulls().quantile(quantile, interpolation="linear")
+            )
+            .list.first()
+        )
+
+    def agg(self, agg_methods: list, axis: int = 1) -> pd.DataFrame:
+        """Aggregate the selected KPIs per minute like DataFrame.agg with axis=1."""
+        if axis != 1:
+            return self.to_frame().agg(agg_methods, axis=axis)
+        names = [AggMethod.get_name(method) for method in agg_methods]
+        columns = [pl.col(column) for column in self.column_names]
+        statistics = []
+        for name in names:
+            statistic = PolarsKpis.build_row_statistic(name, columns)
+            if statistic is None:
+                return self.to_frame().agg(agg_methods, axis=1)
+            statistics.append(statistic.alias(name))
+        df_agg = PolarsKpis.collect(self.df.lazy().select(statistics))
+        df_agg = pd.DataFrame(
+            {name: df_agg[name].to_numpy() for name in names},
+            index=pd.DatetimeIndex(self.df["timestamp"].to_numpy(), name="timestamp"),
+        )
+        # mixed results are floats as in DataFrame.agg
+        return df_agg if names == ["count"] else df_agg.astype(np.float64)
@@ -0,0 +1,267 @@
+import io
+import json
+import logging
+import os
+import re
+import threading
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlencode, urlparse
+from urllib.request import urlopen
+
+import numpy as np
+import pandas as pd
+
+from app.feature_matrix import FeatureMatrix
+from app.gcloud_metrics import GCloudMetrics
+
+
+class ColumnCache:
+    """
+    A thread-safe LRU cache of whole columns of feature matrices within a
+    memory cap in bytes.
+
+    A column is read from the memory map once and sliced by rows in memory
+    afterwards, and the least recently used columns are evicted when the cap
+    is exceeded.
+    """
+
+    def __init__(self, memory_cap: int):
+        self.memory_cap = memory_cap
+        self.num_bytes = 0
+        self.columns = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, experiment: str, feature_matrix: FeatureMatrix, position: int):
+        key = (experiment, position)
+        with self.lock:
+            column = self.columns.get(key)
+            if column is not None:
+                self.columns.move_to_end(key)
+                self.hits += 1
+                return column
+            self.misses += 1
+        column = np.array(feature_matrix.matrix[:, position])
+        with self.lock:
+            if key not in self.columns:
+                self.columns[key] = column
+                self.num_bytes += column.nbytes
+            while self.num_bytes > self.memory_cap and len(self.columns) > 1:
+                _, evicted = self.columns.popitem(last=False)
+                self.num_bytes -= evicted.nbytes
+        return column
+
+
+class ReadService:
+    """
+    A local HTTP service serving slices of merged experiments from their
+    feature matrices through an LRU column cache.
+
+    GET /slice?experiment=<name>&pattern=<regex>&start=<time>&end=<time>
+    returns an NPZ archive with the arrays values (time x columns), columns and
+    timestamps, where the pattern and both inclusive bounds are optional.
+    GET /experiments returns the served experiment names and GET /stats the
+    cache statistics as JSON.
+    """
+
+    CONTENT_TYPE_NPZ = "application/x-npz"
+
+    def __init__(
+        self,
+        experiments: dict,
+        memory_cap: int = 1 << 30,
+        host: str = "127.0.0.1",
+        port: int = 0,
+    ):
+        """
+        Parameters
+        ----------
+        experiments : dict
+            path prefixes of feature matrices keyed by experiment names
+        memory_cap : int
+            the number of bytes of cached columns
+        host : str
+            the host to listen on, localhost by default
+        port : int
+            the port to listen on, any free port by default
+        """
+        self.path_prefixes = experiments
+        self.feature_matrices = {}
+        self.cache = ColumnCache(memory_cap)
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer((host, port), ReadService.build_handler(self))
+        self.thread = None
+
+    @staticmethod
+    def from_experiment_yaml(filename_exp_yaml: str, **kwargs) -> "ReadService":
+        """Serve the merged outputs of all experiments in an experiment YAML."""
+        gcloud_metrics = GCloudMetrics(filename_exp_yaml)
+        experiments = {}
+        for experiment in gcloud_metrics.experiments:
+            path_experiment = gcloud_metrics.build_path_experiment(experiment["name"])
+            if path_experiment is not None:
+                experiments[experiment["name"]] = FeatureMatrix.build_path_prefix(
+                    os.path.join(path_experiment, f'{experiment["name"]}.csv')
+                )
+        return ReadService(experiments, **kwargs)
+
+    @property
+    def url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "ReadService":
+        """Serve requests in a background thread."""
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        logging.info(f"Serving experiments at {self.url} ...")
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+        if self.thread is not None:
+            self.thread.join()
+
+    def open_feature_matrix(self, experiment: str) -> FeatureMatrix:
+        """Open the feature matrix of an experiment, written once from its CSV."""
+        with self.lock:
+            if experiment in self.feature_matrices:
+                return self.feature_matrices[experiment]
+            if experiment not in self.path_prefixes:
+                raise KeyError(f"Experiment {experiment} is not served!")
+            path_prefix = self.path_prefixes[experiment]
+            if not os.path.exists(path_prefix + FeatureMatrix.FNAME_MATRIX_SUFFIX):
+                logging.info(f"Writing the feature matrix of {experiment} ...")
+                FeatureMatrix.write(
+                    pd.read_csv(path_prefix + ".csv", index_col="timestamp"),
+                    path_prefix,
+                )
+            feature_matrix = FeatureMatrix(path_prefix)
+            self.feature_matrices[experiment] = feature_matrix
+            return feature_matrix
+
+    def read_slice(
+        self, experiment: str, pattern: str = None, start=None, end=None
+    ) -> tuple[np.ndarray, list, np.ndarray | None]:
+        """
+        Read a slice of an experiment through the column cache.
+
+        Returns
+        -------
+        tuple[ndarray, list, ndarray | None]
+            values, column names and timestamps of the slice
+        """
+        feature_matrix = self.open_feature_matrix(experiment)
+        rows = feature_matrix.find_rows(start, end)
+        positions = feature_matrix.find_columns(pattern)
+        values = np.empty(
+            (len(range(*rows.indices(feature_matrix.matrix.shape[0]))), len(positions)),
+            dtype=feature_matrix.matrix.dtype,
+        )
+        for i, position in enumerate(positions):
+            values[:, i] = self.cache.get(experiment, feature_matrix, position)[rows]
+        timestamps = (
+            None
+            if feature_matrix.timestamps is None
+            else feature_matrix.timestamps[rows]
+        )
+        columns = feature_matrix.catalog.loc[positions, "column"].to_list()
+        return values, columns, timestamps
+
+    @staticmethod
+    def build_handler(service: "ReadService"):
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                url = urlparse(self.path)
+                params = {
+                    key: values[-1] for key, values in parse_qs(url.query).items()
+                }
+                try:
+                    if url.path == "/slice":
+                        self.send_slice(params)
+                    elif url.path == "/experiments":
+                        self.send_json(list(service.path_prefixes))
+                    elif url.path == "/stats":
+                        self.send_json(
+                            {
+                                "hits": service.cache.hits,
+                                "misses": service.cache.misses,
+                                "num_columns": len(service.cache.columns),
+                                "num_bytes": service.cache.num_bytes,
+                            }
+                        )
+                    else:
+                        self.send_error(404, f"Path {url.path} is not supported!")
+                except KeyError as e:
+                    self.send_error(404, str(e.args[0]))
+                except ValueError as e:
+                    self.send_error(400, str(e))
+
+            def send_slice(self, params: dict):
+                if "experiment" not in params:
+                    raise ValueError("Parameter experiment is missing!")
+                if "pattern" in params:
+                    try:
+                        re.compile(params["pattern"])
+                    except re.error as e:
+                        raise ValueError(
+                            f"Pattern {params['pattern']} is invalid: {e}!"
+                        )
+                values, columns, timestamps = service.read_slice(
+                    params["experiment"],
+                    params.get("pattern"),
+                    params.get("start"),
+                    params.get("end"),
+                )
+                buffer = io.BytesIO()
+                arrays = {"values": values, "columns": np.array(columns, dtype=str)}
+                if timestamps is not None:
+                    arrays["timestamps"] = timestamps
+                np.savez(buffer, **arrays)
+                self.send_bytes(buffer.getvalue(), ReadService.CONTENT_TYPE_NPZ)
+
+            def send_json(self, obj):
+                self.send_bytes(json.dumps(obj).encode(), "application/json")
+
+            def send_bytes(self, body: bytes, content_type: str):
+                self.send_response(200)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                logging.debug(format % args)
+
+        return Handler
+
+    @staticmethod
+    def fetch(
+        url: str, experiment: str, pattern: str = None, start=None, end=None
+    ) -> pd.DataFrame:
+        """Fetch a slice from a running service into a DataFrame."""
+        params = {
+            key: str(value)
+            for key, value in [
+                ("experiment", experiment),
+                ("pattern", pattern),
+                ("start", start),
+                ("end", end),
+            ]
+            if value is not None
+        }
+        with urlopen(f"{url}/slice?{urlencode(params)}") as response:
+            body = response.read()
+        with np.load(io.BytesIO(body)) as npz:
+            index = (
+                pd.Index(npz["timestamps"], name="timestamp")
+                if "timestamps" in npz
+                else None
+            )
+            df = pd.DataFrame(
+                npz["values"], index=index, columns=npz["columns"].tolist()
+            )
+        return df
@@ -0,0 +1,192 @@
+import logging
+import warnings
+
+import numpy as np
+
+from app.feature_matrix import FeatureMatrix
+
+
+class RollingFeatures:
+    """
+    Compute trailing rolling statistics over every column of a merged feature
+    matrix at once, one block of columns at a time.
+
+    Sums are taken from cumulative sums, so mean, std and slope cost O(1) per
+    row regardless of the window length. Min and max use the van Herk/Gil-Werman
+    algorithm, the block-wise equivalent of a monotonic deque that runs as
+    vectorized accumulations over all columns of a block.
+    """
+
+    FNAME_SUFFIX = "-rolling"
+    DEFAULT_WINDOWS = [5, 15, 60]
+    DEFAULT_STATISTICS = ["mean", "std", "min", "max", "slope"]
+    SUPPORTED_STATISTICS = {"mean", "std", "min", "max", "slope"}
+
+    def __init__(
+        self,
+        windows: list = None,
+        statistics: list = None,
+        block_size: int = 256,
+        min_periods: int = None,
+    ):
+        """
+        Parameters
+        ----------
+        windows : list
+            window lengths in minutes
+        statistics : list
+            statistics to compute per window, a subset of mean, std, min, max and slope
+        block_size : int
+            the number of columns processed at once to bound memory
+        min_periods : int
+            the minimum number of valid values in a window, the window length
+            by default as in DataFrame.rolling
+        """
+        self.windows = (
+            windows if windows is not None else RollingFeatures.DEFAULT_WINDOWS
+        )
+        self.statistics = (
+            statistics if statistics is not None else RollingFeatures.DEFAULT_STATISTICS
+        )
+        unsupported = set(self.statistics) - RollingFeatures.SUPPORTED_STATISTICS
+        if unsupported:
+            raise ValueError(f"Rolling statistics {unsupported} are not supported!")
+        self.block_size = block_size
+        self.min_periods = min_periods
+
+    @staticmethod
+    def build_column(column: str, window: int, statistic: str) -> str:
+        return f"{column}-rolling_{window}m_{statistic}"
+
+    def compute(self, path_prefix_in: str, path_prefix_out: str = None):
+        """
+        Compute rolling statistics of a feature matrix into a new feature matrix.
+
+        Windows never cross experiment segments of the input matrix.
+        """
+        if path_prefix_out is None:
+            path_prefix_out = path_prefix_in + RollingFeatures.FNAME_SUFFIX
+        feature_matrix = FeatureMatrix(path_prefix_in)
+        num_rows, num_cols = feature_matrix.matrix.shape
+        columns = feature_matrix.catalog["column"].to_list()
+        num_features = len(self.windows) * len(self.statistics)
+        output_columns = [
+            RollingFeatures.build_column(column, window, statistic)
+            for column in columns
+            for window in self.windows
+            for statistic in self.statistics
+        ]
+        output = FeatureMatrix.create(
+            path_prefix_out,
+            num_rows,
+            output_columns,
+            feature_matrix.timestamps,
+            feature_matrix.segments,
+        )
+        for block_start in range(0, num_cols, self.block_size):
+            block_end = min(block_start + self.block_size, num_cols)
+            logging.info(
+                f"Computing rolling statistics of columns {block_start} to {block_end} ..."
+            )
+            positions = np.arange(block_start, block_end) * num_features
+            for segment in feature_matrix.segments:
+                rows = slice(segment["start"], segment["end"])
+                block = np.asarray(
+                    feature_matrix.matrix[rows, block_start:block_end],
+                    dtype=np.float64,
+                )
+                for i, window in enumerate(self.windows):
+                    for j, (statistic, values) in enumerate(
+                        self.compute_block(block, window).items()
+                    ):
+                        output[rows, positions + i * len(self.statistics) + j] = values
+        output.flush()
+
+    def compute_block(self, block: np.ndarray, window: int) -> dict:
+        """
+        Compute the rolling statistics of a block of columns for one window.
+
+        Returns
+        -------
+        dict
+            arrays shaped like the block keyed by statistic, in the order of
+            self.statistics
+        """
+        min_periods = window if self.min_periods is None else self.min_periods
+        valid = ~np.isnan(block)
+        count = RollingFeatures.rolling_sum(valid.astype(np.float64), window)
+        insufficient = count < min_periods
+        results = {}
+        if {"mean", "std", "slope"} & set(self.statistics):
+            # center columns to limit cancellation in cumulative sums
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore", category=RuntimeWarning)
+                center = np.nanmean(block, axis=0)
+            center = np.where(np.isnan(center), 0.0, center)
+            y = np.where(valid, block - center, 0.0)
+            sum_y = RollingFeatures.rolling_sum(y, window)
+            with np.errstate(divide="ignore", invalid="ignore"):
+                mean = sum_y / count
+        for statistic in self.statistics:
+            with np.errstate(divide="ignore", invalid="ignore"):
+                if statistic == "mean":
+                    values = mean + center
+                elif statistic == "std":
+                    sum_y2 = RollingFeatures.rolling_sum(y * y, window)
+                    # sample standard deviation as in DataFrame.rolling().std()
+                    variance = (sum_y2 - sum_y * mean) / (count - 1)
+                    values = np.sqrt(np.maximum(variance, 0.0))
+                    values[count < 2] = np.nan
+                elif statistic == "slope":
+                    t = np.arange(len(block), dtype=np.float64)[:, np.newaxis]
+                    t = t - t.mean()
+                    sum_t = RollingFeatures.rolling_sum(valid * t, window)
+                    sum_t2 = RollingFeatures.rolling_sum(valid * t * t, window)
+                    sum_ty = RollingFeatures.rolling_sum(y * t, window)
+                    # least-squares slope per minute
+                    values = (count * sum_ty - sum_t * sum_y) / (
+                        count * sum_t2 - sum_t * sum_t
+                    )
+                    values[count < 2] = np.nan
+                elif statistic == "min":
+                    values = RollingFeatures.rolling_min(
+                        np.where(valid, block, np.inf), window
+                    )
+                else:
+                    values = -RollingFeatures.rolling_min(
+                        np.where(valid, -block, np.inf), window
+                    )
+            values[insufficient] = np.nan
+            results[statistic] = values
+        return results
+
+    @staticmethod
+    def rolling_sum(values: np.ndarray, window: int) -> np.ndarray:
+        """Trailing sums over windows of rows from a cumulative sum."""
+        cumulative = np.cumsum(values, axis=0)
+        sums = cumulative.copy()
+        sums[window:] -= cumulative[:-window]
+        return sums
+
+    @staticmethod
+    def rolling_min(values: np.ndarray, window: int) -> np.ndarray:
+        """
+        Trailing minimums over windows of rows, where the minimum of rows
+        [j - window + 1, j] is the minimum of the suffix of the block holding
+        row j - window + 1 and the prefix of the block holding row j.
+        """
+        num_rows, num_cols = values.shape
+        num_padded = -(-num_rows // window) * window
+        padded = np.full((num_padded, num_cols), np.inf)
+        padded[:num_rows] = values
+        blocks = padded.reshape(num_padded // window, window, num_cols)
+        prefix = np.minimum.accumulate(blocks, axis=1).reshape(num_padded, num_cols)
+        suffix = np.minimum.accumulate(blocks[:, ::-1], axis=1)[:, ::-1].reshape(
+            num_padded, num_cols
+        )
+        result = np.minimum.accumulate(values, axis=0)
+        if num_rows >= window:
+            result[window - 1 :] = np.minimum(
+                suffix[: num_rows - window + 1], prefix[window - 1 : num_rows]
+            )
+        return result
@@ -0,0 +1,231 @@
+import re
+
+import numpy as np
+import pandas as pd
+
+from app.agg.agg_method import AggMethod
+
+
+class SparseKpis:
+    """
+    Combined KPIs of one metric in a long format of (minute, kpi_index, value).
+
+    KPIs split by pod phases are mostly NaN in the wide format, because a pod is
+    usually in one phase at a time and pods churn across an experiment. Only
+    observed values are stored here, one float array per value field such as
+    value or mean, and the minutes refer to rows of the wide timestamp index.
+
+    Handlers group and reduce it like a DataFrame without a wide matrix.
+    """
+
+    FNAME_SUFFIX = ".npz"
+    PATTERN_COLUMN = re.compile(r"^kpi-(\d+)-(.+)$")
+
+    def __init__(
+        self,
+        timestamps: np.ndarray,
+        rows: np.ndarray,
+        kpi_indices: np.ndarray,
+        values: dict,
+        column_names: list,
+    ):
+        """
+        Parameters
+        ----------
+        timestamps : ndarray
+            the minutes of the wide format as datetime64
+        rows : ndarray
+            the position in timestamps of each observation
+        kpi_indices : ndarray
+            the KPI index of each observation
+        values : dict
+            an array of observed values per field, NaN if a field is missing
+        column_names : list
+            the wide column names kpi-{kpi_index}-{field} in order
+        """
+        self.timestamps = timestamps
+        self.rows = rows
+        self.kpi_indices = kpi_indices
+        self.values = values
+        self.column_names = column_names
+
+    @staticmethod
+    def parse_column(column: str) -> tuple[int, str]:
+        kpi_index, field = SparseKpis.PATTERN_COLUMN.match(column).groups()
+        return int(kpi_index), field
+
+    @staticmethod
+    def from_frames(kpi_list: list, dtype=np.float64) -> "SparseKpis":
+        """
+        Build sparse KPIs from a list of KPI DataFrames indexed by timestamp with
+        columns kpi-{kpi_index}-{field}, one KPI per DataFrame, storing values
+        as dtype.
+        """
+        column_names = [column for df_kpi in kpi_list for column in df_kpi.columns]
+        fields = list(
+            dict.fromkeys(SparseKpis.parse_column(c)[1] for c in column_names)
+        )
+        timestamps = (
+            pd.DatetimeIndex(
+                np.concatenate([df_kpi.index.to_numpy() for df_kpi in kpi_list])
+            )
+            .unique()
+            .sort_values()
+        )
+        list_rows, list_kpi_indices = [], []
+        list_values = {field: [] for field in fields}
+        for df_kpi in kpi_list:
+            kpi_fields = dict(SparseKpis.parse_column(c)[::-1] for c in df_kpi.columns)
+            kpi_index = next(iter(kpi_fields.values()))
+            list_rows.append(timestamps.get_indexer(df_kpi.index))
+            list_kpi_indices.append(np.full(len(df_kpi), kpi_index, dtype=np.int32))
+            for field in fields:
+                list_values[field].append(
+                    df_kpi[f"kpi-{kpi_index}-{field}"].to_numpy(dtype=dtype)
+                    if field in kpi_fields
+                    else np.full(len(df_kpi), np.nan, dtype=dtype)
+                )
+        return SparseKpis(
+            timestamps.to_numpy(dtype="datetime64[ns]"),
+            np.concatenate(list_rows).astype(np.int32),
+            np.concatenate(list_kpi_indices),
+            {field: np.concatenate(arrays) for field, arrays in list_values.items()},
+            column_names,
+        ).dropna()
+
+    @staticmethod
+    def load(path: str) -> "SparseKpis":
+        with np.load(path, allow_pickle=False) as npz:
+            fields = [str(field) for field in npz["fields"]]
+            return SparseKpis(
+                npz["timestamps"],
+                npz["rows"],
+                npz["kpi_indices"],
+                {field: npz[f"values_{field}"] for field in fields},
+                [str(column) for column in npz["column_names"]],
+            )
+
+    def save(self, path: str):
+        np.savez(
+            path,
+            timestamps=self.timestamps,
+            rows=self.rows,
+            kpi_indices=self.kpi_indices,
+            fields=np.array(list(self.values)),
+            column_names=np.array(self.column_names),
+            **{f"values_{field}": values for field, values in self.values.items()},
+        )
+
+    def filter(self, mask: np.ndarray) -> "SparseKpis":
+        return SparseKpis(
+            self.timestamps,
+            self.rows[mask],
+            self.kpi_indices[mask],
+            {field: values[mask] for field, values in self.values.items()},
+            self.column_names,
+        )
+
+    def dropna(self) -> "SparseKpis":
+        """Drop observations whose fields are all NaN."""
+        observed = np.zeros(len(self.rows), dtype=bool)
+        for values in self.values.values():
+            observed |= ~np.isnan(values)
+        return self.filter(observed)
+
+    def reduce_cumulative(self) -> "SparseKpis":
+        """
+        Difference cumulative values as GCloudMetrics.reduce_cumulative does on
+        each column of the wide format, where the previous value of a KPI is
+        only used if it is in the previous row of the wide format. Differences
+        are computed in float64 and stored in the type of the values.
+        """
+        order = np.lexsort((self.rows, self.kpi_indices))
+        sorted_kpis = self.filter(order)
+        has_previous = np.r_[
+            False,
+            (sorted_kpis.kpi_indices[1:] == sorted_kpis.kpi_indices[:-1])
+            & (sorted_kpis.rows[1:] == sorted_kpis.rows[:-1] + 1),
+        ]
+        for field, values in sorted_kpis.values.items():
+            values_float64 = values.astype(np.float64)
+            diff = np.full(len(values), np.nan)
+            diff[1:] = values_float64[1:] - values_float64[:-1]
+            diff[~has_previous] = np.nan
+            diff[diff < 0] = np.nan
+            sorted_kpis.values[field] = diff.astype(values.dtype)
+        return sorted_kpis
+
+    def astype(self, dtype) -> "SparseKpis":
+        return SparseKpis(
+            self.timestamps,
+            self.rows,
+            self.kpi_indices,
+            {field: values.astype(dtype) for field, values in self.values.items()},
+            self.column_names,
+        )
+
+    @property
+    def columns(self) -> pd.Index:
+        return pd.Index(self.column_names)
+
+    @property
+    def empty(self) -> bool:
+        return len(self.timestamps) == 0 or len(self.column_names) == 0
+
+    @property
+    def index(self) -> pd.DatetimeIndex:
+        return pd.DatetimeIndex(self.timestamps, name="timestamp")
+
+    def __getitem__(self, columns: list) -> "SparseKpis":
+        """Select wide columns kpi-{kpi_index}-{field}."""
+        selected = [SparseKpis.parse_column(column) for column in columns]
+        fields = list(dict.fromkeys(field for _, field in selected))
+        kpi_indices = np.array([kpi_index for kpi_index, _ in selected])
+        sparse_kpis = self.filter(np.isin(self.kpi_indices, kpi_indices))
+        sparse_kpis.values = {field: sparse_kpis.values[field] for field in fields}
+        sparse_kpis.column_names = list(columns)
+        return sparse_kpis.dropna()
+
+    def to_wide(self) -> pd.DataFrame:
+        """Build the wide DataFrame as stored in gcloud_combined/metric-N.csv."""
+        matrix = np.full((len(self.timestamps), len(self.column_names)), np.nan)
+        num_kpis = int(self.kpi_indices.max()) + 1 if len(self.kpi_indices) else 0
+        lookups = {field: np.full(num_kpis, -1) for field in self.values}
+        for i, column in enumerate(self.column_names):
+            kpi_index, field = SparseKpis.parse_column(column)
+            if field in lookups and kpi_index < num_kpis:
+                lookups[field][kpi_index] = i
+        for field, values in self.values.items():
+            # positions of wide columns of each observation
+            positions = lookups[field][self.kpi_indices]
+            exists = positions >= 0
+            matrix[self.rows[exists], positions[exists]] = values[exists]
+        return pd.DataFrame(matrix, index=self.index, columns=self.column_names)
+
+    def rename(self, columns: dict) -> pd.DataFrame:
+        return self.to_wide().rename(columns=columns)
+
+    def agg(self, agg_methods: list, axis: int = 1) -> pd.DataFrame:
+        """
+        Aggregate the selected KPIs per minute like DataFrame.agg with axis=1,
+        grouping the observations by minute instead of scanning a wide matrix.
+        """
+        if axis != 1 or len(self.values) != 1:
+            return self.to_wide().agg(agg_methods, axis=axis)
+        values = next(iter(self.values.values()))
+        observed = ~np.isnan(values)
+        grouped = pd.Series(values[observed]).groupby(self.rows[observed])
+        results = {}
+        for method in agg_methods:
+            name = AggMethod.get_name(method)
+            quantile = AggMethod.get_quantile(name)
+            if quantile is not None and name != "median":
+                result = grouped.quantile(quantile)
+            else:
+                result = grouped.agg(method)
+            result = result.reindex(range(len(self.timestamps)))
+            if name in ("sum", "count"):
+                # minutes without observations sum up to zero as in the wide format
+                result = result.fillna(0)
+            results[name] = result.to_numpy()
+        return pd.DataFrame(results, index=self.index)
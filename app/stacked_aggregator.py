@@ -0,0 +1,263 @@
+import logging
+import os
+
+import numpy as np
+import pandas as pd
+
+from app.agg.agg_method import AggMethod
+from app.agg.aggregate_handler import AggregateHandler
+from app.agg.strategy import Strategy
+from app.gcloud_aggregator import GCloudAggregator
+from app.gcloud_metrics import GCloudMetrics
+from app.sparse_kpis import SparseKpis
+
+
+class StackedAggregator:
+    """
+    Aggregate each metric for all experiments of a YAML at once.
+
+    The combined KPIs of a metric are stacked along time, experiment after
+    experiment, with KPIs of the same labels in one column of a union KPI
+    map, so a handler is created and its grouped aggregations run once per
+    metric instead of once per experiment. Handlers aggregate row by row, so
+    the rows of an experiment are aggregated as if alone, and the results
+    are split back by the row offsets of the experiments.
+
+    A group of the union KPI map may have no KPIs in some experiments. Its
+    columns are only written for experiments with KPIs in the group, found
+    by aggregating a presence matrix with one row per experiment through the
+    same handler. Since output columns of some aggregations depend on the
+    whole KPI map, only metrics with an aggregation record that has methods
+    are stacked, and all other metrics are aggregated per experiment.
+
+    The presence matrix holds ones for present KPIs, which only tells groups
+    with KPIs apart for methods that are nonzero on ones, such as min, max,
+    mean, sum, count and quantiles. Methods like std are NaN or zero there,
+    so metrics whose record has other methods are aggregated per experiment.
+    """
+
+    STACKABLE_METHODS = {"min", "max", "mean", "sum", "count"}
+
+    def __init__(
+        self,
+        filename_exp_yaml: str,
+        filename_metadata_yaml: str,
+        strategy: Strategy,
+        for_normal_dataset: bool,
+        enforce_existing_aggregations: bool,
+        only_pod_metrics: bool = False,
+        dtype: str = None,
+    ):
+        num_experiments = len(GCloudMetrics(filename_exp_yaml).experiments)
+        self.aggregators = [
+            GCloudAggregator(
+                filename_exp_yaml,
+                filename_metadata_yaml,
+                exp_index,
+                strategy=strategy,
+                for_normal_dataset=for_normal_dataset,
+                enforce_existing_aggregations=enforce_existing_aggregations,
+                only_pod_metrics=only_pod_metrics,
+                dtype=dtype,
+            )
+            for exp_index in range(num_experiments)
+        ]
+
+    @staticmethod
+    def is_stackable_method(method: str) -> bool:
+        """Check whether present groups can be found through a method."""
+        return (
+            method in StackedAggregator.STACKABLE_METHODS
+            or AggMethod.get_quantile(method) is not None
+        )
+
+    @staticmethod
+    def has_stackable_record(metric_index: int, metric_name: str) -> bool:
+        """Check whether a metric has an aggregation record with stackable methods."""
+        handler_name = GCloudAggregator.get_handler_name(metric_name)
+        if handler_name is None:
+            return False
+        aggregations = AggregateHandler.read_aggregations(handler_name)
+        aggregation = aggregations[
+            (aggregations["name"] == metric_name)
+            & (aggregations["index"] == metric_index)
+        ]
+        if aggregation.empty:
+            return False
+        methods = aggregation.iloc[0]["methods"]
+        return bool(methods) and all(
+            StackedAggregator.is_stackable_method(method) for method in methods
+        )
+
+    @staticmethod
+    def build_union_kpi_map(kpi_maps: list) -> tuple[pd.DataFrame, list] | None:
+        """
+        Build the union of KPI maps where KPIs with the same labels share an
+        index.
+
+        Returns
+        -------
+        tuple[DataFrame, list] | None
+            the union KPI map and, per KPI map, union indices keyed by its KPI
+            indices, or None if the KPI maps have different label columns or
+            types, or a KPI map has KPIs with the same labels
+        """
+        first = kpi_maps[0].drop(columns=[AggregateHandler.COL_KPI_INDEX])
+        for kpi_map in kpi_maps[1:]:
+            labels = kpi_map.drop(columns=[AggregateHandler.COL_KPI_INDEX])
+            if list(labels.columns) != list(first.columns) or not labels.dtypes.equals(
+                first.dtypes
+            ):
+                return None
+        union = {}
+        union_rows = []
+        renames = []
+        for kpi_map in kpi_maps:
+            labels = kpi_map[first.columns]
+            if labels.duplicated().any():
+                return None
+            rename = {}
+            for kpi_index, key in zip(
+                kpi_map[AggregateHandler.COL_KPI_INDEX],
+                labels.itertuples(index=False, name=None),
+            ):
+                if key not in union:
+                    union[key] = len(union)
+                    union_rows.append(key)
+                rename[int(kpi_index)] = union[key]
+            renames.append(rename)
+        df_union_map = pd.DataFrame(union_rows, columns=first.columns).astype(
+            first.dtypes.to_dict()
+        )
+        df_union_map.insert(0, AggregateHandler.COL_KPI_INDEX, range(len(union_rows)))
+        return df_union_map, renames
+
+    @staticmethod
+    def rename_kpi_columns(columns: pd.Index, rename: dict) -> list:
+        """Rename columns kpi-<index>-<field> to the union indices."""
+        renamed = []
+        for column in columns:
+            kpi_index, field = SparseKpis.parse_column(column)
+            renamed.append(f"kpi-{rename[kpi_index]}-{field}")
+        return renamed
+
+    def aggregate_all_metrics(self):
+        """Aggregate all available metrics of all experiments."""
+        metric_indices = {}
+        for aggregator in self.aggregators:
+            for metric_index in aggregator.get_metric_indices_from_combined_dataset():
+                if not os.path.exists(
+                    os.path.join(
+                        aggregator.aggregated_metrics_path, f"metric-{metric_index}.csv"
+                    )
+                ):
+                    metric_indices.setdefault(metric_index, []).append(aggregator)
+        for metric_index in sorted(metric_indices):
+            self.aggregate_one_metric(metric_index, metric_indices[metric_index])
+
+    def aggregate_one_metric(self, metric_index: int, aggregators: list):
+        """
+        Aggregate one metric of experiments, stacked if possible.
+
+        A stacked aggregation is profiled as the stage aggregate-stacked of
+        the first experiment, per-experiment aggregations as usual.
+        """
+        metric_names = {
+            aggregator.df_metric_type_map.loc[metric_index]["name"]
+            for aggregator in aggregators
+        }
+        metric_name = next(iter(metric_names))
+        if (
+            len(aggregators) > 1
+            and len(metric_names) == 1
+            and not aggregators[0].is_constant_metric(metric_index, metric_name)
+            and StackedAggregator.has_stackable_record(metric_index, metric_name)
+        ):
+            first = aggregators[0]
+            with first.profiler.profile(
+                first.build_path_experiment(first.experiment["name"]),
+                "aggregate-stacked",
+                metric_index,
+            ):
+                stacked = self.aggregate_stacked(metric_index, metric_name, aggregators)
+            if stacked:
+                return
+        for aggregator in aggregators:
+            with aggregator.profiler.profile(
+                aggregator.build_path_experiment(aggregator.experiment["name"]),
+                "aggregate",
+                metric_index,
+            ):
+                aggregator.aggregate_one_metric(metric_index)
+
+    def aggregate_stacked(
+        self, metric_index: int, metric_name: str, aggregators: list
+    ) -> bool:
+        """
+        Aggregate one metric of experiments stacked along time.
+
+        Returns
+        -------
+        bool
+            False if the combined KPIs cannot be stacked
+        """
+        kpi_maps = []
+        frames = []
+        for aggregator in aggregators:
+            df_metric = aggregator.read_combined_kpis(metric_index)
+            if not isinstance(df_metric, pd.DataFrame):
+                return False
+            kpi_maps.append(
+                pd.read_csv(
+                    os.path.join(
+                        aggregator.combined_metrics_path,
+                        f"metric-{metric_index}-kpi-map.csv",
+                    )
+                )
+            )
+            frames.append(df_metric)
+        union = StackedAggregator.build_union_kpi_map(kpi_maps)
+        if union is None:
+            return False
+        df_union_map, renames = union
+        for df_metric, rename in zip(frames, renames):
+            df_metric.columns = StackedAggregator.rename_kpi_columns(
+                df_metric.columns, rename
+            )
+        logging.info(
+            f"Aggregating metric {metric_index} {metric_name} of {len(frames)} experiments ..."
+        )
+        df_stacked = pd.concat(frames, axis=0)
+        df_union_map = GCloudMetrics.to_categorical(df_union_map)
+        df_agg_metric = aggregators[0].aggregate_kpis(
+            metric_index, metric_name, df_union_map.copy(), df_stacked
+        )
+        if df_agg_metric is None or df_agg_metric.empty:
+            return True
+        # a column exists for an experiment if its group has KPIs there
+        df_presence = pd.DataFrame(
+            np.where(
+                np.array(
+                    [df_stacked.columns.isin(df_metric.columns) for df_metric in frames]
+                ),
+                1.0,
+                np.nan,
+            ),
+            columns=df_stacked.columns,
+        )
+        df_agg_presence = (
+            aggregators[0]
+            .aggregate_kpis(metric_index, metric_name, df_union_map, df_presence)
+            .to_numpy(dtype=np.float64)
+        )
+        start = 0
+        for i, (aggregator, df_metric) in enumerate(zip(aggregators, frames)):
+            end = start + len(df_metric)
+            present = ~np.isnan(df_agg_presence[i]) & (df_agg_presence[i] != 0)
+            df_agg_metric.iloc[start:end, present].to_csv(
+                os.path.join(
+                    aggregator.aggregated_metrics_path, f"metric-{metric_index}.csv"
+                )
+            )
+            start = end
+        return True
@@ -0,0 +1,375 @@
+import json
+import logging
+import os
+import re
+
+import numpy as np
+import pandas as pd
+
+from app.gcloud_metric_kind import GCloudMetricKind
+from app.gcloud_metrics import GCloudMetrics
+
+
+class TimeSeriesIngester:
+    """
+    Ingest saved pages of Cloud Monitoring timeSeries.list responses into a
+    raw dataset.
+
+    Each page is parsed as a stream of time series, so only one series is
+    decoded at a time. A KPI is identified by the union of its resource
+    labels, metric labels and resource type, and its index is assigned on
+    first appearance. Instead of one CSV per KPI, the points of a metric type
+    are spooled column by column and packed once all pages are read: the
+    columns of all points sorted by KPI index and timestamp are stored as
+    arrays next to the KPI map, with the offset of each KPI into them.
+    GCloudMetrics.read_kpi reads a KPI of a packed metric type as a slice of
+    these arrays.
+
+    Metric types and KPIs already in the raw dataset keep their indices, and
+    points of a later ingestion are packed with the existing ones, where a
+    later point of a KPI at the same timestamp replaces the earlier one.
+    """
+
+    CHUNK_SIZE = 1 << 20
+    KEY_TIME_SERIES = '"timeSeries"'
+    FNAME_SPOOL_SUFFIX = ".spool"
+    DISTRIBUTION_FIELDS = {
+        "count": "count",
+        "mean": "mean",
+        "sumOfSquaredDeviation": "sum_of_squared_deviation",
+    }
+    PATTERN_WHITESPACE_OR_COMMA = re.compile(r"[\s,]*")
+
+    def __init__(self, path_raw_dataset: str, path_metric_type_map: str = None):
+        """
+        Parameters
+        ----------
+        path_raw_dataset : str
+            the folder of the raw dataset, created if it does not exist
+        path_metric_type_map : str
+            a metric type map to take indices of new metric types from, e.g.
+            the one of the normal dataset
+        """
+        self.path_raw_dataset = path_raw_dataset
+        os.makedirs(path_raw_dataset, exist_ok=True)
+        path_own_map = os.path.join(
+            path_raw_dataset, GCloudMetrics.FNAME_METRIC_TYPE_MAP
+        )
+        self.metric_types = {}
+        for path in [path_own_map, path_metric_type_map]:
+            if path is not None and os.path.exists(path):
+                for record in pd.read_csv(path).to_dict("records"):
+                    self.metric_types.setdefault(record["name"], record)
+        # only metric types of this raw dataset are written to its map
+        self.ingested_names = (
+            set(pd.read_csv(path_own_map)["name"])
+            if os.path.exists(path_own_map)
+            else set()
+        )
+        self.kpi_maps = {}
+        self.spools = {}
+
+    @staticmethod
+    def iter_time_series(path_page: str, chunk_size: int = CHUNK_SIZE):
+        """
+        Yield the time series of a saved page one by one, reading the file in
+        chunks and decoding one element of the timeSeries array at a time.
+        """
+        decoder = json.JSONDecoder()
+        with open(path_page) as file_page:
+            buffer = ""
+            position = -1
+            # find the opening bracket of the timeSeries array
+            while position < 0:
+                chunk = file_page.read(chunk_size)
+                if not chunk:
+                    return
+                buffer += chunk
+                key = buffer.find(TimeSeriesIngester.KEY_TIME_SERIES)
+                if key >= 0:
+                    position = buffer.find("[", key)
+            position += 1
+            eof = False
+            while True:
+                position = TimeSeriesIngester.PATTERN_WHITESPACE_OR_COMMA.match(
+                    buffer, position
+                ).end()
+                if position < len(buffer) and buffer[position] == "]":
+                    return
+                try:
+                    time_series, end = decoder.raw_decode(buffer, position)
+                except json.JSONDecodeError:
+                    if eof:
+                        raise ValueError(f"Page {path_page} is truncated!")
+                    # the element continues in the next chunk
+                    chunk = file_page.read(chunk_size)
+                    eof = not chunk
+                    buffer = buffer[position:] + chunk
+                    position = 0
+                    continue
+                yield time_series
+                position = end
+
+    @staticmethod
+    def build_kpi(time_series: dict) -> dict:
+        """Build the labels of the KPI of a time series."""
+        resource = time_series.get("resource", {})
+        kpi = dict(resource.get("labels", {}))
+        kpi.update(time_series.get("metric", {}).get("labels", {}))
+        if "type" in resource:
+            kpi["resource_type"] = resource["type"]
+        return kpi
+
+    @staticmethod
+    def parse_points(time_series: dict) -> tuple[list, dict]:
+        """
+        Parse the end times and values of the points of a time series.
+
+        Returns
+        -------
+        tuple[list, dict]
+            end times of points and lists of values keyed by fields, i.e.
+            value or count, mean and sum_of_squared_deviation of distributions
+        """
+        points = time_series.get("points", [])
+        end_times = [point["interval"]["endTime"] for point in points]
+        if time_series.get("valueType") == "DISTRIBUTION":
+            values = {
+                field: [] for field in TimeSeriesIngester.DISTRIBUTION_FIELDS.values()
+            }
+            for point in points:
+                distribution = point["value"].get("distributionValue", {})
+                # fields equal to zero are omitted in responses
+                for key, field in TimeSeriesIngester.DISTRIBUTION_FIELDS.items():
+                    values[field].append(float(distribution.get(key, 0)))
+            return end_times, values
+        values = []
+        for point in points:
+            value = point["value"]
+            if "doubleValue" in value:
+                values.append(float(value["doubleValue"]))
+            elif "int64Value" in value:
+                values.append(float(value["int64Value"]))
+            elif "boolValue" in value:
+                values.append(float(value["boolValue"]))
+            else:
+                values.append(np.nan)
+        return end_times, {"value": values}
+
+    def find_metric_index(self, time_series: dict) -> int:
+        """Find the index of the metric type of a time series, adding it if new."""
+        name = time_series["metric"]["type"]
+        if name not in self.metric_types:
+            self.metric_types[name] = {
+                "index": max(
+                    [record["index"] for record in self.metric_types.values()],
+                    default=0,
+                )
+                + 1,
+                "name": name,
+                "kind": GCloudMetricKind[
+                    time_series.get("metricKind", "METRIC_KIND_UNSPECIFIED")
+                ].value,
+            }
+        self.ingested_names.add(name)
+        return int(self.metric_types[name]["index"])
+
+    def build_path_metric_type(self, metric_index: int) -> str:
+        return os.path.join(
+            self.path_raw_dataset,
+            GCloudMetrics.FNAME_METRIC_TYPE_PREFIX + str(metric_index),
+        )
+
+    def open_kpi_map(self, metric_index: int) -> dict:
+        """Open the KPI map of a metric type, keyed by label sets."""
+        if metric_index in self.kpi_maps:
+            return self.kpi_maps[metric_index]
+        kpi_map = {}
+        path_kpi_map = os.path.join(
+            self.build_path_metric_type(metric_index), GCloudMetrics.FNAME_KPI_MAP
+        )
+        if os.path.exists(path_kpi_map):
+            with open(path_kpi_map) as file_kpi_map:
+                for line in file_kpi_map:
+                    if line.strip():
+                        item = json.loads(line)
+                        kpi_map[frozenset(item["kpi"].items())] = (
+                            item["index"],
+                            item["kpi"],
+                        )
+        self.kpi_maps[metric_index] = kpi_map
+        return kpi_map
+
+    def find_kpi_index(self, metric_index: int, kpi: dict) -> int:
+        kpi_map = self.open_kpi_map(metric_index)
+        key = frozenset(kpi.items())
+        if key not in kpi_map:
+            kpi_map[key] = (len(kpi_map), kpi)
+        return kpi_map[key][0]
+
+    def spool(self, metric_index: int, columns: dict):
+        """Append columns of points of a metric type to its spool files."""
+        path_metric_type = self.build_path_metric_type(metric_index)
+        if metric_index not in self.spools:
+            os.makedirs(path_metric_type, exist_ok=True)
+            self.spools[metric_index] = {"num_points": 0, "files": {}}
+        spools = self.spools[metric_index]
+        num_points = len(columns["timestamp"])
+        for column in columns:
+            if column not in spools["files"]:
+                spools["files"][column] = open(
+                    os.path.join(
+                        path_metric_type,
+                        GCloudMetrics.FNAME_POINTS_PREFIX
+                        + column
+                        + TimeSeriesIngester.FNAME_SPOOL_SUFFIX,
+                    ),
+                    "wb",
+                )
+                # fields first seen now are missing in earlier points
+                np.full(spools["num_points"], np.nan).tofile(spools["files"][column])
+        for column, file_spool in spools["files"].items():
+            values = columns.get(column, np.full(num_points, np.nan))
+            values.tofile(file_spool)
+        spools["num_points"] += num_points
+
+    def ingest_page(self, path_page: str) -> int:
+        """
+        Ingest the time series of a saved page.
+
+        Returns
+        -------
+        int
+            the number of ingested points
+        """
+        # buffer points of the page per metric type to convert them at once
+        buffers = {}
+        for time_series in TimeSeriesIngester.iter_time_series(path_page):
+            end_times, values = TimeSeriesIngester.parse_points(time_series)
+            if not end_times:
+                continue
+            metric_index = self.find_metric_index(time_series)
+            kpi_index = self.find_kpi_index(
+                metric_index, TimeSeriesIngester.build_kpi(time_series)
+            )
+            buffer = buffers.setdefault(
+                metric_index,
+                {"kpi_index": [], "timestamp": [], "fields": {}},
+            )
+            num_points = len(buffer["timestamp"])
+            buffer["kpi_index"].extend([kpi_index] * len(end_times))
+            buffer["timestamp"].extend(end_times)
+            for field, field_values in values.items():
+                buffer["fields"].setdefault(field, [np.nan] * num_points)
+            for field, field_values in buffer["fields"].items():
+                field_values.extend(values.get(field, [np.nan] * len(end_times)))
+        num_points = 0
+        for metric_index, buffer in buffers.items():
+            timestamps = pd.to_datetime(buffer["timestamp"], utc=True, format="ISO8601")
+            columns = {
+                "kpi_index": np.array(buffer["kpi_index"], dtype=np.int64),
+                "timestamp": timestamps.as_unit("ns").asi8 // 1_000_000_000,
+            }
+            for field, field_values in buffer["fields"].items():
+                columns[field] = np.array(field_values, dtype=np.float64)
+            self.spool(metric_index, columns)
+            num_points += len(columns["timestamp"])
+        return num_points
+
+    def ingest(self, path_pages: str) -> int:
+        """
+        Ingest all saved pages in a folder in the order of their filenames.
+
+        Returns
+        -------
+        int
+            the number of ingested points
+        """
+        num_points = 0
+        for filename in sorted(os.listdir(path_pages)):
+            if not filename.endswith(".json"):
+                continue
+            logging.info(f"Ingesting page {filename} ...")
+            num_points += self.ingest_page(os.path.join(path_pages, filename))
+        self.finish()
+        logging.info(
+            f"Ingested {num_points} points of {len(self.spools)} metric types."
+        )
+        return num_points
+
+    def read_spool(self, metric_index: int) -> dict:
+        """Read the spooled columns of a metric type and remove the spool files."""
+        columns = {}
+        for column, file_spool in self.spools[metric_index]["files"].items():
+            file_spool.close()
+            dtype = np.int64 if column in ["kpi_index", "timestamp"] else np.float64
+            columns[column] = np.fromfile(file_spool.name, dtype=dtype)
+            os.remove(file_spool.name)
+        return columns
+
+    def pack(self, metric_index: int):
+        """Pack spooled points of a metric type with its existing points."""
+        path_metric_type = self.build_path_metric_type(metric_index)
+        columns = self.read_spool(metric_index)
+        existing = GCloudMetrics.read_packed_points(path_metric_type)
+        if existing is not None:
+            offsets, existing_columns = existing
+            existing_columns["kpi_index"] = np.repeat(
+                np.arange(len(offsets) - 1), np.diff(offsets)
+            )
+            num_existing = len(existing_columns["timestamp"])
+            num_new = len(columns["timestamp"])
+            for column in set(columns) | set(existing_columns):
+                columns[column] = np.concatenate(
+                    [
+                        existing_columns.get(column, np.full(num_existing, np.nan)),
+                        columns.get(column, np.full(num_new, np.nan)),
+                    ]
+                )
+        # keep the order of ingestion among points of the same timestamp
+        order = np.lexsort((columns["timestamp"], columns["kpi_index"]))
+        kpi_indices = columns["kpi_index"][order]
+        timestamps = columns["timestamp"][order]
+        # keep the last ingested point of a KPI at a timestamp, e.g. of a page
+        # ingested again
+        is_last = np.r_[
+            (kpi_indices[1:] != kpi_indices[:-1]) | (timestamps[1:] != timestamps[:-1]),
+            True,
+        ]
+        order = order[is_last]
+        kpi_indices = columns.pop("kpi_index")[order]
+        num_kpis = len(self.kpi_maps[metric_index])
+        offsets = np.searchsorted(kpi_indices, np.arange(num_kpis + 1))
+        fields = sorted(column for column in columns if column != "timestamp")
+        GCloudMetrics.write_packed_points(
+            path_metric_type,
+            offsets,
+            {column: columns[column][order] for column in ["timestamp"] + fields},
+        )
+
+    def write_kpi_map(self, metric_index: int):
+        path_kpi_map = os.path.join(
+            self.build_path_metric_type(metric_index), GCloudMetrics.FNAME_KPI_MAP
+        )
+        with open(path_kpi_map, "w") as file_kpi_map:
+            for kpi_index, kpi in sorted(self.kpi_maps[metric_index].values()):
+                file_kpi_map.write(json.dumps({"index": kpi_index, "kpi": kpi}) + "\n")
+
+    def finish(self):
+        """Pack points and write KPI maps and the metric type map."""
+        for metric_index in list(self.spools):
+            self.pack(metric_index)
+            self.write_kpi_map(metric_index)
+        self.spools = {}
+        df_metric_type_map = pd.DataFrame(
+            [
+                self.metric_types[name]
+                for name in self.metric_types
+                if name in self.ingested_names
+            ],
+            columns=["index", "name", "kind"],
+        ).sort_values("index")
+        df_metric_type_map.to_csv(
+            os.path.join(self.path_raw_dataset, GCloudMetrics.FNAME_METRIC_TYPE_MAP),
+            index=False,
+        )
@@ -0,0 +1,256 @@
+import json
+import logging
+import os
+
+import numpy as np
+
+from app.feature_matrix import FeatureMatrix
+
+
+class TimeSeriesPyramid:
+    """
+    A multi-resolution pyramid of a merged feature matrix.
+
+    Each level stores mean, min, max, last and the count of valid minutes per
+    column in bins of its resolution, computed from the level below in one
+    vectorized pass per column block. Bins are aligned to multiples of the
+    resolution since the UNIX epoch and never cross experiment segments.
+    """
+
+    FDNAME_SUFFIX = "-pyramid"
+    FNAME_META = "pyramid.json"
+    FNAME_LEVEL_PREFIX = "level-"
+    DEFAULT_RESOLUTIONS = [5, 15, 60]
+    STATISTICS = ["mean", "min", "max", "last", "count"]
+
+    def __init__(self, path_prefix: str):
+        """Open the pyramid of the feature matrix at path_prefix for reading."""
+        self.base = FeatureMatrix(path_prefix)
+        self.path_pyramid = path_prefix + TimeSeriesPyramid.FDNAME_SUFFIX
+        with open(os.path.join(self.path_pyramid, TimeSeriesPyramid.FNAME_META)) as f:
+            self.resolutions = json.load(f)["resolutions"]
+        self.levels = {}
+        for resolution in self.resolutions:
+            path_level = TimeSeriesPyramid.build_path_level(
+                self.path_pyramid, resolution
+            )
+            self.levels[resolution] = (
+                np.load(path_level + ".npy", mmap_mode="r"),
+                np.load(path_level + "-timestamps.npy"),
+            )
+
+    @staticmethod
+    def build_path_level(path_pyramid: str, resolution: int) -> str:
+        return os.path.join(
+            path_pyramid, f"{TimeSeriesPyramid.FNAME_LEVEL_PREFIX}{resolution}m"
+        )
+
+    @staticmethod
+    def build(path_prefix: str, resolutions: list = None, block_size: int = 1024):
+        """
+        Build the pyramid of a feature matrix.
+
+        Parameters
+        ----------
+        path_prefix : str
+            the path of the feature matrix without suffixes
+        resolutions : list
+            resolutions in minutes of the levels, each must be a multiple of the
+            previous one
+        block_size : int
+            the number of columns processed at once to bound memory
+        """
+        if resolutions is None:
+            resolutions = TimeSeriesPyramid.DEFAULT_RESOLUTIONS
+        base = FeatureMatrix(path_prefix)
+        num_rows, num_cols = base.matrix.shape
+        path_pyramid = path_prefix + TimeSeriesPyramid.FDNAME_SUFFIX
+        os.makedirs(path_pyramid, exist_ok=True)
+
+        # minutes since epoch of the base rows, row positions without timestamps
+        if base.timestamps is not None:
+            minutes = base.timestamps.astype("datetime64[m]").astype(np.int64)
+        else:
+            minutes = np.arange(num_rows, dtype=np.int64)
+        segment_ids = np.zeros(num_rows, dtype=np.int64)
+        for i, segment in enumerate(base.segments):
+            segment_ids[segment["start"] : segment["end"]] = i
+
+        previous_resolution = 1
+        previous_path = None
+        for resolution in resolutions:
+            if resolution % previous_resolution != 0:
+                raise ValueError(
+                    f"Resolution {resolution} is not a multiple of {previous_resolution}!"
+                )
+            logging.info(f"Building pyramid level of {resolution} minutes ...")
+            bins = minutes // resolution
+            starts = np.flatnonzero(
+                np.r_[
+                    True,
+                    (bins[1:] != bins[:-1]) | (segment_ids[1:] != segment_ids[:-1]),
+                ]
+            )
+            path_level = TimeSeriesPyramid.build_path_level(path_pyramid, resolution)
+            np.save(
+                path_level + "-timestamps.npy",
+                (bins[starts] * resolution).astype("datetime64[m]"),
+            )
+            level = np.lib.format.open_memmap(
+                path_level + ".npy",
+                mode="w+",
+                dtype=FeatureMatrix.DTYPE,
+                shape=(len(starts), num_cols, len(TimeSeriesPyramid.STATISTICS)),
+                fortran_order=True,
+            )
+            if previous_path is not None:
+                lower = np.load(previous_path + ".npy", mmap_mode="r")
+            for block_start in range(0, num_cols, block_size):
+                columns = slice(block_start, min(block_start + block_size, num_cols))
+                if previous_path is None:
+                    values = np.asarray(base.matrix[:, columns], dtype=np.float64)
+                    valid = ~np.isnan(values)
+                    lower_stats = {
+                        "mean": values,
+                        "min": values,
+                        "max": values,
+                        "last": values,
+                        "count": valid.astype(np.float64),
+                    }
+                else:
+                    lower_stats = {
+                        statistic: np.asarray(lower[:, columns, i], dtype=np.float64)
+                        for i, statistic in enumerate(TimeSeriesPyramid.STATISTICS)
+                    }
+                for i, values in enumerate(
+                    TimeSeriesPyramid.reduce_bins(lower_stats, starts).values()
+                ):
+                    level[:, columns, i] = values
+            level.flush()
+            del level
+            # the next level reduces bins of this level
+            minutes = minutes[starts]
+            segment_ids = segment_ids[starts]
+            previous_resolution = resolution
+            previous_path = path_level
+
+        with open(os.path.join(path_pyramid, TimeSeriesPyramid.FNAME_META), "w") as f:
+            json.dump({"resolutions": resolutions}, f)
+
+    @staticmethod
+    def reduce_bins(stats: dict, starts: np.ndarray) -> dict:
+        """
+        Reduce consecutive rows starting at starts into bins.
+
+        Parameters
+        ----------
+        stats : dict
+            mean, min, max, last and count of the level below, each of shape
+            (rows, columns)
+        starts : ndarray
+            the first row of each bin
+
+        Returns
+        -------
+        dict
+            mean, min, max, last and count of the bins
+        """
+        count = stats["count"]
+        valid = count > 0
+        total_count = np.add.reduceat(count, starts, axis=0)
+        weighted = np.add.reduceat(
+            np.where(valid, stats["mean"] * count, 0.0), starts, axis=0
+        )
+        with np.errstate(divide="ignore", invalid="ignore"):
+            mean = weighted / total_count
+        minimum = np.minimum.reduceat(
+            np.where(valid, stats["min"], np.inf), starts, axis=0
+        )
+        maximum = np.maximum.reduceat(
+            np.where(valid, stats["max"], -np.inf), starts, axis=0
+        )
+        # the last valid row of each bin per column
+        rows = np.arange(len(count))[:, np.newaxis]
+        last_rows = np.maximum.reduceat(np.where(valid, rows, -1), starts, axis=0)
+        last = np.take_along_axis(stats["last"], np.maximum(last_rows, 0), axis=0)
+        empty = total_count == 0
+        for values in (mean, minimum, maximum, last):
+            values[empty] = np.nan
+        return {
+            "mean": mean,
+            "min": minimum,
+            "max": maximum,
+            "last": last,
+            "count": total_count,
+        }
+
+    def select_level(self, resolution: int) -> int:
+        """Select the coarsest stored resolution that divides the requested one."""
+        candidates = [r for r in [1] + self.resolutions if resolution % r == 0]
+        if not candidates:
+            raise ValueError(f"Resolution {resolution} is not supported!")
+        return max(candidates)
+
+    def read(
+        self,
+        resolution: int,
+        statistic: str = "mean",
+        pattern: str = None,
+        start=None,
+        end=None,
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Read a statistic of columns at a resolution within a time range.
+
+        The coarsest level that divides the resolution is read, and bins of that
+        level are reduced further if the resolution is not stored.
+
+        Returns
+        -------
+        tuple[ndarray, ndarray]
+            bin timestamps and values of shape (bins, columns)
+        """
+        positions = self.base.find_columns(pattern)
+        level_resolution = self.select_level(resolution)
+        if level_resolution == 1:
+            rows = self.base.find_rows(start, end)
+            values = np.asarray(self.base.matrix[rows][:, positions], dtype=np.float64)
+            stats = {
+                "mean": values,
+                "min": values,
+                "max": values,
+                "last": values,
+                "count": (~np.isnan(values)).astype(np.float64),
+            }
+            timestamps = (
+                self.base.timestamps[rows].astype("datetime64[m]")
+                if self.base.timestamps is not None
+                else np.arange(self.base.matrix.shape[0])[rows].astype("datetime64[m]")
+            )
+        else:
+            level, timestamps = self.levels[level_resolution]
+            rows = slice(
+                (
+                    None
+                    if start is None
+                    else np.searchsorted(timestamps, FeatureMatrix.to_datetime64(start))
+                ),
+                (
+                    None
+                    if end is None
+                    else np.searchsorted(
+                        timestamps, FeatureMatrix.to_datetime64(end), side="right"
+                    )
+                ),
+            )
+            timestamps = timestamps[rows]
+            stats = {
+                s: np.asarray(level[rows][:, positions, i], dtype=np.float64)
+                for i, s in enumerate(TimeSeriesPyramid.STATISTICS)
+            }
+        if level_resolution != resolution and len(timestamps) > 0:
+            bins = timestamps.astype(np.int64) // resolution
+            starts = np.flatnonzero(np.r_[True, bins[1:] != bins[:-1]])
+            stats = TimeSeriesPyramid.reduce_bins(stats, starts)
+            timestamps = (bins[starts] * resolution).astype("datetime64[m]")
+        return timestamps, stats[statistic]
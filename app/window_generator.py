@@ -0,0 +1,183 @@
+import os
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+from app.feature_matrix import FeatureMatrix
+from app.gcloud_metrics import GCloudMetrics
+
+
+class WindowGenerator:
+    """
+    Generate batches of overlapping windows from memory-mapped feature matrices.
+
+    Windows are strided views on the memory maps, so nothing is copied until
+    a batch is gathered, and windows never cross experiment boundaries.
+    """
+
+    LABEL_LAST = "last"
+    LABEL_MAX = "max"
+
+    def __init__(
+        self,
+        feature_matrices: list[FeatureMatrix],
+        window_size: int,
+        stride: int = 1,
+        batch_size: int = 64,
+        pattern: str = None,
+        labels: list[np.ndarray] = None,
+        label_reduction: str = LABEL_LAST,
+        shuffle: bool = False,
+        seed: int = None,
+    ):
+        """
+        Parameters
+        ----------
+        feature_matrices : list[FeatureMatrix]
+            merged experiments, each may contain several experiment segments
+        window_size : int
+            the number of minutes in a window
+        stride : int
+            the number of minutes between the starts of consecutive windows
+        batch_size : int
+            the maximum number of windows in a batch
+        pattern : str
+            a regex pattern to select columns, all columns by default
+        labels : list[ndarray]
+            a label per row of each feature matrix, no labels by default
+        label_reduction : str
+            "last" to label a window with its last row, "max" with its maximum
+        shuffle : bool
+            if set, yield windows in a random order
+        seed : int
+            the seed of the random order
+        """
+        if labels is not None and len(labels) != len(feature_matrices):
+            raise ValueError("Labels must be given for every feature matrix!")
+        if label_reduction not in (
+            WindowGenerator.LABEL_LAST,
+            WindowGenerator.LABEL_MAX,
+        ):
+            raise ValueError(f"Unsupported label reduction {label_reduction}!")
+        self.window_size = window_size
+        self.stride = stride
+        self.batch_size = batch_size
+        self.label_reduction = label_reduction
+        self.shuffle = shuffle
+        self.seed = seed
+        self.columns = None
+        # windows of each segment as views of shape (windows, columns, window_size)
+        self.segment_windows = []
+        self.segment_positions = []
+        self.segment_labels = []
+        for i, feature_matrix in enumerate(feature_matrices):
+            positions = feature_matrix.find_columns(pattern)
+            columns = feature_matrix.catalog.loc[positions, "column"].to_list()
+            if self.columns is None:
+                self.columns = columns
+            elif columns != self.columns:
+                raise ValueError(
+                    f"Columns of {feature_matrix.path_prefix} differ from the first feature matrix!"
+                )
+            for segment in feature_matrix.segments:
+                if segment["end"] - segment["start"] < window_size:
+                    continue
+                rows = slice(segment["start"], segment["end"])
+                self.segment_windows.append(
+                    sliding_window_view(
+                        feature_matrix.matrix[rows], window_size, axis=0
+                    )[::stride]
+                )
+                self.segment_positions.append(np.asarray(positions))
+                self.segment_labels.append(
+                    None
+                    if labels is None
+                    else self.reduce_labels(np.asarray(labels[i])[rows])
+                )
+        # (segment, window) pairs of all windows
+        num_windows = [len(windows) for windows in self.segment_windows]
+        self.window_segments = np.repeat(np.arange(len(num_windows)), num_windows)
+        self.window_offsets = np.concatenate(
+            [np.arange(n) for n in num_windows] or [np.empty(0, dtype=int)]
+        )
+
+    @staticmethod
+    def from_experiment_yaml(
+        fname_exp_yaml: str, merged: bool = False, **kwargs
+    ) -> "WindowGenerator":
+        """
+        Create a generator from the merged experiments of an experiment YAML.
+
+        Parameters
+        ----------
+        fname_exp_yaml : str
+            filename of the experiment YAML
+        merged : bool
+            set True to read the output of merge_normal_experiments, otherwise
+            read the output of merge_all_metrics of each experiment
+        """
+        gcloud_metrics = GCloudMetrics(fname_exp_yaml)
+        if merged:
+            path_prefixes = [
+                os.path.join(
+                    gcloud_metrics.path_experiments,
+                    fname_exp_yaml.removesuffix(".yaml"),
+                )
+            ]
+        else:
+            path_prefixes = [
+                os.path.join(
+                    gcloud_metrics.build_path_experiment(experiment["name"]),
+                    experiment["name"],
+                )
+                for experiment in gcloud_metrics.experiments
+            ]
+        return WindowGenerator(
+            [FeatureMatrix(path_prefix) for path_prefix in path_prefixes], **kwargs
+        )
+
+    def reduce_labels(self, labels: np.ndarray) -> np.ndarray:
+        label_windows = sliding_window_view(labels, self.window_size)[:: self.stride]
+        if self.label_reduction == WindowGenerator.LABEL_MAX:
+            return label_windows.max(axis=1)
+        return label_windows[:, -1]
+
+    def __len__(self) -> int:
+        return -(-len(self.window_segments) // self.batch_size)
+
+    def __iter__(self):
+        """
+        Yield (windows, labels) batches with windows of shape
+        (batch, window_size, columns) and labels of shape (batch,) or None.
+        """
+        order = np.arange(len(self.window_segments))
+        if self.shuffle:
+            np.random.default_rng(self.seed).shuffle(order)
+        for batch_start in range(0, len(order), self.batch_size):
+            yield self.gather(order[batch_start : batch_start + self.batch_size])
+
+    def gather(self, window_indices: np.ndarray) -> tuple:
+        """Copy the selected windows into a contiguous batch."""
+        batch = np.empty(
+            (len(window_indices), self.window_size, len(self.columns)),
+            dtype=FeatureMatrix.DTYPE,
+        )
+        batch_labels = None
+        has_labels = self.segment_labels and self.segment_labels[0] is not None
+        if has_labels:
+            batch_labels = np.empty(
+                len(window_indices), dtype=self.segment_labels[0].dtype
+            )
+        segments = self.window_segments[window_indices]
+        offsets = self.window_offsets[window_indices]
+        for segment in np.unique(segments):
+            selected = np.flatnonzero(segments == segment)
+            # gather only the selected columns of the selected windows
+            windows = self.segment_windows[segment][
+                np.ix_(offsets[selected], self.segment_positions[segment])
+            ]
+            # (windows, columns, window_size) -> (windows, window_size, columns)
+            batch[selected] = windows.transpose(0, 2, 1)
+            if has_labels:
+                batch_labels[selected] = self.segment_labels[segment][offsets[selected]]
+        return batch, batch_labels
@@ -0,0 +1,338 @@
+import json
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+import pytest
+
+PATH_REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FNAME_EXP_YAML = "exp.yaml"
+FNAME_METADATA_YAML = "train_ticket.yaml"
+EXPERIMENT = "exp-a"
+START = pd.Timestamp("2024-01-24T16:00:00+01:00")
+END = pd.Timestamp("2024-01-24T16:40:00+01:00")
+CLUSTER = "train-ticket-cluster-exp-a-0124"
+OTHER_CLUSTER = "train-ticket-cluster-other-0101"
+NODES = [
+    ("gke-train-ticket-cluster-default-pool-ab12cd34-n1", "111"),
+    ("gke-train-ticket-cluster-default-pool-ab12cd34-n2", "222"),
+]
+SERVICES = ["ts-auth-service", "ts-travel-service", "ts-order-service"]
+# a later experiment of the same family without the order service
+OTHER_EXPERIMENT = "exp-b"
+OTHER_START = START + pd.Timedelta(hours=1)
+OTHER_EXPERIMENT_CLUSTER = "train-ticket-cluster-exp-b-0124"
+
+
+def write_metric(
+    path_raw: str,
+    rng: np.random.Generator,
+    minutes: np.ndarray,
+    index: int,
+    kpis: list,
+    cumulative: bool = False,
+):
+    path_metric = os.path.join(path_raw, f"metric-type-{index}")
+    os.makedirs(path_metric)
+    with open(os.path.join(path_metric, "kpi_map.jsonl"), "w") as f:
+        for kpi_index, labels in enumerate(kpis):
+            f.write(json.dumps({"index": kpi_index, "kpi": labels}) + "\n")
+            # raw points jitter around minutes and some are missing
+            timestamps = minutes + rng.integers(-20, 20, len(minutes))
+            keep = rng.random(len(timestamps)) > 0.05
+            values = rng.gamma(2, 10, keep.sum())
+            df_kpi = pd.DataFrame(
+                {
+                    "timestamp": timestamps[keep],
+                    "value": np.cumsum(values) if cumulative else np.round(values, 2),
+                }
+            )
+            df_kpi.to_csv(
+                os.path.join(path_metric, f"kpi-{kpi_index}.csv"), index=False
+            )
+
+
+def build_dataset(path_work: str, seed: int = 42, with_family: bool = False) -> str:
+    """
+    Build a small raw dataset of one experiment with metrics of every handler
+    in a working directory with the aggregations and metadata of the repo,
+    followed by a second experiment of the same family if with_family is set.
+    """
+    for folder in ("aggregations", "metadata"):
+        shutil.copytree(
+            os.path.join(PATH_REPO, folder), os.path.join(path_work, folder)
+        )
+    os.makedirs(os.path.join(path_work, "experiments"))
+    path_data = os.path.join(path_work, "data")
+    experiments = [(EXPERIMENT, START, CLUSTER, SERVICES)]
+    if with_family:
+        experiments.append(
+            (OTHER_EXPERIMENT, OTHER_START, OTHER_EXPERIMENT_CLUSTER, SERVICES[:2])
+        )
+    with open(os.path.join(path_work, "experiments", FNAME_EXP_YAML), "w") as f:
+        f.write(f'path_experiments: "{path_data}"\nexperiments:\n')
+        for name, start, cluster, _ in experiments:
+            f.write(
+                f"  - name: {name}\n"
+                f'    start: "{start.isoformat()}"\n'
+                f'    end: "{(start + (END - START)).isoformat()}"\n'
+                f"    cluster_suffix: {cluster.removeprefix('train-ticket-cluster-')}\n"
+            )
+    for folder in ("pods_info", "nodes_info"):
+        os.makedirs(os.path.join(path_data, folder))
+    rng = np.random.default_rng(seed)
+    for name, start, cluster, services in experiments:
+        write_experiment(
+            os.path.join(path_data, name, "gcloud_metrics"),
+            path_data,
+            rng,
+            start,
+            start + (END - START),
+            cluster,
+            services,
+        )
+    return path_data
+
+
+def write_experiment(
+    path_raw: str,
+    path_data: str,
+    rng: np.random.Generator,
+    start: pd.Timestamp,
+    end: pd.Timestamp,
+    cluster: str,
+    services: list,
+):
+    """Write raw metrics of one experiment and its pod and node snapshots."""
+    os.makedirs(path_raw)
+    start_ts, end_ts = int(start.timestamp()), int(end.timestamp())
+    minutes = np.arange(start_ts - 300, end_ts + 300, 60)
+    pods = []
+    for service in services:
+        for k in range(2):
+            started = int(rng.integers(0, 15))
+            pods.append((f"{service}-7f9c{k}-x{k}q", started, started + 20))
+
+    for i, ts in enumerate(range(start_ts, end_ts + 1, 60)):
+        items = []
+        for name, started, stopped in pods:
+            if i < started - 3:
+                continue
+            phase = (
+                "Pending"
+                if i < started
+                else ("Running" if i < stopped else "Succeeded")
+            )
+            items.append({"metadata": {"name": name}, "status": {"phase": phase}})
+        with open(os.path.join(path_data, "pods_info", f"{ts}.json"), "w") as f:
+            json.dump({"items": items}, f)
+        if i % 10 == 0:
+            nodes = [
+                {
+                    "metadata": {
+                        "name": name,
+                        "annotations": {"container.googleapis.com/instance_id": iid},
+                    }
+                }
+                for name, iid in NODES
+            ]
+            with open(os.path.join(path_data, "nodes_info", f"{ts}.json"), "w") as f:
+                json.dump({"items": nodes}, f)
+
+    project = {"project_id": "p", "zone": "europe-west6-a"}
+    metric_types = [
+        (7, "compute.googleapis.com/guest/cpu/usage_time", 3),
+        (29, "compute.googleapis.com/instance/cpu/utilization", 1),
+        (102, "kubernetes.io/container/cpu/core_usage_time", 3),
+        (115, "kubernetes.io/container/memory/used_bytes", 1),
+        (167, "prometheus.googleapis.com/kube_pod_status_phase/gauge", 1),
+        (92, "logging.googleapis.com/byte_count", 2),
+        (74, "networking.googleapis.com/node_flow/egress_bytes_count", 2),
+    ]
+    write_metric(
+        path_raw,
+        rng,
+        minutes,
+        7,
+        [
+            dict(instance_id=iid, instance_name=name, state=state, **project)
+            for name, iid in NODES
+            for state in ("idle", "user")
+        ],
+        cumulative=True,
+    )
+    write_metric(
+        path_raw,
+        rng,
+        minutes,
+        29,
+        [dict(instance_id=iid, instance_name=name, **project) for name, iid in NODES],
+    )
+    write_metric(
+        path_raw,
+        rng,
+        minutes,
+        102,
+        [
+            dict(
+                cluster_name=cluster_name,
+                container_name=pod.rsplit("-", 2)[0],
+                pod_name=pod,
+                namespace_name="default",
+            )
+            for cluster_name in (cluster, OTHER_CLUSTER)
+            for pod, _, _ in pods
+        ],
+        cumulative=True,
+    )
+    write_metric(
+        path_raw,
+        rng,
+        minutes,
+        115,
+        [
+            dict(
+                cluster_name=cluster,
+                container_name=pod.rsplit("-", 2)[0],
+                pod_name=pod,
+                memory_type=memory_type,
+                namespace_name="default",
+            )
+            for pod, _, _ in pods
+            for memory_type in ("evictable", "non-evictable")
+        ],
+    )
+    write_metric(
+        path_raw,
+        rng,
+        minutes,
+        167,
+        [
+            dict(cluster=cluster, pod=pod, phase=phase, namespace="default")
+            for pod, _, _ in pods
+            for phase in ("Running", "Pending")
+        ],
+    )
+    write_metric(
+        path_raw,
+        rng,
+        minutes,
+        92,
+        [
+            dict(instance_id=iid, severity=severity, log="l")
+            for _, iid in NODES
+            for severity in ("INFO", "ERROR")
+        ]
+        + [
+            dict(cluster_name=cluster, severity=severity, log="l")
+            for severity in ("INFO", "ERROR")
+        ],
+    )
+    write_metric(
+        path_raw,
+        rng,
+        minutes,
+        74,
+        [
+            dict(cluster_name=cluster_name, protocol=protocol, node_name="n")
+            for cluster_name in (cluster, OTHER_CLUSTER)
+            for protocol in ("TCP", "UDP")
+        ],
+    )
+    pd.DataFrame(metric_types, columns=["index", "name", "kind"]).to_csv(
+        os.path.join(path_raw, "metric_type_map.csv"), index=False
+    )
+
+
+def build_path_experiment(path_work: str, experiment: str = EXPERIMENT) -> str:
+    return os.path.join(path_work, "data", experiment)
+
+
+def read_aggregated(path_work: str, experiment: str = EXPERIMENT) -> dict:
+    """Read aggregated metrics of the experiment keyed by their file names."""
+    path_aggregated = os.path.join(
+        build_path_experiment(path_work, experiment), "gcloud_aggregated"
+    )
+    return {
+        fname: pd.read_csv(os.path.join(path_aggregated, fname), index_col=0)
+        for fname in sorted(os.listdir(path_aggregated))
+        if fname.endswith(".csv")
+    }
+
+
+def assert_aggregated_equal(
+    path_expected: str,
+    path_actual: str,
+    rtol: float = 1e-9,
+    experiment: str = EXPERIMENT,
+):
+    expected = read_aggregated(path_expected, experiment)
+    actual = read_aggregated(path_actual, experiment)
+    assert list(actual) == list(expected)
+    for fname, df_expected in expected.items():
+        assert sorted(actual[fname].columns) == sorted(df_expected.columns), fname
+        pd.testing.assert_frame_equal(
+            actual[fname].reindex(columns=df_expected.columns),
+            df_expected,
+            check_exact=False,
+            rtol=rtol,
+            obj=fname,
+        )
+
+
+@pytest.fixture
+def dataset(tmp_path, monkeypatch):
+    """A raw dataset in a temporary working directory."""
+    build_dataset(str(tmp_path))
+    monkeypatch.chdir(tmp_path)
+    return str(tmp_path)
+
+
+@pytest.fixture
+def make_dataset(tmp_path, monkeypatch):
+    """Build identical raw datasets in subfolders to compare runs."""
+
+    def make(name: str, **kwargs) -> str:
+        path_work = str(tmp_path / name)
+        os.makedirs(path_work)
+        build_dataset(path_work, **kwargs)
+        return path_work
+
+    return make
+
+
+def run_pipeline(
+    path_work: str,
+    strategy=None,
+    separator_options: dict = None,
+    aggregator_options: dict = None,
+    merge: bool = True,
+):
+    """Separate, aggregate and merge the experiment of a working directory."""
+    from app.agg.strategy import Strategy
+    from app.gcloud_aggregator import GCloudAggregator
+    from app.gcloud_separator import GCloudSeparator
+
+    strategy = strategy if strategy is not None else Strategy.CONSIDER_POD_PHASES
+    path_cwd = os.getcwd()
+    os.chdir(path_work)
+    try:
+        GCloudSeparator(
+            FNAME_EXP_YAML, 0, strategy=strategy, **(separator_options or {})
+        ).separate_kpis()
+        aggregator = GCloudAggregator(
+            FNAME_EXP_YAML,
+            FNAME_METADATA_YAML,
+            0,
+            strategy=strategy,
+            for_normal_dataset=True,
+            enforce_existing_aggregations=False,
+            **(aggregator_options or {}),
+        )
+        aggregator.aggregate_all_metrics()
+        if merge:
+            aggregator.merge_all_metrics()
+        return aggregator
+    finally:
+        os.chdir(path_cwd)
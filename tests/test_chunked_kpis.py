@@ -0,0 +1,53 @@
+import glob
+import os
+
+import pytest
+
+from app.agg.strategy import Strategy
+from app.chunked_kpis import ChunkedKpis
+from app.gcloud_aggregator import GCloudAggregator
+from tests.conftest import (
+    FNAME_EXP_YAML,
+    FNAME_METADATA_YAML,
+    assert_aggregated_equal,
+    build_path_experiment,
+    run_pipeline,
+)
+
+
+def test_chunked_aggregation_equals_pandas(make_dataset):
+    path_pandas = make_dataset("pandas")
+    path_chunked = make_dataset("chunked")
+    run_pipeline(path_pandas, merge=False)
+    # a budget of a few rows per block
+    run_pipeline(path_chunked, aggregator_options={"memory_budget": 4096}, merge=False)
+    assert_aggregated_equal(path_pandas, path_chunked)
+    assert not glob.glob(
+        os.path.join(
+            build_path_experiment(path_chunked), "**", "*" + ChunkedKpis.FNAME_SUFFIX
+        ),
+        recursive=True,
+    )
+
+
+def test_spilled_columns_are_removed_if_a_handler_fails(dataset, monkeypatch):
+    run_pipeline(dataset, merge=False)
+    aggregator = GCloudAggregator(
+        FNAME_EXP_YAML,
+        FNAME_METADATA_YAML,
+        0,
+        strategy=Strategy.CONSIDER_POD_PHASES,
+        for_normal_dataset=True,
+        enforce_existing_aggregations=False,
+        memory_budget=4096,
+    )
+
+    def fail(*args):
+        raise RuntimeError("handler failed")
+
+    monkeypatch.setattr(aggregator, "aggregate_kpis", fail)
+    with pytest.raises(RuntimeError):
+        aggregator.aggregate_one_metric(102)
+    assert not glob.glob(
+        os.path.join(aggregator.combined_metrics_path, "*" + ChunkedKpis.FNAME_SUFFIX)
+    )
@@ -0,0 +1,67 @@
+import multiprocessing
+import os
+
+import pandas as pd
+import pytest
+
+from app.agg.aggregate_handler import AggregateHandler
+from app.agg.strategy import Strategy
+from app.experiment_context import ExperimentContext
+from app.gcloud_aggregator import GCloudAggregator
+from app.main import load_experiment_context
+from tests.conftest import (
+    FNAME_EXP_YAML,
+    FNAME_METADATA_YAML,
+    build_path_experiment,
+    run_pipeline,
+)
+
+
+def lookup_exp_yaml(filename_exp_yaml: str):
+    return ExperimentContext.lookup(ExperimentContext.KIND_EXP_YAML, filename_exp_yaml)
+
+
+@pytest.mark.parametrize("start_method", multiprocessing.get_all_start_methods())
+def test_workers_share_the_published_context(start_method, monkeypatch):
+    get_context = multiprocessing.get_context
+    monkeypatch.setattr(
+        multiprocessing, "get_context", lambda method=None: get_context(start_method)
+    )
+    context = ExperimentContext()
+    context.add(ExperimentContext.KIND_EXP_YAML, "shared.yaml", {"experiments": []})
+    try:
+        with ExperimentContext.create_pool(context, 2) as pool:
+            results = pool.map(lookup_exp_yaml, ["shared.yaml", "other.yaml"])
+    finally:
+        ExperimentContext.unpublish()
+    assert results == [{"experiments": []}, None]
+    assert lookup_exp_yaml("shared.yaml") is None
+
+
+def test_recorded_aggregations_are_read_again(dataset):
+    run_pipeline(dataset, merge=False)
+    path_compute = AggregateHandler.build_path_aggregations("compute")
+    df_records = pd.read_csv(path_compute)
+    # drop the record of metric 29 so that aggregation records a new one
+    df_records[df_records["index"] != 29].to_csv(path_compute, index=False)
+    ExperimentContext.publish(
+        load_experiment_context([(FNAME_EXP_YAML, 0)], FNAME_METADATA_YAML)
+    )
+    try:
+        path_aggregated = os.path.join(
+            build_path_experiment(dataset), "gcloud_aggregated", "metric-29.csv"
+        )
+        for _ in range(2):
+            os.remove(path_aggregated)
+            GCloudAggregator(
+                FNAME_EXP_YAML,
+                FNAME_METADATA_YAML,
+                0,
+                strategy=Strategy.CONSIDER_POD_PHASES,
+                for_normal_dataset=True,
+                enforce_existing_aggregations=False,
+            ).aggregate_one_metric(29)
+    finally:
+        ExperimentContext.unpublish()
+    df_records = pd.read_csv(path_compute)
+    assert (df_records["index"] == 29).sum() == 1
@@ -0,0 +1,34 @@
+import json
+import os
+
+from app.gcloud_metrics import GCloudMetrics
+from tests.conftest import EXPERIMENT, FNAME_EXP_YAML
+
+
+def test_kpi_map_cache_is_rebuilt_for_a_changed_kpi_map(dataset):
+    gcloud_metrics = GCloudMetrics(FNAME_EXP_YAML)
+    assert len(gcloud_metrics.read_kpi_map(29, EXPERIMENT)) == 2
+    path_kpi_map = gcloud_metrics.build_path_kpi_map(29, EXPERIMENT)
+    stat = os.stat(path_kpi_map)
+    with open(path_kpi_map, "a") as f:
+        f.write(json.dumps({"index": 2, "kpi": {"instance_id": "333"}}) + "\n")
+    # older than the cache, e.g. restored from a backup
+    os.utime(path_kpi_map, ns=(stat.st_atime_ns, stat.st_mtime_ns - 10**9))
+    df_kpi_map = gcloud_metrics.read_kpi_map(29, EXPERIMENT)
+    assert len(df_kpi_map) == 3
+    assert df_kpi_map.loc[2, "instance_id"] == "333"
+
+
+def test_kpi_map_cache_is_used(dataset, monkeypatch):
+    gcloud_metrics = GCloudMetrics(FNAME_EXP_YAML)
+    path_metric_type = gcloud_metrics.build_path_metric_type(102, EXPERIMENT)
+    fnames_raw = sorted(os.listdir(path_metric_type))
+    df_kpi_map = gcloud_metrics.read_kpi_map(102, EXPERIMENT)
+    # the cache is kept with the outputs of the experiment
+    assert sorted(os.listdir(path_metric_type)) == fnames_raw
+    assert os.path.exists(gcloud_metrics.build_path_kpi_map_cache(102, EXPERIMENT))
+    monkeypatch.setattr(json, "loads", None)
+    df_cached = gcloud_metrics.read_kpi_map(102, EXPERIMENT)
+    assert df_cached.equals(df_kpi_map)
+    assert df_cached.dtypes.equals(df_kpi_map.dtypes)
+    assert df_cached.index.equals(df_kpi_map.index)
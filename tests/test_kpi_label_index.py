@@ -0,0 +1,77 @@
+import json
+import os
+import shutil
+
+from app.gcloud_metrics import GCloudMetrics
+from app.kpi_label_index import KpiLabelIndex
+from tests.conftest import (
+    CLUSTER,
+    EXPERIMENT,
+    FNAME_EXP_YAML,
+    assert_aggregated_equal,
+    build_path_experiment,
+    run_pipeline,
+)
+
+
+def test_index_is_written_next_to_outputs(dataset):
+    KpiLabelIndex.load_or_build(GCloudMetrics(FNAME_EXP_YAML), EXPERIMENT)
+    path_experiment = build_path_experiment(dataset)
+    assert os.path.exists(os.path.join(path_experiment, KpiLabelIndex.FNAME_INDEX))
+    assert KpiLabelIndex.FNAME_INDEX not in os.listdir(
+        os.path.join(path_experiment, GCloudMetrics.FDNAME_ORIGINAL_KPIS)
+    )
+
+
+def test_unchanged_index_is_loaded(dataset):
+    gcloud_metrics = GCloudMetrics(FNAME_EXP_YAML)
+    label_index = KpiLabelIndex.load_or_build(gcloud_metrics, EXPERIMENT)
+    path_index = KpiLabelIndex.build_path_index(gcloud_metrics, EXPERIMENT)
+    mtime_index = os.stat(path_index).st_mtime_ns
+    loaded = KpiLabelIndex.load_or_build(gcloud_metrics, EXPERIMENT)
+    assert os.stat(path_index).st_mtime_ns == mtime_index
+    assert loaded.lookup("cluster_name", [CLUSTER]) == label_index.lookup(
+        "cluster_name", [CLUSTER]
+    )
+
+
+def test_index_is_rebuilt_for_an_older_new_metric(dataset):
+    gcloud_metrics = GCloudMetrics(FNAME_EXP_YAML)
+    KpiLabelIndex.load_or_build(gcloud_metrics, EXPERIMENT)
+    path_raw = os.path.join(
+        build_path_experiment(dataset), GCloudMetrics.FDNAME_ORIGINAL_KPIS
+    )
+    # a metric copied in later with the modification times of its source
+    shutil.copytree(
+        os.path.join(path_raw, "metric-type-115"),
+        os.path.join(path_raw, "metric-type-116"),
+    )
+    path_kpi_map = gcloud_metrics.build_path_kpi_map(116, EXPERIMENT)
+    os.utime(path_kpi_map, ns=(0, 0))
+    label_index = KpiLabelIndex.load_or_build(gcloud_metrics, EXPERIMENT)
+    assert label_index.lookup("cluster_name", [CLUSTER], metric_index=116)
+
+
+def test_index_is_rebuilt_for_a_changed_kpi_map(dataset):
+    gcloud_metrics = GCloudMetrics(FNAME_EXP_YAML)
+    KpiLabelIndex.load_or_build(gcloud_metrics, EXPERIMENT)
+    path_kpi_map = gcloud_metrics.build_path_kpi_map(29, EXPERIMENT)
+    stat = os.stat(path_kpi_map)
+    with open(path_kpi_map, "a") as f:
+        f.write(json.dumps({"index": 2, "kpi": {"instance_id": "333"}}) + "\n")
+    # an older modification time is not enough to detect a change
+    os.utime(path_kpi_map, ns=(stat.st_atime_ns, stat.st_mtime_ns - 10**9))
+    shutil.copy(
+        os.path.join(os.path.dirname(path_kpi_map), "kpi-0.csv"),
+        os.path.join(os.path.dirname(path_kpi_map), "kpi-2.csv"),
+    )
+    label_index = KpiLabelIndex.load_or_build(gcloud_metrics, EXPERIMENT)
+    assert label_index.lookup("instance_id", ["333"]) == {(29, 2)}
+
+
+def test_separation_with_index_equals_scan(make_dataset):
+    path_scan = make_dataset("scan")
+    path_index = make_dataset("index")
+    run_pipeline(path_scan, separator_options={"use_label_index": False}, merge=False)
+    run_pipeline(path_index, separator_options={"use_label_index": True}, merge=False)
+    assert_aggregated_equal(path_scan, path_index)
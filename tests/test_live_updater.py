@@ -0,0 +1,139 @@
+import glob
+import os
+import shutil
+
+import pandas as pd
+
+from app.agg.strategy import Strategy
+from app.live_updater import LiveUpdater
+from tests.conftest import (
+    FNAME_EXP_YAML,
+    FNAME_METADATA_YAML,
+    START,
+    assert_aggregated_equal,
+    build_path_experiment,
+    run_pipeline,
+)
+
+
+class RawDataset:
+    """Replay a raw dataset as if it was collected up to a point in time."""
+
+    def __init__(self, path_work: str):
+        self.path_data = os.path.join(path_work, "data")
+        self.path_full = os.path.join(path_work, "full")
+        shutil.copytree(self.path_data, self.path_full)
+        self.paths_kpi = glob.glob(
+            os.path.join(self.path_full, "*", "gcloud_metrics", "*", "kpi-*.csv")
+        )
+        self.paths_snapshot = glob.glob(
+            os.path.join(self.path_full, "pods_info", "*.json")
+        )
+
+    def collect_until(self, ts: float):
+        for path_kpi in self.paths_kpi:
+            with open(path_kpi) as f:
+                lines = f.read().splitlines(keepends=True)
+            kept = [lines[0]] + [
+                line for line in lines[1:] if int(line.split(",")[0]) <= ts
+            ]
+            text = "".join(kept)
+            if len(kept) < len(lines):
+                # a row being written
+                text += lines[len(kept)][:5]
+            with open(path_kpi.replace(self.path_full, self.path_data), "w") as f:
+                f.write(text)
+        for path_snapshot in self.paths_snapshot:
+            path_live = path_snapshot.replace(self.path_full, self.path_data)
+            if int(os.path.basename(path_snapshot).removesuffix(".json")) <= ts:
+                shutil.copy(path_snapshot, path_live)
+            elif os.path.exists(path_live):
+                os.remove(path_live)
+
+
+def read_merged(path_work: str) -> pd.DataFrame:
+    df = pd.read_csv(
+        os.path.join(build_path_experiment(path_work), "exp-a.csv"), index_col=0
+    )
+    return df.reindex(columns=sorted(df.columns)).sort_index()
+
+
+def test_incremental_updates_equal_batch(make_dataset, monkeypatch):
+    strategy = Strategy.CONSIDER_POD_PHASES
+    path_batch = make_dataset("batch")
+    path_live = make_dataset("live")
+    run_pipeline(path_batch, strategy=strategy)
+
+    raw_dataset = RawDataset(path_live)
+    monkeypatch.chdir(path_live)
+    start_ts = START.timestamp()
+    for minutes in (10, 17, 25):
+        # cuts at a snapshot with raw rows of the last minute still missing
+        raw_dataset.collect_until(start_ts + minutes * 60)
+        LiveUpdater(FNAME_EXP_YAML, FNAME_METADATA_YAML, 0, strategy).update()
+    raw_dataset.collect_until(float("inf"))
+    LiveUpdater(FNAME_EXP_YAML, FNAME_METADATA_YAML, 0, strategy).update()
+    assert LiveUpdater(FNAME_EXP_YAML, FNAME_METADATA_YAML, 0, strategy).update() == 0
+
+    assert_aggregated_equal(path_batch, path_live)
+    pd.testing.assert_frame_equal(
+        read_merged(path_live), read_merged(path_batch), check_exact=False, rtol=1e-9
+    )
+
+
+def test_last_minute_waits_for_its_raw_rows(dataset):
+    raw_dataset = RawDataset(dataset)
+    cut_ts = START.timestamp() + 10 * 60
+    raw_dataset.collect_until(cut_ts)
+    updater = LiveUpdater(
+        FNAME_EXP_YAML, FNAME_METADATA_YAML, 0, Strategy.CONSIDER_POD_PHASES
+    )
+    updater.update()
+    # rows until 30 seconds after the snapshot minute are not collected yet
+    assert updater.state["high_water_mark"] < cut_ts
+
+
+def test_updates_continue_a_batch_run(make_dataset, monkeypatch):
+    strategy = Strategy.CONSIDER_POD_PHASES
+    path_batch = make_dataset("batch")
+    path_live = make_dataset("live")
+    run_pipeline(path_batch, strategy=strategy)
+
+    raw_dataset = RawDataset(path_live)
+    # all raw rows of the first 17 minutes and none of later minutes
+    raw_dataset.collect_until(START.timestamp() + 17 * 60 + 30)
+    run_pipeline(path_live, strategy=strategy)
+    monkeypatch.chdir(path_live)
+    raw_dataset.collect_until(float("inf"))
+    LiveUpdater(FNAME_EXP_YAML, FNAME_METADATA_YAML, 0, strategy).update()
+
+    assert_aggregated_equal(path_batch, path_live)
+    df_merged = read_merged(path_live)
+    assert df_merged.index.is_unique
+    pd.testing.assert_frame_equal(
+        df_merged, read_merged(path_batch), check_exact=False, rtol=1e-9
+    )
+
+
+def test_only_grown_raw_kpis_are_read(dataset, monkeypatch):
+    strategy = Strategy.CONSIDER_POD_PHASES
+    raw_dataset = RawDataset(dataset)
+    raw_dataset.collect_until(START.timestamp() + 10 * 60)
+    LiveUpdater(FNAME_EXP_YAML, FNAME_METADATA_YAML, 0, strategy).update()
+    paths_read = []
+    read_last_timestamp = LiveUpdater.read_last_timestamp
+
+    def record_read(path_kpi: str) -> float | None:
+        paths_read.append(path_kpi)
+        return read_last_timestamp(path_kpi)
+
+    monkeypatch.setattr(LiveUpdater, "read_last_timestamp", record_read)
+    LiveUpdater(FNAME_EXP_YAML, FNAME_METADATA_YAML, 0, strategy).update()
+    assert paths_read == []
+    path_grown = raw_dataset.paths_kpi[0].replace(
+        raw_dataset.path_full, raw_dataset.path_data
+    )
+    with open(path_grown, "a") as f:
+        f.write("\n")
+    LiveUpdater(FNAME_EXP_YAML, FNAME_METADATA_YAML, 0, strategy).update()
+    assert paths_read == [path_grown]
@@ -0,0 +1,68 @@
+import ast
+import glob
+import os
+
+import pandas as pd
+import pytest
+
+from app.agg.strategy import Strategy
+from app.engine import Engine
+from tests.conftest import assert_aggregated_equal, build_path_experiment, run_pipeline
+
+pytest.importorskip("polars")
+
+
+def read_combined(path_work: str) -> dict:
+    path_combined = os.path.join(build_path_experiment(path_work), "gcloud_combined")
+    return {
+        fname: pd.read_csv(os.path.join(path_combined, fname), index_col=0)
+        for fname in sorted(os.listdir(path_combined))
+        if fname.endswith(".csv")
+    }
+
+
+def drop_pod_phase_groups(path_work: str):
+    """Drop pod phases from the recorded groups, which are then not separated."""
+    for path_aggregations in glob.glob(
+        os.path.join(path_work, "aggregations", "*.csv")
+    ):
+        aggregations = pd.read_csv(path_aggregations)
+        if "groups" not in aggregations.columns:
+            continue
+        aggregations["groups"] = [
+            str([group for group in ast.literal_eval(groups) if group != "pod_phase"])
+            for groups in aggregations["groups"]
+        ]
+        aggregations.to_csv(path_aggregations, index=False)
+
+
+@pytest.mark.parametrize(
+    "strategy",
+    [
+        Strategy.CONSIDER_POD_PHASES,
+        Strategy.CONSIDER_ONLY_RUNNING_PODS,
+        Strategy.IGNORE_POD_PHASES,
+    ],
+)
+def test_polars_engine_equals_pandas(make_dataset, strategy):
+    path_pandas = make_dataset("pandas")
+    path_polars = make_dataset("polars")
+    if strategy == Strategy.IGNORE_POD_PHASES:
+        drop_pod_phase_groups(path_pandas)
+        drop_pod_phase_groups(path_polars)
+    run_pipeline(path_pandas, strategy=strategy, merge=False)
+    run_pipeline(
+        path_polars,
+        strategy=strategy,
+        separator_options={"engine": Engine.POLARS},
+        aggregator_options={"engine": Engine.POLARS},
+        merge=False,
+    )
+    combined_pandas = read_combined(path_pandas)
+    combined_polars = read_combined(path_polars)
+    assert list(combined_polars) == list(combined_pandas)
+    for fname, df_pandas in combined_pandas.items():
+        pd.testing.assert_frame_equal(
+            combined_polars[fname], df_pandas, check_exact=False, obj=fname
+        )
+    assert_aggregated_equal(path_pandas, path_polars)
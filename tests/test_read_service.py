@@ -0,0 +1,46 @@
+from urllib.error import HTTPError
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from app.read_service import ReadService
+
+
+@pytest.fixture
+def service(tmp_path):
+    index = pd.date_range("2024-01-24 15:00", periods=10, freq="min", name="timestamp")
+    df = pd.DataFrame(
+        np.arange(30, dtype=np.float64).reshape(10, 3),
+        index=index.strftime("%Y-%m-%d %H:%M:%S"),
+        columns=["metric-7-kpi-value-max", "metric-7-kpi-value-min", "metric-29-mean"],
+    )
+    df.index.name = "timestamp"
+    df.to_csv(tmp_path / "exp-a.csv")
+    service = ReadService({"exp-a": str(tmp_path / "exp-a")}).start()
+    yield service, df
+    service.stop()
+
+
+def test_slice_is_served(service):
+    service, df = service
+    df_slice = ReadService.fetch(
+        service.url, "exp-a", "^metric-7-", "2024-01-24 15:02", "2024-01-24 15:05"
+    )
+    assert df_slice.columns.to_list() == [
+        "metric-7-kpi-value-max",
+        "metric-7-kpi-value-min",
+    ]
+    np.testing.assert_array_equal(
+        df_slice.to_numpy(), df.iloc[2:6, :2].to_numpy(dtype=np.float32)
+    )
+
+
+def test_invalid_pattern_is_a_bad_request(service):
+    service, _ = service
+    with pytest.raises(HTTPError) as exc_info:
+        ReadService.fetch(service.url, "exp-a", "metric-(7")
+    assert exc_info.value.code == 400
+    assert "Pattern metric-(7 is invalid" in exc_info.value.reason
+    # the service keeps serving afterwards
+    assert ReadService.fetch(service.url, "exp-a", "metric-29").shape == (10, 1)
@@ -0,0 +1,71 @@
+import numpy as np
+import pandas as pd
+
+from app.agg.agg_method import AggMethod
+from app.agg.aggregate_handler import AggregateHandler
+from app.sparse_kpis import SparseKpis
+from tests.conftest import assert_aggregated_equal, run_pipeline
+
+
+def build_kpi_list() -> list:
+    rng = np.random.default_rng(0)
+    index = pd.date_range(
+        "2024-01-24 16:00", periods=30, freq="min", name="timestamp", unit="ns"
+    )
+    kpi_list = []
+    for kpi_index in range(5):
+        # each KPI is observed in a different window as pods churn
+        rows = np.sort(rng.choice(len(index), 12 + kpi_index, replace=False))
+        kpi_list.append(
+            pd.DataFrame(
+                {f"kpi-{kpi_index}-value": rng.gamma(2, 10, len(rows))},
+                index=index[rows],
+            )
+        )
+    return kpi_list
+
+
+def test_agg_equals_wide_frame():
+    kpi_list = build_kpi_list()
+    sparse_kpis = SparseKpis.from_frames(kpi_list)
+    df_wide = pd.concat(kpi_list, axis=1, sort=True)
+    methods = [
+        "min",
+        "max",
+        "mean",
+        "median",
+        "sum",
+        "count",
+        AggregateHandler.first_quartile,
+        AggregateHandler.third_quartile,
+        AggregateHandler.percentile(0.9),
+    ]
+    columns = ["kpi-1-value", "kpi-3-value", "kpi-4-value"]
+    df_expected = df_wide[columns].agg(methods, axis=1)
+    df_actual = sparse_kpis[columns].agg(methods, axis=1)
+    pd.testing.assert_frame_equal(
+        df_actual, df_expected, check_names=False, check_freq=False
+    )
+
+
+def test_to_wide_round_trips():
+    kpi_list = build_kpi_list()
+    df_wide = pd.concat(kpi_list, axis=1, sort=True)
+    pd.testing.assert_frame_equal(
+        SparseKpis.from_frames(kpi_list).to_wide(), df_wide, check_freq=False
+    )
+
+
+def test_get_quantile():
+    assert AggMethod.get_quantile("median") == 0.5
+    assert AggMethod.get_quantile("first_quartile") == 0.25
+    assert AggMethod.get_quantile("percentile_90") == 0.9
+    assert AggMethod.get_quantile("mean") is None
+
+
+def test_sparse_separation_equals_pandas(make_dataset):
+    path_pandas = make_dataset("pandas")
+    path_sparse = make_dataset("sparse")
+    run_pipeline(path_pandas, merge=False)
+    run_pipeline(path_sparse, separator_options={"sparse": True}, merge=False)
+    assert_aggregated_equal(path_pandas, path_sparse)
@@ -0,0 +1,112 @@
+import os
+
+import pandas as pd
+import pytest
+
+from app.agg.strategy import Strategy
+from app.gcloud_aggregator import GCloudAggregator
+from app.gcloud_separator import GCloudSeparator
+from app.metric_profiler import MetricProfiler
+from app.stacked_aggregator import StackedAggregator
+from tests.conftest import (
+    EXPERIMENT,
+    FNAME_EXP_YAML,
+    FNAME_METADATA_YAML,
+    OTHER_EXPERIMENT,
+    assert_aggregated_equal,
+    build_path_experiment,
+)
+
+EXPERIMENTS = [EXPERIMENT, OTHER_EXPERIMENT]
+
+
+def aggregate_family(path_work: str, stacked: bool):
+    """Separate both experiments of the family and aggregate them."""
+    os.chdir(path_work)
+    for exp_index in range(len(EXPERIMENTS)):
+        GCloudSeparator(
+            FNAME_EXP_YAML, exp_index, strategy=Strategy.CONSIDER_POD_PHASES
+        ).separate_kpis()
+    options = dict(
+        strategy=Strategy.CONSIDER_POD_PHASES,
+        for_normal_dataset=True,
+        enforce_existing_aggregations=False,
+    )
+    if stacked:
+        StackedAggregator(
+            FNAME_EXP_YAML, FNAME_METADATA_YAML, **options
+        ).aggregate_all_metrics()
+    else:
+        for exp_index in range(len(EXPERIMENTS)):
+            GCloudAggregator(
+                FNAME_EXP_YAML, FNAME_METADATA_YAML, exp_index, **options
+            ).aggregate_all_metrics()
+
+
+def set_methods(path_work: str, handler_name: str, metric_index: int, methods: list):
+    path_aggregations = os.path.join(path_work, "aggregations", f"{handler_name}.csv")
+    aggregations = pd.read_csv(path_aggregations)
+    aggregations.loc[aggregations["index"] == metric_index, "methods"] = str(methods)
+    aggregations.to_csv(path_aggregations, index=False)
+
+
+@pytest.fixture
+def family(make_dataset, monkeypatch):
+    monkeypatch.chdir(os.getcwd())
+    return make_dataset("per_experiment", with_family=True), make_dataset(
+        "stacked", with_family=True
+    )
+
+
+def test_stacked_aggregation_equals_per_experiment(family, monkeypatch):
+    path_per_experiment, path_stacked = family
+    stacked_metrics = []
+    aggregate_stacked = StackedAggregator.aggregate_stacked
+
+    def record_stacked(self, metric_index, metric_name, aggregators):
+        stacked = aggregate_stacked(self, metric_index, metric_name, aggregators)
+        if stacked:
+            stacked_metrics.append(metric_index)
+        return stacked
+
+    monkeypatch.setattr(StackedAggregator, "aggregate_stacked", record_stacked)
+    aggregate_family(path_per_experiment, stacked=False)
+    aggregate_family(path_stacked, stacked=True)
+    # groups of the order service only exist in the first experiment
+    assert 102 in stacked_metrics
+    for experiment in EXPERIMENTS:
+        assert_aggregated_equal(
+            path_per_experiment, path_stacked, experiment=experiment
+        )
+
+
+def test_records_with_std_are_aggregated_per_experiment(family):
+    path_per_experiment, path_stacked = family
+    for path_work in family:
+        set_methods(path_work, "kubernetes", 102, ["min", "std"])
+    os.chdir(path_stacked)
+    assert not StackedAggregator.has_stackable_record(
+        102, "kubernetes.io/container/cpu/core_usage_time"
+    )
+    assert StackedAggregator.has_stackable_record(
+        115, "kubernetes.io/container/memory/used_bytes"
+    )
+    aggregate_family(path_per_experiment, stacked=False)
+    aggregate_family(path_stacked, stacked=True)
+    for experiment in EXPERIMENTS:
+        assert_aggregated_equal(
+            path_per_experiment, path_stacked, experiment=experiment
+        )
+
+
+def test_stacked_aggregation_is_profiled(family, monkeypatch):
+    _, path_stacked = family
+    monkeypatch.setenv(MetricProfiler.ENV_METRICS, "102")
+    aggregate_family(path_stacked, stacked=True)
+    assert os.path.exists(
+        os.path.join(
+            build_path_experiment(path_stacked),
+            MetricProfiler.FDNAME_PROFILES,
+            "aggregate-stacked-metric-102.prof",
+        )
+    )
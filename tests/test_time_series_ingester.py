@@ -0,0 +1,169 @@
+import glob
+import json
+import os
+
+import pandas as pd
+
+from app.gcloud_metrics import GCloudMetrics
+from app.time_series_ingester import TimeSeriesIngester
+from tests.conftest import (
+    assert_aggregated_equal,
+    build_path_experiment,
+    run_pipeline,
+)
+
+METRIC_NAME = "kubernetes.io/container/cpu/core_usage_time"
+METRIC_INDEX = 102
+
+
+def build_time_series(labels: dict, points: list, value_type: str = "DOUBLE") -> dict:
+    return {
+        "metric": {"type": METRIC_NAME, "labels": labels},
+        "resource": {"labels": {}},
+        "metricKind": "CUMULATIVE",
+        "valueType": value_type,
+        "points": [
+            {
+                "interval": {
+                    "endTime": pd.Timestamp(ts, unit="s", tz="UTC").isoformat()
+                },
+                "value": value,
+            }
+            for ts, value in points
+        ],
+    }
+
+
+def write_page(path_page: str, time_series: list):
+    with open(path_page, "w") as f:
+        json.dump({"timeSeries": time_series, "nextPageToken": "t"}, f, indent=1)
+
+
+def test_pages_are_decoded_across_chunks(tmp_path):
+    time_series = [
+        build_time_series({"pod_name": f"p{i}"}, [(60 * j, {"doubleValue": j})])
+        for i in range(3)
+        for j in range(4)
+    ]
+    path_page = str(tmp_path / "page-0.json")
+    write_page(path_page, time_series)
+    assert (
+        list(TimeSeriesIngester.iter_time_series(path_page, chunk_size=7))
+        == time_series
+    )
+
+
+def test_distribution_fields_are_packed(tmp_path):
+    path_pages = tmp_path / "pages"
+    path_pages.mkdir()
+    write_page(
+        str(path_pages / "page-0.json"),
+        [
+            build_time_series(
+                {"pod_name": "p0"},
+                [
+                    (60, {"distributionValue": {"count": "3", "mean": 2.0}}),
+                    (
+                        120,
+                        {
+                            "distributionValue": {
+                                "count": "2",
+                                "mean": 1.5,
+                                "sumOfSquaredDeviation": 0.5,
+                            }
+                        },
+                    ),
+                ],
+                value_type="DISTRIBUTION",
+            )
+        ],
+    )
+    path_raw = str(tmp_path / "raw")
+    assert TimeSeriesIngester(path_raw).ingest(str(path_pages)) == 2
+    packed_points = GCloudMetrics.read_packed_points(
+        os.path.join(path_raw, f"{GCloudMetrics.FNAME_METRIC_TYPE_PREFIX}1")
+    )
+    df_points = GCloudMetrics.slice_packed_points(packed_points, 0)
+    pd.testing.assert_frame_equal(
+        df_points,
+        pd.DataFrame(
+            {
+                "timestamp": [60, 120],
+                "count": [3.0, 2.0],
+                "mean": [2.0, 1.5],
+                # omitted fields are zero
+                "sum_of_squared_deviation": [0.0, 0.5],
+            }
+        ),
+    )
+
+
+def write_pages_of_metric(path_metric_type: str, path_pages: str, halves: list):
+    """Write raw KPIs of a metric as pages, one page per half of their points."""
+    with open(os.path.join(path_metric_type, GCloudMetrics.FNAME_KPI_MAP)) as f:
+        kpi_maps = [json.loads(line) for line in f]
+    os.makedirs(path_pages)
+    for half in halves:
+        time_series = []
+        for item in kpi_maps:
+            df_kpi = pd.read_csv(
+                os.path.join(path_metric_type, f'kpi-{item["index"]}.csv')
+            )
+            middle = len(df_kpi) // 2
+            df_half = df_kpi.iloc[:middle] if half == 0 else df_kpi.iloc[middle:]
+            time_series.append(
+                build_time_series(
+                    item["kpi"],
+                    [
+                        (ts, {"doubleValue": value})
+                        for ts, value in zip(df_half["timestamp"], df_half["value"])
+                    ],
+                )
+            )
+        write_page(os.path.join(path_pages, f"page-{half}.json"), time_series)
+
+
+def test_packed_metric_is_separated_as_its_csv(make_dataset, monkeypatch):
+    path_csv = make_dataset("csv")
+    path_packed = make_dataset("packed")
+    path_raw = os.path.join(build_path_experiment(path_packed), "gcloud_metrics")
+    path_metric_type = os.path.join(
+        path_raw, f"{GCloudMetrics.FNAME_METRIC_TYPE_PREFIX}{METRIC_INDEX}"
+    )
+    # the first half of the points, then the second half with the first again
+    write_pages_of_metric(path_metric_type, os.path.join(path_packed, "pages-0"), [0])
+    write_pages_of_metric(
+        path_metric_type, os.path.join(path_packed, "pages-1"), [0, 1]
+    )
+    for path_kpi in glob.glob(os.path.join(path_metric_type, "kpi-*.csv")):
+        os.remove(path_kpi)
+    os.remove(os.path.join(path_metric_type, GCloudMetrics.FNAME_KPI_MAP))
+    num_points = TimeSeriesIngester(path_raw).ingest(
+        os.path.join(path_packed, "pages-0")
+    )
+    assert (
+        TimeSeriesIngester(path_raw).ingest(os.path.join(path_packed, "pages-1"))
+        > num_points
+    )
+    packed_points = GCloudMetrics.read_packed_points(path_metric_type)
+    df_points = GCloudMetrics.slice_packed_points(packed_points, 0)
+    assert df_points["timestamp"].is_unique
+    assert df_points["timestamp"].is_monotonic_increasing
+
+    num_reads = []
+    read_packed_points = GCloudMetrics.read_packed_points
+
+    def record_read(path: str):
+        num_reads.append(path)
+        return read_packed_points(path)
+
+    monkeypatch.setattr(GCloudMetrics, "read_packed_points", record_read)
+    run_pipeline(path_csv, merge=False)
+    run_pipeline(path_packed, merge=False)
+    assert num_reads.count(path_metric_type) == 1
+    path_combined = os.path.join("gcloud_combined", f"metric-{METRIC_INDEX}.csv")
+    pd.testing.assert_frame_equal(
+        pd.read_csv(os.path.join(build_path_experiment(path_packed), path_combined)),
+        pd.read_csv(os.path.join(build_path_experiment(path_csv), path_combined)),
+    )
+    assert_aggregated_equal(path_csv, path_packed)